@@ -1,11 +1,12 @@
 
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
-import joblib
 import numpy as np
 import os
 import sys
 import hashlib
+import tempfile
 from datetime import datetime
 
 # Fix imports
@@ -23,6 +24,13 @@ st.set_page_config(
 
 # Constants
 RECORDS_FILE = 'data/patient_records.csv'
+# Patients shown in the Analytics 3D scatter (newest first)
+NEBULA_POINTS = 2000
+# 'queue' hands CT scans to job workers (python -m src.job_queue worker)
+CT_SCORING = os.environ.get('CT_SCORING', 'inline')
+# Largest export offered as a browser download (Streamlit holds a download
+# in memory while it is offered); bigger ones via python -m src.database export
+EXPORT_UI_MAX_MB = float(os.environ.get('EXPORT_UI_MAX_MB', 25))
 
 # Custom CSS for Hospital Theme
 def apply_custom_style():
@@ -187,7 +195,89 @@ def verify_password(password, hashed):
     return hash_password(password) == hashed
 
 # Database Integration
-from src.database import save_patient_record, load_all_records, save_appointment, load_all_appointments
+from src.database import load_all_records, search_patients, get_cohort_summary
+from src.database import find_patient_id, get_patient_history, export_records, COLUMN_MAP
+from src import write_behind
+from src import job_queue
+from src import scheduling
+from src import metrics
+from src.metrics import track
+
+# --- Cached data (shared across sessions; cleared when this session saves a record) ---
+HEADER_REFRESH_SECONDS = 15
+
+@st.cache_data(ttl=5, show_spinner=False)
+def cached_cohort_summary():
+    return get_cohort_summary()
+
+@st.cache_data(ttl=10, show_spinner=False)
+def cached_records():
+    write_behind.flush()
+    return load_all_records()
+
+@st.cache_data(ttl=10, max_entries=100, show_spinner=False)
+def cached_search(query):
+    write_behind.flush()
+    return search_patients(query, limit=200)
+
+@st.cache_data(ttl=10, max_entries=100, show_spinner=False)
+def cached_history(patient_id):
+    write_behind.flush()
+    return get_patient_history(patient_id)
+
+@st.cache_data(ttl=30, show_spinner=False)
+def cached_analytics_figures():
+    from src.analytics import AnalyticsDashboard
+    analytics = AnalyticsDashboard("")
+    cohorts = analytics.load_cohort_stats()
+    if cohorts.empty:
+        return []
+    # The 3D scatter needs individual patients; plot the most recent ones
+    recent = load_all_records(limit=NEBULA_POINTS)
+    return [analytics.get_risk_distribution(cohorts), analytics.get_risk_cluster_nebula(recent)]
+
+@st.cache_data(ttl=60, show_spinner=False)
+def cached_drift_report():
+    from src.drift import get_monitor
+    monitor = get_monitor()
+    monitor.poll()
+    return monitor.report()
+
+@st.cache_data(ttl=10, max_entries=50, show_spinner=False)
+def cached_schedule(day, view, resource):
+    view_fn = scheduling.week_view if view == "Week" else scheduling.day_view
+    return view_fn(day, resource or None)
+
+@st.cache_data(ttl=10, max_entries=50, show_spinner=False)
+def cached_free_slots(day, duration, resource):
+    return scheduling.free_slots(day, duration, resource)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def cached_ct_prediction(image_bytes):
+    import io
+    from src.image_model import predict_image
+    return predict_image(io.BytesIO(image_bytes))
+
+@st.cache_resource
+def get_chatbot():
+    from src.chatbot import DrAIChatbot
+    return DrAIChatbot()
+
+def rerun_fragment():
+    # Only valid while a fragment is rerunning on its own (not on a full
+    # script run, e.g. the first render after navigation)
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def clear_record_caches():
+    for cached in (cached_cohort_summary, cached_records, cached_search, cached_history, cached_analytics_figures):
+        cached.clear()
+
+# Optional live /metrics endpoint (METRICS_ENABLED=1 METRICS_PORT=9464)
+if metrics.ENABLED and os.environ.get('METRICS_PORT'):
+    metrics.serve_metrics(int(os.environ['METRICS_PORT']))
 
 # Initialize session state for login and flow
 if 'logged_in' not in st.session_state:
@@ -198,8 +288,6 @@ if 'patient_reg_info' not in st.session_state:
     st.session_state['patient_reg_info'] = {}
 if 'ct_result' not in st.session_state:
     st.session_state['ct_result'] = None
-if 'ct_scanning' not in st.session_state:
-    st.session_state['ct_scanning'] = False
 
 # --- Pages ---
 
@@ -234,6 +322,436 @@ def login_page():
             <div style='text-align: center; color: #64748B; font-size: 0.8em; margin-top: 20px;'>Medical Dashboard System | Authorized Use Only</div>
         """, unsafe_allow_html=True)
 
+@st.fragment(run_every=HEADER_REFRESH_SECONDS)
+def header_metrics():
+    """Live statistics, refreshed on a timer without rerunning the page."""
+    summary = cached_cohort_summary()
+    total_patients, high_risk, low_risk = summary['total'], summary['high'], summary['low']
+    high_risk_pct = (high_risk / total_patients * 100) if total_patients else 0
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1: st.metric("Total Patients", total_patients)
+    with col2: st.metric("High Risk", high_risk, delta_color="inverse")
+    with col3: st.metric("Low Risk", low_risk)
+    with col4: st.metric("Risk Rate", f"{high_risk_pct:.1f}%")
+
+@st.fragment
+def predictor_page():
+    """Registration, assessment form and result."""
+    st.markdown("### 📝 Patient Assessment")
+    model_path = 'models/lung_cancer_model.pkl'
+
+    if not os.path.exists(model_path):
+        st.error("⚠️ Model error.")
+    else:
+        # Phase 1: Registration
+        if not st.session_state['reg_complete']:
+            with st.form("reg_form"):
+                st.markdown("#### Step 1: Patient Registration")
+                r1, r2 = st.columns(2)
+                with r1:
+                    p_name = st.text_input("Full Patient Name")
+                    phone = st.text_input("Phone Number")
+                with r2:
+                    location = st.text_input("Location / Address")
+                    gender = st.selectbox("Gender", ["Male", "Female"])
+
+                age = st.slider("Patient Age", 18, 100, 50)
+
+                if st.form_submit_button("✅ Register Patient"):
+                    if not p_name or not phone:
+                        st.warning("⚠️ Please provide Patient Name and Phone Number.")
+                    else:
+                        st.session_state['patient_reg_info'] = {
+                            'Patient Name': p_name,
+                            'Phone': phone,
+                            'Location': location,
+                            'GENDER': 1 if gender == "Male" else 0,
+                            'AGE': age,
+                            'Gender_Str': gender # For display
+                        }
+                        st.session_state['reg_complete'] = True
+                        st.success(f"🎊 Patient {p_name} registered successfully!")
+                        rerun_fragment()
+
+        # Phase 2: Clinical Assessment
+        else:
+            p_info = st.session_state['patient_reg_info']
+            st.info(f"📋 Assessing: **{p_info['Patient Name']}** | {p_info['Gender_Str']}, {p_info['AGE']} yrs")
+            returning_id = find_patient_id(p_info['Patient Name'], p_info['Phone'])
+            if returning_id:
+                history = cached_history(returning_id)
+                if not history.empty:
+                    last = history.iloc[-1]
+                    st.caption(f"🔁 Returning patient {returning_id}: {len(history)} previous assessment(s), "
+                               f"last on {last['Date'][:10]} ({last['Risk']}, {last['Probability']:.1%})")
+
+            with st.form("assessment_form"):
+                st.markdown("#### Step 2: Clinical Questions")
+                smoking = st.selectbox("Smoking History", ["No", "Yes"])
+                alcohol = st.selectbox("Alcohol Consumption", ["No", "Yes"])
+
+                feat_list = ["Yellow Fingers", "Anxiety", "Peer Pressure", "Chronic Disease", "Fatigue", "Allergy", "Wheezing", "Coughing", "Shortness of Breath", "Swallowing Difficulty", "Chest Pain"]
+                user_vals = {}
+                c1, c2 = st.columns(2)
+                for i, f in enumerate(feat_list):
+                    with (c1 if i < len(feat_list)//2 else c2):
+                        user_vals[f] = st.selectbox(f, ["No", "Yes"])
+
+                col_btn1, col_btn2 = st.columns([1, 4])
+                with col_btn1:
+                    if st.form_submit_button("⬅️ Back"):
+                        st.session_state['reg_complete'] = False
+                        rerun_fragment()
+                with col_btn2:
+                    submit_asmt = st.form_submit_button("🚀 Run Risk Analysis")
+
+                if submit_asmt:
+                    from src.scoring import load_clinical_model
+                    from src.explain import get_explainer
+                    # Cached per process; reloaded only when the model file changes
+                    model = load_clinical_model(model_path)
+                    # Exact Mapping
+                    feature_mapping = {
+                        "Smoking": "SMOKING", "Yellow Fingers": "YELLOW_FINGERS", "Anxiety": "ANXIETY",
+                        "Peer Pressure": "PEER_PRESSURE", "Chronic Disease": "CHRONIC DISEASE",
+                        "Fatigue": "FATIGUE ", "Allergy": "ALLERGY ", "Wheezing": "WHEEZING",
+                        "Alcohol": "ALCOHOL CONSUMING", "Coughing": "COUGHING",
+                        "Shortness of Breath": "SHORTNESS OF BREATH", "Swallowing Difficulty": "SWALLOWING DIFFICULTY",
+                        "Chest Pain": "CHEST PAIN"
+                    }
+
+                    # Build full data row
+                    input_row = {
+                        'GENDER': p_info['GENDER'], 
+                        'AGE': p_info['AGE'], 
+                        'SMOKING': 1 if smoking=="Yes" else 0, 
+                        'ALCOHOL CONSUMING': 1 if alcohol=="Yes" else 0
+                    }
+                    for k, v in user_vals.items():
+                        input_row[feature_mapping.get(k, k.upper())] = 1 if v=="Yes" else 0
+
+                    df = pd.DataFrame([input_row])
+
+                    # Reorder columns to match the model's expected order
+                    expected_features = [
+                        'GENDER', 'AGE', 'SMOKING', 'YELLOW_FINGERS', 'ANXIETY', 
+                        'PEER_PRESSURE', 'CHRONIC DISEASE', 'FATIGUE ', 'ALLERGY ', 
+                        'WHEEZING', 'ALCOHOL CONSUMING', 'COUGHING', 
+                        'SHORTNESS OF BREATH', 'SWALLOWING DIFFICULTY', 'CHEST PAIN'
+                    ]
+                    df = df[expected_features]
+
+                    with track('predictor.inference'):
+                        pred = model.predict(df)[0]
+                        prob = model.predict_proba(df)[0][1]
+
+                    # Per-feature contributions to this probability
+                    explanation = get_explainer(model_path).explain(df, top=6)[0]
+
+                    # Save result to session state to show outside form
+                    st.session_state['last_result'] = {
+                        'pred': pred,
+                        'prob': prob,
+                        'p_name': p_info['Patient Name'],
+                        'contributions': explanation['contributions']
+                    }
+
+                    # Save to DB
+                    final_record = {
+                        **p_info,
+                        **input_row,
+                        'Risk': 'High' if pred==1 else 'Low',
+                        'Probability': prob
+                    }
+                    final_record.pop('Gender_Str', None)
+                    # Queued for the background writer; the result shows without waiting on disk
+                    if write_behind.submit_patient_record(final_record):
+                        clear_record_caches()
+                        st.toast("✅ Record archived successfully.")
+                    else:
+                        st.session_state['save_error'] = "Record could not be saved to the database. Please try again."
+                    rerun_fragment()
+
+            # Display Results Outside Form
+            save_error = st.session_state.pop('save_error', None)
+            if save_error:
+                st.error(save_error)
+            if 'last_result' in st.session_state:
+                res = st.session_state['last_result']
+                st.divider()
+                if res['pred'] == 1: 
+                    st.markdown(f"""
+                        <div style='background-color: #E76F51; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(231, 111, 81, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #FFFFFF;'>
+                            <span style='background: white; color: #E76F51; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>🚨 CRITICAL: HIGH RISK</span> Patient Assessment Result
+                            <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
+                        </div>
+                    """, unsafe_allow_html=True)
+                elif res['prob'] > 0.4:
+                    st.markdown(f"""
+                        <div style='background-color: #6C757D; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(108, 117, 125, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #ADB5BD;'>
+                            <span style='background: white; color: #6C757D; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>⚠️ WARNING: MEDIUM RISK</span> Patient Assessment Result
+                            <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
+                        </div>
+                    """, unsafe_allow_html=True)
+                else: 
+                    st.markdown(f"""
+                        <div style='background-color: #6A994E; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(106, 153, 78, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #FFFFFF;'>
+                            <span style='background: white; color: #6A994E; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>✅ STABLE: LOW RISK</span> Patient Assessment Result
+                            <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
+                        </div>
+                    """, unsafe_allow_html=True)
+
+                if res.get('contributions'):
+                    from src.explain import format_contributions
+                    st.markdown("#### 🔍 Key Contributing Factors")
+                    st.caption("Change in predicted risk attributed to each answer (percentage points).")
+                    st.dataframe(format_contributions(res['contributions']), hide_index=True, use_container_width=True)
+
+                if st.button("🔄 Start New Assessment"):
+                    st.session_state['reg_complete'] = False
+                    st.session_state['patient_reg_info'] = {}
+                    del st.session_state['last_result']
+                    rerun_fragment()
+
+@st.fragment
+def archive_page():
+    """Patient table and search."""
+    st.markdown("### 📂 Patient Records")
+    query = st.text_input("🔍 Search patients", placeholder="Name, phone, location or patient ID")
+    if query.strip():
+        matches = cached_search(query.strip())
+        st.caption(f"{len(matches)} matching record(s)" + (" (showing first 200)" if len(matches) == 200 else ""))
+        st.dataframe(matches, use_container_width=True)
+    else:
+        st.dataframe(cached_records(), use_container_width=True)
+
+    export_panel(query.strip())
+
+    patient_id = st.text_input("🧾 Patient history", placeholder="Patient ID, e.g. P000042").strip().upper()
+    if patient_id:
+        history = cached_history(patient_id)
+        if history.empty:
+            st.caption(f"No visits found for {patient_id}.")
+        else:
+            st.caption(f"{len(history)} visit(s) for {history['Patient Name'].iloc[-1]}")
+            st.line_chart(history.set_index('Date')['Probability'], height=220)
+            st.dataframe(history, use_container_width=True, hide_index=True)
+
+def export_panel(query):
+    """Streams the filtered archive to a file, then offers it for download."""
+    with st.expander("⬇️ Export records"):
+        st.caption("Applies the search above" if query else "All records, or filter below")
+        e1, e2, e3, e4 = st.columns(4)
+        fmt = e1.selectbox("Format", ["csv.gz", "csv", "parquet"])
+        start_date = e2.date_input("From", value=None)
+        end_date = e3.date_input("To", value=None)
+        risk = e4.selectbox("Risk", ["All", "High", "Low"])
+        columns = st.multiselect("Columns", list(COLUMN_MAP.values()), default=list(COLUMN_MAP.values()))
+        include_archive = st.checkbox("Include archived years")
+        if st.button("📦 Prepare export", disabled=not columns):
+            discard_export()
+            write_behind.flush()
+            fd, path = tempfile.mkstemp(prefix='patients_export_', suffix='.' + fmt)
+            os.close(fd)
+            try:
+                with st.spinner("Exporting..."):
+                    rows = export_records(path, fmt, columns, query or None, start_date, end_date,
+                                          None if risk == "All" else risk, include_archive)
+                size_mb = os.path.getsize(path) / 1e6
+                if size_mb > EXPORT_UI_MAX_MB:
+                    os.remove(path)
+                    st.error(f"{rows} records ({size_mb:.0f} MB) is too large to download here; "
+                             f"use python -m src.database export.")
+                else:
+                    # Only the path is kept; the file is read when the button is drawn
+                    st.session_state['export'] = (f"patients_{datetime.now():%Y%m%d_%H%M}.{fmt}", path, rows)
+            except Exception as e:
+                os.remove(path)
+                st.error(f"Export Error: {e}")
+        export = st.session_state.get('export')
+        if export and os.path.exists(export[1]):
+            name, path, rows = export
+            with open(path, 'rb') as f:
+                st.download_button(f"⬇️ Download {name} ({rows} records)", f, file_name=name,
+                                   on_click=discard_export)
+
+def discard_export():
+    # Temp file of this session's last export: removed once downloaded or replaced
+    export = st.session_state.pop('export', None)
+    if export and os.path.exists(export[1]):
+        os.remove(export[1])
+
+@st.fragment
+def analytics_page():
+    """Cohort charts."""
+    st.markdown("### 📊 Analytics")
+    figures = cached_analytics_figures()
+    if figures:
+        with track('analytics.render'):
+            for fig in figures:
+                st.plotly_chart(fig, use_container_width=True)
+
+    drift = cached_drift_report()
+    alerts = drift.get('alerts', [])
+    with st.expander("🧭 Input drift vs. training data" + (f" — ⚠️ {', '.join(alerts)}" if alerts else "")):
+        if 'error' in drift:
+            st.caption(drift['error'])
+        else:
+            st.caption(f"Last {drift['window_rows']} assessments. PSI above 0.1 is a moderate shift, above 0.25 significant.")
+            st.dataframe(pd.DataFrame(drift['rows']), hide_index=True, use_container_width=True)
+
+@st.fragment(run_every=1)
+def ct_job_status():
+    """Polls the queued CT job; shows the result once a worker finishes it."""
+    job = job_queue.get_job(st.session_state['ct_job'])
+    if job is None or job['status'] in ('queued', 'running'):
+        state = job['status'] if job else 'missing'
+        st.info(f"🔍 Scan {state} (job #{st.session_state['ct_job']}); waiting for a scoring worker...")
+        return
+    del st.session_state['ct_job']
+    if job['status'] == 'done':
+        st.session_state['ct_result'] = job['result']['probability']
+    else:
+        st.session_state['ct_job_error'] = job['error']
+    st.rerun()
+
+@st.fragment
+def ct_scan_page():
+    """Scan upload, prediction and result panel."""
+    st.markdown("### 🖼️ CT Imaging Analysis")
+    uploaded_file = st.file_uploader("Upload Medical Scan (CT/X-Ray)", type=["jpg", "png", "jpeg"])
+
+    if uploaded_file:
+        st.image(uploaded_file, caption="Uploaded Scan for Analysis", width=500)
+
+        # Reset result if a new file is uploaded (optional logic)
+        # if 'uploaded_file_name' in st.session_state and st.session_state['uploaded_file_name'] != uploaded_file.name:
+        #     st.session_state['ct_result'] = None
+        # st.session_state['uploaded_file_name'] = uploaded_file.name
+
+        if st.button("🚀 Execute Diagnostic Scan"):
+            st.session_state['ct_error'] = None
+            if CT_SCORING == 'queue':
+                import base64
+                st.session_state['ct_job_error'] = None
+                st.session_state['ct_result'] = None
+                # Interactive scans go ahead of queued archive batches
+                st.session_state['ct_job'] = job_queue.enqueue(
+                    'ct_score', {'image_b64': base64.b64encode(uploaded_file.getvalue()).decode()}, priority=10)
+            else:
+                with st.spinner("🔍 AI Analysis in progress..."):
+                    import time
+                    from src.image_model import ScanTooLarge
+
+                    time.sleep(2)
+                    # Run actual prediction (cached per file content)
+                    try:
+                        st.session_state['ct_result'] = cached_ct_prediction(uploaded_file.getvalue())
+                    except ScanTooLarge as e:
+                        st.session_state['ct_error'] = str(e)
+                        st.session_state['ct_result'] = None
+
+        if st.session_state.get('ct_job'):
+            ct_job_status()
+
+        if st.session_state.get('ct_error'):
+            st.error(f"⚠️ Scan too large to analyse: {st.session_state['ct_error']}")
+        if st.session_state.get('ct_job_error'):
+            st.error(f"⚠️ Scan could not be scored: {st.session_state['ct_job_error']}")
+
+        # Display Persistent Result
+        if st.session_state.get('ct_result') is not None:
+            prob = st.session_state['ct_result']
+            st.divider()
+
+            # Level Classification Logic
+            if prob > 0.7:
+                level = "HIGH LEVEL"
+                desc = "Critical malignant signatures detected. Immediate specialist intervention required."
+                color = "#E76F51" # Soft Red
+                icon = "🚨"
+            elif prob > 0.4:
+                level = "MEDIUM LEVEL"
+                desc = "Suspicious radiographic signatures identified. Further diagnostic screening recommended."
+                color = "#F59E0B" # Amber
+                icon = "⚠️"
+            else:
+                level = "LOW LEVEL"
+                desc = "Benign study. No immediate malignant indicators found. Regular follow-up protocol suggested."
+                color = "#6A994E" # Muted Green
+                icon = "✅"
+
+            st.markdown(f"""
+                <div style='background-color: {color}; color: #ffffff; padding: 25px; border-radius: 12px; box-shadow: 0 15px 30px rgba(0,0,0,0.1); font-weight: bold; border-left: 10px solid #FFFFFF;'>
+                    <div style='font-size: 0.9em; text-transform: uppercase; margin-bottom: 5px; opacity: 0.9;'>Diagnostic Analysis Result</div>
+                    <div style='font-size: 26px;'>{icon} {level}: {prob:.1%} Match</div>
+                    <div style='margin-top: 10px; font-weight: 500; font-size: 14px;'>{desc}</div>
+                </div>
+            """, unsafe_allow_html=True)
+
+            if st.button("🗑️ Clear Result"):
+                st.session_state['ct_result'] = None
+                rerun_fragment()
+
+@st.fragment
+def schedule_page():
+    """Appointments for the visible day or week, and booking into free slots."""
+    st.markdown("### 🗓️ Appointments")
+    c1, c2, c3 = st.columns([2, 1, 2])
+    day = c1.date_input("Date", value=datetime.now().date())
+    view = c2.radio("View", ["Day", "Week"], horizontal=True)
+    resource = c3.text_input("Resource", value="clinic").strip()
+
+    appts = cached_schedule(day, view, resource)
+    if appts.empty:
+        st.caption(f"No appointments this {view.lower()}.")
+    else:
+        st.dataframe(appts.drop(columns=['start_min']), use_container_width=True, hide_index=True)
+
+    msg = st.session_state.pop('schedule_msg', None)
+    if msg:
+        getattr(st, msg[0])(msg[1])
+
+    with st.expander("➕ Book appointment", expanded=False):
+        b1, b2 = st.columns(2)
+        name = b1.text_input("Patient name")
+        patient_id = b2.text_input("Patient ID (optional)").strip().upper() or None
+        duration = b1.selectbox("Duration (min)", [15, 30, 45, 60], index=1)
+        appt_type = b2.selectbox("Type", ["Consultation", "Screening", "CT Scan", "Follow-up"])
+        slots = cached_free_slots(day, duration, resource or 'clinic')
+        if not slots:
+            st.caption(f"No free {duration}-minute slots on {day:%Y-%m-%d}.")
+        else:
+            start = st.selectbox("Start", slots, format_func=lambda t: t.strftime("%H:%M"))
+            if st.button("📅 Book", disabled=not name):
+                try:
+                    scheduling.book(name, start, duration, appt_type, resource or 'clinic', patient_id)
+                    st.session_state['schedule_msg'] = ('success', f"Booked {name} at {start:%Y-%m-%d %H:%M}.")
+                except scheduling.SlotConflict as e:
+                    st.session_state['schedule_msg'] = ('error', f"Slot taken meanwhile: {e}")
+                cached_schedule.clear()
+                cached_free_slots.clear()
+                rerun_fragment()
+
+@st.fragment
+def chat_page():
+    """Dr. AI chat."""
+    st.markdown("### 🤖 Dr. AI Assistant")
+    if query := st.chat_input("Ask Dr. AI..."):
+        with st.chat_message("user"): st.write(query)
+        with st.chat_message("assistant"):
+            st.write(get_chatbot().get_response(query))
+
+PAGES = {
+    "Predictor": predictor_page,
+    "Archive": archive_page,
+    "Analytics": analytics_page,
+    "CT Scan": ct_scan_page,
+    "Schedule": schedule_page,
+    "Dr. AI": chat_page
+}
+
 def main_app():
     apply_custom_style()
     
@@ -243,21 +761,8 @@ def main_app():
         </div>
     """, unsafe_allow_html=True)
     
-    # Live Statistics
-    records = load_all_records()
-    if not records.empty:
-        total_patients = len(records)
-        high_risk = len(records[records['Risk'] == 'High'])
-        low_risk = len(records[records['Risk'] == 'Low'])
-        high_risk_pct = (high_risk / total_patients * 100)
-    else:
-        total_patients, high_risk, low_risk, high_risk_pct = 0, 0, 0, 0
-
-    col1, col2, col3, col4 = st.columns(4)
-    with col1: st.metric("Total Patients", total_patients)
-    with col2: st.metric("High Risk", high_risk, delta_color="inverse")
-    with col3: st.metric("Low Risk", low_risk)
-    with col4: st.metric("Risk Rate", f"{high_risk_pct:.1f}%")
+    # Live Statistics (from the materialized cohort aggregates)
+    header_metrics()
 
     st.sidebar.markdown("### 👨‍⚕️ Medical Menu")
     menu_options = {
@@ -275,245 +780,16 @@ def main_app():
         st.rerun()
     
     # --- Content ---
-    if choice == "Predictor":
-        st.markdown("### 📝 Patient Assessment")
-        model_path = 'models/lung_cancer_model.pkl'
-        
-        if not os.path.exists(model_path):
-            st.error("⚠️ Model error.")
-        else:
-            # Phase 1: Registration
-            if not st.session_state['reg_complete']:
-                with st.form("reg_form"):
-                    st.markdown("#### Step 1: Patient Registration")
-                    r1, r2 = st.columns(2)
-                    with r1:
-                        p_name = st.text_input("Full Patient Name")
-                        phone = st.text_input("Phone Number")
-                    with r2:
-                        location = st.text_input("Location / Address")
-                        gender = st.selectbox("Gender", ["Male", "Female"])
-                    
-                    age = st.slider("Patient Age", 18, 100, 50)
-                    
-                    if st.form_submit_button("✅ Register Patient"):
-                        if not p_name or not phone:
-                            st.warning("⚠️ Please provide Patient Name and Phone Number.")
-                        else:
-                            st.session_state['patient_reg_info'] = {
-                                'Patient Name': p_name,
-                                'Phone': phone,
-                                'Location': location,
-                                'GENDER': 1 if gender == "Male" else 0,
-                                'AGE': age,
-                                'Gender_Str': gender # For display
-                            }
-                            st.session_state['reg_complete'] = True
-                            st.success(f"🎊 Patient {p_name} registered successfully!")
-                            st.rerun()
-            
-            # Phase 2: Clinical Assessment
-            else:
-                p_info = st.session_state['patient_reg_info']
-                st.info(f"📋 Assessing: **{p_info['Patient Name']}** | {p_info['Gender_Str']}, {p_info['AGE']} yrs")
-                
-                with st.form("assessment_form"):
-                    st.markdown("#### Step 2: Clinical Questions")
-                    smoking = st.selectbox("Smoking History", ["No", "Yes"])
-                    alcohol = st.selectbox("Alcohol Consumption", ["No", "Yes"])
-                    
-                    feat_list = ["Yellow Fingers", "Anxiety", "Peer Pressure", "Chronic Disease", "Fatigue", "Allergy", "Wheezing", "Coughing", "Shortness of Breath", "Swallowing Difficulty", "Chest Pain"]
-                    user_vals = {}
-                    c1, c2 = st.columns(2)
-                    for i, f in enumerate(feat_list):
-                        with (c1 if i < len(feat_list)//2 else c2):
-                            user_vals[f] = st.selectbox(f, ["No", "Yes"])
-                    
-                    col_btn1, col_btn2 = st.columns([1, 4])
-                    with col_btn1:
-                        if st.form_submit_button("⬅️ Back"):
-                            st.session_state['reg_complete'] = False
-                            st.rerun()
-                    with col_btn2:
-                        submit_asmt = st.form_submit_button("🚀 Run Risk Analysis")
-
-                    if submit_asmt:
-                        model = joblib.load(model_path)
-                        # Exact Mapping
-                        feature_mapping = {
-                            "Smoking": "SMOKING", "Yellow Fingers": "YELLOW_FINGERS", "Anxiety": "ANXIETY",
-                            "Peer Pressure": "PEER_PRESSURE", "Chronic Disease": "CHRONIC DISEASE",
-                            "Fatigue": "FATIGUE ", "Allergy": "ALLERGY ", "Wheezing": "WHEEZING",
-                            "Alcohol": "ALCOHOL CONSUMING", "Coughing": "COUGHING",
-                            "Shortness of Breath": "SHORTNESS OF BREATH", "Swallowing Difficulty": "SWALLOWING DIFFICULTY",
-                            "Chest Pain": "CHEST PAIN"
-                        }
-                        
-                        # Build full data row
-                        input_row = {
-                            'GENDER': p_info['GENDER'], 
-                            'AGE': p_info['AGE'], 
-                            'SMOKING': 1 if smoking=="Yes" else 0, 
-                            'ALCOHOL CONSUMING': 1 if alcohol=="Yes" else 0
-                        }
-                        for k, v in user_vals.items():
-                            input_row[feature_mapping.get(k, k.upper())] = 1 if v=="Yes" else 0
-                        
-                        df = pd.DataFrame([input_row])
-                        
-                        # Reorder columns to match the model's expected order
-                        expected_features = [
-                            'GENDER', 'AGE', 'SMOKING', 'YELLOW_FINGERS', 'ANXIETY', 
-                            'PEER_PRESSURE', 'CHRONIC DISEASE', 'FATIGUE ', 'ALLERGY ', 
-                            'WHEEZING', 'ALCOHOL CONSUMING', 'COUGHING', 
-                            'SHORTNESS OF BREATH', 'SWALLOWING DIFFICULTY', 'CHEST PAIN'
-                        ]
-                        df = df[expected_features]
-                        
-                        pred = model.predict(df)[0]
-                        prob = model.predict_proba(df)[0][1]
-                        
-                        # Save result to session state to show outside form
-                        st.session_state['last_result'] = {
-                            'pred': pred,
-                            'prob': prob,
-                            'p_name': p_info['Patient Name']
-                        }
-                        
-                        # Save to DB
-                        final_record = {
-                            **p_info,
-                            **input_row,
-                            'Risk': 'High' if pred==1 else 'Low',
-                            'Probability': prob
-                        }
-                        final_record.pop('Gender_Str', None)
-                        save_patient_record(final_record)
-                        st.toast("✅ Record archived successfully.")
-                        st.rerun()
-
-                # Display Results Outside Form
-                if 'last_result' in st.session_state:
-                    res = st.session_state['last_result']
-                    st.divider()
-                    if res['pred'] == 1: 
-                        st.markdown(f"""
-                            <div style='background-color: #E76F51; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(231, 111, 81, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #FFFFFF;'>
-                                <span style='background: white; color: #E76F51; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>🚨 CRITICAL: HIGH RISK</span> Patient Assessment Result
-                                <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    elif res['prob'] > 0.4:
-                        st.markdown(f"""
-                            <div style='background-color: #6C757D; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(108, 117, 125, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #ADB5BD;'>
-                                <span style='background: white; color: #6C757D; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>⚠️ WARNING: MEDIUM RISK</span> Patient Assessment Result
-                                <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    else: 
-                        st.markdown(f"""
-                            <div style='background-color: #6A994E; color: #ffffff; padding: 20px; border-radius: 12px; box-shadow: 0 10px 20px rgba(106, 153, 78, 0.2); font-weight: bold; font-size: 16px; border-left: 8px solid #FFFFFF;'>
-                                <span style='background: white; color: #6A994E; padding: 4px 12px; border-radius: 6px; margin-right: 12px;'>✅ STABLE: LOW RISK</span> Patient Assessment Result
-                                <div style='font-size: 28px; margin-top: 10px; color: #FFFFFF;'>Probability: {res['prob']:.1%}</div>
-                            </div>
-                        """, unsafe_allow_html=True)
-                    
-                    if st.button("🔄 Start New Assessment"):
-                        st.session_state['reg_complete'] = False
-                        st.session_state['patient_reg_info'] = {}
-                        del st.session_state['last_result']
-                        st.rerun()
-
-    elif choice == "Archive":
-        st.markdown("### 📂 Patient Records")
-        st.dataframe(load_all_records(), use_container_width=True)
-
-    elif choice == "Analytics":
-        st.markdown("### 📊 Analytics")
-        from src.analytics import AnalyticsDashboard
-        analytics = AnalyticsDashboard("")
-        if not records.empty:
-            st.plotly_chart(analytics.get_risk_distribution(records), use_container_width=True)
-            st.plotly_chart(analytics.get_risk_cluster_nebula(records), use_container_width=True)
-
-    elif choice == "CT Scan":
-        st.markdown("### 🖼️ CT Imaging Analysis")
-        uploaded_file = st.file_uploader("Upload Medical Scan (CT/X-Ray)", type=["jpg", "png", "jpeg"])
-        
-        if uploaded_file:
-            st.image(uploaded_file, caption="Uploaded Scan for Analysis", width=500)
-            
-            # Reset result if a new file is uploaded (optional logic)
-            # if 'uploaded_file_name' in st.session_state and st.session_state['uploaded_file_name'] != uploaded_file.name:
-            #     st.session_state['ct_result'] = None
-            # st.session_state['uploaded_file_name'] = uploaded_file.name
-
-            if st.button("🚀 Execute Diagnostic Scan"):
-                st.session_state['ct_scanning'] = True
-                st.rerun()
-
-            if st.session_state.get('ct_scanning'):
-                with st.spinner("🔍 AI Analysis in progress..."):
-                    import time
-                    from src.image_model import predict_image
-                    
-                    time.sleep(2)
-                    # Run actual prediction
-                    prob = predict_image(uploaded_file)
-                    st.session_state['ct_result'] = prob
-                
-                st.session_state['ct_scanning'] = False
-                st.rerun()
-
-            # Display Persistent Result
-            if st.session_state.get('ct_result') is not None:
-                prob = st.session_state['ct_result']
-                st.divider()
-                
-                # Level Classification Logic
-                if prob > 0.7:
-                    level = "HIGH LEVEL"
-                    desc = "Critical malignant signatures detected. Immediate specialist intervention required."
-                    color = "#E76F51" # Soft Red
-                    icon = "🚨"
-                elif prob > 0.4:
-                    level = "MEDIUM LEVEL"
-                    desc = "Suspicious radiographic signatures identified. Further diagnostic screening recommended."
-                    color = "#F59E0B" # Amber
-                    icon = "⚠️"
-                else:
-                    level = "LOW LEVEL"
-                    desc = "Benign study. No immediate malignant indicators found. Regular follow-up protocol suggested."
-                    color = "#6A994E" # Muted Green
-                    icon = "✅"
-
-                st.markdown(f"""
-                    <div style='background-color: {color}; color: #ffffff; padding: 25px; border-radius: 12px; box-shadow: 0 15px 30px rgba(0,0,0,0.1); font-weight: bold; border-left: 10px solid #FFFFFF;'>
-                        <div style='font-size: 0.9em; text-transform: uppercase; margin-bottom: 5px; opacity: 0.9;'>Diagnostic Analysis Result</div>
-                        <div style='font-size: 26px;'>{icon} {level}: {prob:.1%} Match</div>
-                        <div style='margin-top: 10px; font-weight: 500; font-size: 14px;'>{desc}</div>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                if st.button("🗑️ Clear Result"):
-                    st.session_state['ct_result'] = None
-                    st.rerun()
-
-    elif choice == "Schedule":
-        st.markdown("### 🗓️ Appointments")
-        appts = load_all_appointments()
-        st.dataframe(appts, use_container_width=True)
-
-    elif choice == "Dr. AI":
-        st.markdown("### 🤖 Dr. AI Assistant")
-        if query := st.chat_input("Ask Dr. AI..."):
-            with st.chat_message("user"): st.write(query)
-            with st.chat_message("assistant"):
-                from src.chatbot import DrAIChatbot
-                st.write(DrAIChatbot().get_response(query))
+    # Each page is a fragment: its own widgets rerun only that page
+    PAGES[choice]()
 
     st.markdown("<div style='text-align: center; color: #64748B; font-size: 0.8em; margin-top: 20px;'>Medical Dashboard System | 2026</div>", unsafe_allow_html=True)
 
+    # Dump collected timings after every rerun
+    if metrics.ENABLED:
+        metrics.export_prometheus()
+
 if __name__ == "__main__":
-    if not st.session_state.get('logged_in'): login_page()
-    else: main_app()
\ No newline at end of file
+    with track('app.rerun'):
+        if not st.session_state.get('logged_in'): login_page()
+        else: main_app()
\ No newline at end of file
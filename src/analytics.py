@@ -2,23 +2,40 @@
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+from src.metrics import timed
+
+# Chart methods accept either raw patient rows or the materialized cohort
+# aggregates from database.load_cohort_stats() (one row per cohort with a
+# 'Count' column), so page cost does not grow with the archive.
+def _is_aggregated(df):
+    return 'Count' in df.columns
 
 class AnalyticsDashboard:
     def __init__(self, data_path):
         self.data_path = data_path
         
+    @timed('analytics.load_data')
     def load_data(self):
         try:
             return pd.read_csv(self.data_path)
         except Exception:
             return pd.DataFrame()
 
+    @timed('analytics.load_cohort_stats')
+    def load_cohort_stats(self):
+        from src.database import load_cohort_stats
+        return load_cohort_stats()
+
+    @timed('analytics.get_risk_distribution')
     def get_risk_distribution(self, df):
         if df.empty or 'Risk' not in df.columns:
             return None
         
         # Count risk levels
-        risk_counts = df['Risk'].value_counts().reset_index()
+        if _is_aggregated(df):
+            risk_counts = df.groupby('Risk')['Count'].sum().reset_index()
+        else:
+            risk_counts = df['Risk'].value_counts().reset_index()
         risk_counts.columns = ['Risk Level', 'Count']
         
         fig = px.pie(
@@ -33,17 +50,29 @@ class AnalyticsDashboard:
         fig.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color='#f1f5f9')
         return fig
 
+    @timed('analytics.get_age_distribution')
     def get_age_distribution(self, df):
-        if df.empty or 'AGE' not in df.columns:
+        if df.empty or ('AGE' not in df.columns and 'Age Band' not in df.columns):
             return None
             
-        fig = px.histogram(
-            df, 
-            x='AGE', 
-            nbins=20,
-            title='Patient Age Demographics',
-            color_discrete_sequence=['#3b82f6']
-        )
+        if _is_aggregated(df):
+            fig = px.histogram(
+                df,
+                x='Age Band',
+                y='Count',
+                histfunc='sum',
+                nbins=20,
+                title='Patient Age Demographics',
+                color_discrete_sequence=['#3b82f6']
+            )
+        else:
+            fig = px.histogram(
+                df, 
+                x='AGE', 
+                nbins=20,
+                title='Patient Age Demographics',
+                color_discrete_sequence=['#3b82f6']
+            )
         fig.update_layout(
             paper_bgcolor='rgba(0,0,0,0)', 
             plot_bgcolor='rgba(0,0,0,0)', 
@@ -53,6 +82,7 @@ class AnalyticsDashboard:
         )
         return fig
         
+    @timed('analytics.get_gender_risk_comparison')
     def get_gender_risk_comparison(self, df):
         if df.empty or 'GENDER' not in df.columns or 'Risk' not in df.columns:
             return None
@@ -64,6 +94,8 @@ class AnalyticsDashboard:
         fig = px.histogram(
             df_plot,
             x='Gender Label',
+            y='Count' if _is_aggregated(df_plot) else None,
+            histfunc='sum' if _is_aggregated(df_plot) else 'count',
             color='Risk',
             barmode='group',
             title='Risk Assessment by Gender',
@@ -76,9 +108,16 @@ class AnalyticsDashboard:
         )
         return fig
 
+    @timed('analytics.get_key_stats')
     def get_key_stats(self, df):
         if df.empty:
             return 0, 0, 0.0
+        
+        if _is_aggregated(df):
+            total_patients = int(df['Count'].sum())
+            high_risk = int(df.loc[df['Risk'] == 'High', 'Count'].sum())
+            avg_prob = df['Probability Sum'].sum() / total_patients if total_patients else 0.0
+            return total_patients, high_risk, avg_prob
             
         total_patients = len(df)
         high_risk = len(df[df['Risk'] == 'High']) if 'Risk' in df.columns else 0
@@ -91,6 +130,7 @@ class AnalyticsDashboard:
         
         return total_patients, high_risk, avg_prob
 
+    @timed('analytics.get_risk_cluster_nebula')
     def get_risk_cluster_nebula(self, df):
         if df.empty or 'Risk' not in df.columns or 'Probability' not in df.columns:
             return None
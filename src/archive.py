@@ -0,0 +1,225 @@
+# Time-Partitioned Archival and Compaction of Patient Records
+#
+# Patient rows older than ARCHIVE_AFTER_DAYS move out of the live database
+# into one SQLite file per year (data/archive/patients_2024.db, same columns
+# and ids), so the hot file stays small enough to sit in the page cache.
+# database.connect_with_archive() attaches the years behind a TEMP view
+# 'all_patients' for historical queries; patient history reads through it.
+# What stays whole-history without reading the archive: cohort_stats (each
+# run first folds every live row into the aggregates, and only rows already
+# counted are moved; archival never subtracts them), patient identities, and
+# the drift monitor's window (polled before rows move). Name search covers
+# the live table only.
+# Freed pages are returned with incremental vacuum (a bounded number of
+# pages per run) and planner statistics refreshed with a size-limited ANALYZE.
+#   python -m src.archive run [--days 730] [--vacuum-pages 2000]
+#   python -m src.archive status
+#   python -m src.archive watch --interval 86400
+# or enqueue a 'maintenance' job for a src.job_queue worker.
+import os
+import time
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+
+from src import database
+from src.metrics import timed
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+# Rows moved per transaction (the write lock is held for one batch)
+BATCH_ROWS = 20000
+# Free pages returned to the OS per maintenance run
+VACUUM_PAGES = int(os.environ.get('ARCHIVE_VACUUM_PAGES', 2000))
+# Rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = 1000
+BUSY_TIMEOUT = 30.0
+
+
+def _connect():
+    return sqlite3.connect(database.DB_FILE, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+def _prepare_year(conn, year):
+    # Attach (creating if needed) the year's file with the live table's schema
+    os.makedirs(database.ARCHIVE_DIR, exist_ok=True)
+    alias = f"archive_{year}"
+    conn.execute("ATTACH DATABASE ? AS ?", (os.path.join(database.ARCHIVE_DIR, f"patients_{year}.db"), alias))
+    sql = conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = 'patients'").fetchone()[0]
+    conn.execute(sql.replace("CREATE TABLE patients", f"CREATE TABLE IF NOT EXISTS {alias}.patients", 1))
+    # Columns added to the live table since the file was created
+    present = {row[1] for row in conn.execute(f"PRAGMA {alias}.table_info(patients)")}
+    for _, name, col_type, _, _, _ in conn.execute("PRAGMA main.table_info(patients)").fetchall():
+        if name not in present:
+            conn.execute(f"ALTER TABLE {alias}.patients ADD COLUMN {name} {col_type}")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_patients_patient_id ON patients (patient_id, date)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_patients_date ON patients (date)")
+    return alias
+
+
+@timed('archive.archive_old_records')
+def archive_old_records(horizon_days=ARCHIVE_AFTER_DAYS, batch=BATCH_ROWS):
+    """
+    Moves patient rows dated more than 'horizon_days' ago into their year's
+    archive file, 'batch' rows per pass, in one pass over the live table by
+    id. Returns {year: rows moved}.
+    The aggregates and the drift monitor catch up first, and rows saved
+    after that are left for the next run, so no row leaves the live table
+    uncounted. Within a batch, years are attached database.MAX_ATTACHED at a time;
+    each group's copy and delete share a transaction. Under WAL a crash
+    between the two files' commits can leave a row in both, and the next
+    run (INSERT OR IGNORE, then delete) settles it.
+    """
+    cutoff = (datetime.now() - timedelta(days=horizon_days)).strftime("%Y-%m-%d %H:%M:%S")
+    database.refresh_cohort_stats()
+    try:
+        from src.drift import get_monitor
+        get_monitor().poll()
+    except Exception as e:
+        print(f"Drift monitor not updated before archiving: {e}")
+    conn = _connect()
+    moved = {}
+    last_id = 0
+    try:
+        counted_id = conn.execute("SELECT last_id FROM cohort_watermark WHERE id = 1").fetchone()[0]
+        columns = ', '.join(row[1] for row in conn.execute("PRAGMA main.table_info(patients)"))
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY, year INTEGER)")
+        while True:
+            # Dated rows only: '' and free text sort below any cutoff
+            rows = conn.execute('''
+                SELECT id, CAST(substr(date, 1, 4) AS INTEGER) FROM patients
+                WHERE id > ? AND id <= ? AND date < ? AND date GLOB '[0-9][0-9][0-9][0-9]-*'
+                ORDER BY id LIMIT ?
+            ''', (last_id, counted_id, cutoff, batch)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            years = sorted({year for _, year in rows})
+            for start in range(0, len(years), database.MAX_ATTACHED):
+                _move_years(conn, columns, rows, years[start:start + database.MAX_ATTACHED])
+            for _, year in rows:
+                moved[year] = moved.get(year, 0) + 1
+        return moved
+    finally:
+        conn.close()
+
+
+def _move_years(conn, columns, rows, years):
+    # Copies this batch's rows of 'years' to their archive files and deletes them from the live table
+    aliases = {}
+    try:
+        for year in years:
+            aliases[year] = _prepare_year(conn, year)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM temp.archive_batch")
+        conn.executemany("INSERT INTO temp.archive_batch (id, year) VALUES (?, ?)",
+                         [row for row in rows if row[1] in aliases])
+        for year, alias in aliases.items():
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {alias}.patients ({columns})
+                SELECT {columns} FROM main.patients
+                WHERE id IN (SELECT id FROM temp.archive_batch WHERE year = ?)
+            ''', (year,))
+        conn.execute("DELETE FROM main.patients WHERE id IN (SELECT id FROM temp.archive_batch)")
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        for alias in aliases.values():
+            conn.execute(f"DETACH DATABASE {alias}")
+
+
+@timed('archive.compact')
+def compact(pages=VACUUM_PAGES):
+    """
+    Returns up to 'pages' free pages to the OS and refreshes planner
+    statistics. A database created before incremental auto-vacuum was
+    enabled is converted once with a full VACUUM (it rewrites the file and
+    holds the write lock while it does). Returns a dict of page counts.
+    """
+    conn = _connect()
+    try:
+        free_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            print("Converting the database to incremental auto-vacuum (one-time full VACUUM)...")
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        else:
+            # executescript steps the pragma to completion (execute() frees one page)
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        conn.execute("ANALYZE")
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            # The main file only shrinks once the WAL is checkpointed
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return {
+            'free_pages_before': free_before,
+            'free_pages_after': conn.execute("PRAGMA freelist_count").fetchone()[0],
+            'page_count': conn.execute("PRAGMA page_count").fetchone()[0]
+        }
+    finally:
+        conn.close()
+
+
+def run_maintenance(horizon_days=ARCHIVE_AFTER_DAYS, vacuum_pages=VACUUM_PAGES):
+    """
+    One scheduled pass: archive, then compact.
+    """
+    moved = archive_old_records(horizon_days)
+    pages = compact(vacuum_pages)
+    return {'archived': {str(year): n for year, n in moved.items()}, **pages}
+
+
+def archive_status():
+    """
+    Live table size and row counts per archived year.
+    """
+    conn = sqlite3.connect(database.DB_FILE)
+    try:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        status = {
+            'live_rows': conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0],
+            'oldest_live': conn.execute("SELECT MIN(date) FROM patients WHERE date GLOB '[0-9]*'").fetchone()[0],
+            'live_mb': conn.execute("PRAGMA page_count").fetchone()[0] * page_size / 1e6,
+            'free_mb': conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size / 1e6,
+            'years': {}
+        }
+    finally:
+        conn.close()
+    for year, path in database.archive_files().items():
+        archive = sqlite3.connect(path)
+        try:
+            rows = archive.execute("SELECT COUNT(*) FROM patients").fetchone()[0]
+        finally:
+            archive.close()
+        status['years'][year] = {'rows': rows, 'mb': os.path.getsize(path) / 1e6}
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old patient records and compact the live database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    r = sub.add_parser('run')
+    r.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS, help="Archive records older than this")
+    r.add_argument('--vacuum-pages', type=int, default=VACUUM_PAGES)
+    sub.add_parser('status')
+    w = sub.add_parser('watch')
+    w.add_argument('--interval', type=float, default=86400)
+    w.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS)
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        s = archive_status()
+        print(f"Live: {s['live_rows']} rows, {s['live_mb']:.1f} MB ({s['free_mb']:.1f} MB free), oldest {s['oldest_live']}")
+        for year, info in s['years'].items():
+            print(f"  {year}: {info['rows']} rows, {info['mb']:.1f} MB")
+    elif args.command == 'run':
+        print(run_maintenance(args.days, args.vacuum_pages))
+    else:
+        try:
+            while True:
+                print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {run_maintenance(args.days)}", flush=True)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,338 @@
+# Online Backup and Snapshots of the Medical Records Database
+#
+# Copies the live database with the SQLite online backup API, a few hundred
+# pages per step with a short pause between steps, so clinicians keep
+# writing while it runs. Snapshots are stored incrementally: the consistent
+# copy is cut into fixed-size blocks, and only blocks not already in the
+# store are written (zlib-compressed, content-addressed by SHA-256).
+# Under WAL (RECORD_DURABILITY=relaxed or a synthetic load) the copy pins one
+# read snapshot and never blocks writers; with a rollback journal each step
+# briefly holds a shared lock and heavy write traffic forces larger steps.
+#   python -m src.backup snapshot [--keep 14]
+#   python -m src.backup list
+#   python -m src.backup verify [snapshot.json]
+#   python -m src.backup restore snapshot.json --out data/restored.db
+# Snapshots in progress hold a shared lock on BACKUP_DIR/.lock until their
+# manifest is written; pruning takes it exclusively, so it never deletes a
+# block that a snapshot still being stored has reused or just written.
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:
+    # No flock (Windows): run one backup process at a time there
+    fcntl = None
+
+from src import database
+from src.metrics import observe
+
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'data/backups')
+BLOCK_SIZE = 1 << 20
+# Pages copied per backup step and pause between steps (yields to writers)
+PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 0.005))
+# A write from another connection restarts the copy; after this many
+# restarts the step size is raised so the copy can finish on a busy database
+MAX_RESTARTS = 5
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _copy_once(src, dst, pages, pause, stats):
+    last = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        # A restart starts over from page 1, so more is left than expected
+        if last['remaining'] is not None and remaining > max(last['remaining'] - pages, 0):
+            last['restarts'] += 1
+            stats['restarts'] += 1
+            if last['restarts'] > MAX_RESTARTS:
+                raise _Restarted()
+        last['remaining'] = remaining
+        if pause and remaining:
+            time.sleep(pause)
+
+    src.backup(dst, pages=pages, progress=progress)
+
+
+def backup_database(dest_path, db_file=None, pages=PAGES_PER_STEP, pause=STEP_PAUSE):
+    """
+    Makes a consistent copy of the live database at dest_path without
+    blocking writers for more than one step at a time. Returns stats:
+    bytes, pages, steps, restarts, seconds, MB/s, journal mode.
+    """
+    db_file = db_file or database.DB_FILE
+    stats = {'steps': 0, 'pages': 0, 'restarts': 0}
+    start = time.perf_counter()
+    src = sqlite3.connect(db_file, timeout=30)
+    tmp = dest_path + '.part'
+    try:
+        journal_mode = src.execute("PRAGMA journal_mode").fetchone()[0]
+        if journal_mode == 'wal':
+            # Pin one read snapshot for the whole copy: writers keep appending
+            # to the WAL and the copy never restarts. In rollback-journal mode
+            # this would block writers, so there each step takes its own lock.
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        while True:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            dst = sqlite3.connect(tmp)
+            try:
+                _copy_once(src, dst, pages, pause, stats)
+                break
+            except _Restarted:
+                # Busy database: take bigger bites (finally all at once)
+                pages = pages * 8 if 0 < pages < 65536 else -1
+                print(f"Backup restarted by concurrent writes; retrying with {pages} pages per step")
+            finally:
+                dst.close()
+    finally:
+        src.close()
+    os.replace(tmp, dest_path)
+
+    elapsed = time.perf_counter() - start
+    observe('db.backup', elapsed)
+    size = os.path.getsize(dest_path)
+    stats.update({
+        'bytes': size,
+        'seconds': elapsed,
+        'mb_per_s': size / 1e6 / elapsed if elapsed else 0.0,
+        'journal_mode': journal_mode
+    })
+    return stats
+
+
+def _table_counts(path):
+    conn = sqlite3.connect(path)
+    try:
+        names = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+            "AND sql NOT LIKE 'CREATE VIRTUAL TABLE%' ORDER BY name")]
+        return {name: conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0] for name in names}
+    finally:
+        conn.close()
+
+
+def _block_path(digest):
+    return os.path.join(BACKUP_DIR, 'blocks', digest[:2], digest + '.z')
+
+
+def _store_block(data):
+    digest = hashlib.sha256(data).hexdigest()
+    path = _block_path(digest)
+    if os.path.exists(path):
+        return digest, 0
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = zlib.compress(data, 1)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp, path)
+    return digest, len(payload)
+
+
+def _read_block(digest):
+    with open(_block_path(digest), 'rb') as f:
+        data = zlib.decompress(f.read())
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Backup block {digest[:12]} is corrupt")
+    return data
+
+
+@contextlib.contextmanager
+def _store_lock(exclusive):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    with open(os.path.join(BACKUP_DIR, '.lock'), 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def create_snapshot(db_file=None, keep=None):
+    """
+    Backs up the live database and stores it as an incremental snapshot.
+    Returns the manifest (also written to BACKUP_DIR/snapshot-<time>.json).
+    """
+    with _store_lock(exclusive=False):
+        manifest = _create_snapshot(db_file)
+    if keep:
+        prune_snapshots(keep)
+    return manifest
+
+
+def _create_snapshot(db_file):
+    fd, tmp_copy = tempfile.mkstemp(suffix='.db', dir=BACKUP_DIR)
+    os.close(fd)
+    try:
+        stats = backup_database(tmp_copy, db_file)
+        blocks = []
+        new_bytes = 0
+        start = time.perf_counter()
+        with open(tmp_copy, 'rb') as f:
+            for data in iter(lambda: f.read(BLOCK_SIZE), b''):
+                digest, stored = _store_block(data)
+                blocks.append(digest)
+                new_bytes += stored
+        stats['store_seconds'] = time.perf_counter() - start
+        stats['new_blocks_bytes'] = new_bytes
+        tables = _table_counts(tmp_copy)
+    finally:
+        os.remove(tmp_copy)
+
+    name = datetime.now().strftime("snapshot-%Y%m%d-%H%M%S")
+    manifest = {
+        'name': name,
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'source': os.path.abspath(db_file or database.DB_FILE),
+        'block_size': BLOCK_SIZE,
+        'blocks': blocks,
+        'tables': tables,
+        'stats': stats
+    }
+    path = os.path.join(BACKUP_DIR, name + '.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+def list_snapshots():
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(os.path.join(BACKUP_DIR, n) for n in os.listdir(BACKUP_DIR)
+                  if n.startswith('snapshot-') and n.endswith('.json'))
+
+
+def _load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def prune_snapshots(keep):
+    """
+    Keeps the newest 'keep' snapshots and deletes blocks no longer referenced.
+    Waits for snapshots in progress to finish.
+    """
+    with _store_lock(exclusive=True):
+        return _prune_snapshots(keep)
+
+
+def _prune_snapshots(keep):
+    snapshots = list_snapshots()
+    for path in snapshots[:-keep]:
+        os.remove(path)
+    live = set()
+    for path in list_snapshots():
+        live.update(_load_manifest(path)['blocks'])
+    removed = 0
+    blocks_dir = os.path.join(BACKUP_DIR, 'blocks')
+    for root, _, files in os.walk(blocks_dir):
+        for name in files:
+            if name.endswith('.z') and name[:-2] not in live:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+def restore_snapshot(manifest_path, out_path):
+    """
+    Rebuilds the database file from a snapshot. Refuses to overwrite the
+    live database; point the app at the restored file instead.
+    """
+    if os.path.abspath(out_path) == os.path.abspath(database.DB_FILE):
+        raise ValueError("Refusing to overwrite the live database; restore to another path")
+    manifest = _load_manifest(manifest_path)
+    tmp = out_path + '.part'
+    with open(tmp, 'wb') as f:
+        for digest in manifest['blocks']:
+            f.write(_read_block(digest))
+    os.replace(tmp, out_path)
+    return out_path
+
+
+def verify_snapshot(manifest_path):
+    """
+    Restores a snapshot to a temporary file and checks block hashes,
+    PRAGMA integrity_check and per-table row counts against the manifest.
+    """
+    manifest = _load_manifest(manifest_path)
+    fd, tmp = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    start = time.perf_counter()
+    try:
+        restore_snapshot(manifest_path, tmp)
+        conn = sqlite3.connect(tmp)
+        try:
+            integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            conn.close()
+        counts = _table_counts(tmp)
+    except Exception as e:
+        return {'ok': False, 'error': str(e)}
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    mismatched = {t: (n, counts.get(t)) for t, n in manifest['tables'].items() if counts.get(t) != n}
+    return {
+        'ok': integrity == 'ok' and not mismatched,
+        'integrity': integrity,
+        'mismatched_tables': mismatched,
+        'seconds': time.perf_counter() - start
+    }
+
+
+def _print_snapshot(manifest):
+    s = manifest['stats']
+    print(f"{manifest['name']}: {s['bytes'] / 1e6:.1f} MB in {s['seconds']:.2f}s "
+          f"({s['mb_per_s']:.1f} MB/s, {s['steps']} steps, {s['restarts']} restarts, "
+          f"journal={s['journal_mode']}), new blocks {s['new_blocks_bytes'] / 1e6:.2f} MB stored")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Online backup / snapshots of the medical records database")
+    sub = parser.add_subparsers(dest='command', required=True)
+    snap = sub.add_parser('snapshot')
+    snap.add_argument('--keep', type=int, default=None, help="Keep only the newest N snapshots")
+    sub.add_parser('list')
+    ver = sub.add_parser('verify')
+    ver.add_argument('manifest', nargs='?', default=None, help="Defaults to the newest snapshot")
+    res = sub.add_parser('restore')
+    res.add_argument('manifest')
+    res.add_argument('--out', required=True)
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        _print_snapshot(create_snapshot(keep=args.keep))
+    elif args.command == 'list':
+        for path in list_snapshots():
+            _print_snapshot(_load_manifest(path))
+    elif args.command == 'verify':
+        snapshots = list_snapshots()
+        target = args.manifest or (snapshots[-1] if snapshots else None)
+        if target is None:
+            print("No snapshots found.")
+            sys.exit(1)
+        result = verify_snapshot(target)
+        print(f"{os.path.basename(target)}: {'OK' if result['ok'] else 'FAILED'} {result}")
+        sys.exit(0 if result['ok'] else 1)
+    else:
+        print(f"Restored to {restore_snapshot(args.manifest, args.out)}")
@@ -0,0 +1,209 @@
+# Directory-Scale CT Batch Scoring
+#
+# Scores every scan under a directory tree with the CT model:
+#   python -m src.batch_score_ct data/archive_scans --out results.csv
+#   python -m src.batch_score_ct data/archive_scans --out db
+# Decode + resize runs in a process pool, a whole batch per task, with at most
+# --prefetch batches in flight so the model never waits on JPEG decoding and
+# memory stays bounded. Finished paths are appended to a checkpoint file after
+# every batch; re-running the same command resumes where it stopped.
+# Scans are keyed by absolute path (results, checkpoint, and the job queue's
+# 'ct_score' rows alike), so runs over different roots never collide.
+import os
+import csv
+import time
+import argparse
+import multiprocessing
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.scan_loader import load_scan, IMG_SIZE
+
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_PREFETCH = 4
+CSV_FIELDS = ['scan_path', 'probability', 'level', 'model', 'scored_at', 'error']
+
+
+def risk_level(prob):
+    # Same bands as the CT Scan page
+    if prob > 0.7:
+        return "HIGH"
+    if prob > 0.4:
+        return "MEDIUM"
+    return "LOW"
+
+
+def list_scans(root):
+    """
+    Returns absolute image paths under root, in a stable order.
+    """
+    paths = []
+    for dirpath, dirnames, files in os.walk(os.path.abspath(root)):
+        dirnames.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(dirpath, name))
+    return paths
+
+
+def _decode(path):
+    # Same reduced-resolution decode as image_model.preprocess_image, without
+    # importing TensorFlow in every worker. Kept as uint8 until it reaches
+    # the main process: a quarter of the float32 pickling cost.
+    return load_scan(path, IMG_SIZE)
+
+
+def _decode_batch(paths):
+    arrays, errors = [], []
+    for path in paths:
+        try:
+            arrays.append(_decode(path))
+            errors.append(None)
+        except Exception as e:
+            arrays.append(None)
+            errors.append(str(e))
+    return paths, arrays, errors
+
+
+def read_checkpoint(path, root):
+    # Checkpoints written before paths were absolute hold paths relative to root
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {os.path.abspath(os.path.join(root, line.rstrip('\n'))) for line in f if line.strip()}
+
+
+class _CsvSink:
+    def __init__(self, path):
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.f = open(path, 'a', newline='')
+        self.writer = csv.DictWriter(self.f, fieldnames=CSV_FIELDS)
+        if new:
+            self.writer.writeheader()
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
+
+
+class _DbSink:
+    def __init__(self):
+        from src import database
+        self.database = database
+
+    def write(self, rows):
+        if not self.database.save_ct_results(rows):
+            raise RuntimeError("Could not write CT results to the database")
+
+    def close(self):
+        pass
+
+
+def score_directory(root, out='results.csv', checkpoint=None, batch_size=DEFAULT_BATCH_SIZE,
+                    workers=None, prefetch=DEFAULT_PREFETCH, limit=None):
+    """
+    Scores all scans under 'root' and writes one row per scan to 'out'
+    (a CSV path, or 'db' for the ct_scan_results table).
+    Returns a summary dict.
+    """
+    if checkpoint is None:
+        checkpoint = ('data/ct_batch' if out == 'db' else os.path.splitext(out)[0]) + '.checkpoint'
+    done = read_checkpoint(checkpoint, root)
+    todo = [p for p in list_scans(root) if p not in done]
+    if limit:
+        todo = todo[:limit]
+    batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+    print(f"{len(todo)} scans to score ({len(done)} already done per {checkpoint})")
+    if not batches:
+        return {'scored': 0, 'errors': 0, 'seconds': 0.0}
+
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    # Decode workers come from a fresh forkserver (spawn where there is none),
+    # not from this process: the pool only starts them on the first submit,
+    # after TensorFlow and the model are loaded below, and a plain fork would
+    # copy all of that into every worker
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    from src import image_model
+    from src.image_model import predict_batch, get_model
+    model = get_model()
+    if model is None:
+        print("CT model not available. Scores will be simulated.")
+        model_name = 'simulated'
+    else:
+        backend_path = image_model.TFLITE_MODEL_PATH if image_model.INFERENCE_BACKEND == 'tflite' else image_model.MODEL_PATH
+        model_name = f"{image_model.INFERENCE_BACKEND}:{os.path.basename(backend_path)}"
+
+    sink = _DbSink() if out == 'db' else _CsvSink(out)
+    scored = errors = 0
+    start = time.perf_counter()
+    pending = deque()
+    next_batch = 0
+    try:
+        with open(checkpoint, 'a') as ckpt:
+            while next_batch < len(batches) or pending:
+                # Keep the prefetch window full
+                while next_batch < len(batches) and len(pending) < prefetch:
+                    pending.append(pool.submit(_decode_batch, batches[next_batch]))
+                    next_batch += 1
+
+                paths, arrays, decode_errors = pending.popleft().result()
+                ok = [i for i, a in enumerate(arrays) if a is not None]
+                probs = predict_batch([arrays[i].astype(np.float32) / 255.0 for i in ok]) if ok else []
+                prob_by_index = dict(zip(ok, probs))
+
+                now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                rows = []
+                for i, path in enumerate(paths):
+                    prob = prob_by_index.get(i)
+                    rows.append({
+                        'scan_path': path,
+                        'probability': round(prob, 6) if prob is not None else None,
+                        'level': risk_level(prob) if prob is not None else None,
+                        'model': model_name,
+                        'scored_at': now,
+                        'error': decode_errors[i]
+                    })
+                sink.write(rows)
+                # Only checkpoint once the results are durable
+                ckpt.write(''.join(path + '\n' for path in paths))
+                ckpt.flush()
+                scored += len(ok)
+                errors += len(paths) - len(ok)
+
+                total = scored + errors
+                elapsed = time.perf_counter() - start
+                print(f"\r{total}/{len(todo)} scans  {total / elapsed:.1f} scans/s  {errors} errors",
+                      end='', flush=True)
+    finally:
+        print()
+        for fut in pending:
+            fut.cancel()
+        pool.shutdown(wait=True)
+        sink.close()
+
+    elapsed = time.perf_counter() - start
+    print(f"Scored {scored} scans ({errors} unreadable) in {elapsed:.1f}s -> {out}")
+    return {'scored': scored, 'errors': errors, 'seconds': elapsed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every CT scan under a directory")
+    parser.add_argument('root')
+    parser.add_argument('--out', default='results.csv', help="CSV path, or 'db' for the ct_scan_results table")
+    parser.add_argument('--checkpoint', default=None)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH)
+    parser.add_argument('--limit', type=int, default=None)
+    args = parser.parse_args()
+    score_directory(args.root, args.out, args.checkpoint, args.batch_size, args.workers,
+                    args.prefetch, args.limit)
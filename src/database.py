@@ -1,14 +1,56 @@
 # Medical Record Database Module
+import io
+import re
+import csv
+import gzip
+import difflib
 import sqlite3
+import unicodedata
 import pandas as pd
 from datetime import datetime
 import os
+from src.metrics import timed
 
-DB_FILE = 'data/medical_records.db'
+# Override with MEDICAL_DB_FILE (e.g. to point tools at a scratch database)
+DB_FILE = os.environ.get('MEDICAL_DB_FILE', 'data/medical_records.db')
+# Per-year databases of archived patient rows (see src/archive.py)
+ARCHIVE_DIR = os.environ.get('MEDICAL_ARCHIVE_DIR', 'data/archive')
+# SQLite attaches at most 10 databases to one connection by default
+MAX_ATTACHED = 10
 
+# DB column -> UI/Analytics column names
+COLUMN_MAP = {
+    'date': 'Date',
+    'patient_name': 'Patient Name',
+    'patient_id': 'Patient ID',
+    'gender': 'GENDER',
+    'age': 'AGE',
+    'smoking': 'SMOKING',
+    'yellow_fingers': 'YELLOW_FINGERS',
+    'anxiety': 'ANXIETY',
+    'peer_pressure': 'PEER_PRESSURE',
+    'chronic_disease': 'CHRONIC DISEASE',
+    'fatigue': 'FATIGUE ', # Note space
+    'allergy': 'ALLERGY ', # Note space
+    'wheezing': 'WHEEZING',
+    'alcohol': 'ALCOHOL CONSUMING',
+    'coughing': 'COUGHING',
+    'shortness_of_breath': 'SHORTNESS OF BREATH',
+    'swallowing_difficulty': 'SWALLOWING DIFFICULTY',
+    'chest_pain': 'CHEST PAIN',
+    'phone': 'Phone',
+    'location': 'Location',
+    'risk_level': 'Risk',
+    'malignancy_probability': 'Probability'
+}
+
+@timed('db.init_db')
 def init_db():
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
+    # New databases return pages freed by archival in steps (src/archive.py);
+    # existing ones are converted on their first compaction
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
     
     # Create Patients Table
     c.execute('''
@@ -50,6 +92,114 @@ def init_db():
     except sqlite3.OperationalError:
         pass # Column already exists
     
+    # Ground-truth outcome (1 = cancer confirmed, 0 = ruled out), filled in after follow-up
+    try:
+        c.execute("ALTER TABLE patients ADD COLUMN confirmed_diagnosis INTEGER")
+    except sqlite3.OperationalError:
+        pass # Column already exists
+    # Order in which labels were set (src/incremental.py watermark): a label
+    # added later to an old record still comes after every earlier label
+    try:
+        c.execute("ALTER TABLE patients ADD COLUMN label_seq INTEGER")
+        # Labels set before the column existed keep their id as sequence,
+        # so watermarks recorded as ids stay valid
+        c.execute("UPDATE patients SET label_seq = id WHERE confirmed_diagnosis IS NOT NULL")
+    except sqlite3.OperationalError:
+        pass # Column already exists
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patients_label_seq ON patients (label_seq)")
+    for event, condition in (("INSERT", "new.confirmed_diagnosis IS NOT NULL"),
+                             ("UPDATE OF confirmed_diagnosis", "new.confirmed_diagnosis IS NOT old.confirmed_diagnosis")):
+        name = 'patients_label_seq_' + event.split()[0].lower()
+        c.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON patients
+            WHEN {condition} BEGIN
+                UPDATE patients SET label_seq = (SELECT COALESCE(MAX(label_seq), 0) + 1 FROM patients)
+                WHERE id = new.id;
+            END
+        ''')
+    
+    # Full-text index over the lookup columns (external content: rows live
+    # only in 'patients', triggers keep the index in step)
+    try:
+        fts_exists = c.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'"
+        ).fetchone()
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+                patient_name, phone, location, patient_id,
+                content='patients', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+            )
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+                INSERT INTO patients_fts(rowid, patient_name, phone, location, patient_id)
+                VALUES (new.id, new.patient_name, new.phone, new.location, new.patient_id);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+                INSERT INTO patients_fts(patients_fts, rowid, patient_name, phone, location, patient_id)
+                VALUES ('delete', old.id, old.patient_name, old.phone, old.location, old.patient_id);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS patients_fts_update
+            AFTER UPDATE OF patient_name, phone, location, patient_id ON patients BEGIN
+                INSERT INTO patients_fts(patients_fts, rowid, patient_name, phone, location, patient_id)
+                VALUES ('delete', old.id, old.patient_name, old.phone, old.location, old.patient_id);
+                INSERT INTO patients_fts(rowid, patient_name, phone, location, patient_id)
+                VALUES (new.id, new.patient_name, new.phone, new.location, new.patient_id);
+            END
+        ''')
+        if not fts_exists:
+            # Index rows saved before the search index existed
+            c.execute("INSERT INTO patients_fts(patients_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        print(f"Full-text search unavailable ({e}); falling back to LIKE search.")
+    
+    # Patient identities: one per normalized (phone, name); records get
+    # patient_id 'P000042' on insert, so a patient's visits are one index range
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS patient_identities (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_norm TEXT NOT NULL,
+            name_norm TEXT NOT NULL,
+            created_at TEXT,
+            UNIQUE (phone_norm, name_norm)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_patients_patient_id ON patients (patient_id, date)")
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS patient_visits AS
+        SELECT patient_id, id AS record_id, date, patient_name, phone, location,
+               risk_level, malignancy_probability, confirmed_diagnosis
+        FROM patients
+        WHERE patient_id IS NOT NULL AND patient_id != ''
+    ''')
+
+    # Materialized cohort aggregates for analytics / header metrics, kept
+    # current by refresh_cohort_stats() from an id watermark
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cohort_stats (
+            day TEXT NOT NULL,
+            age_band INTEGER NOT NULL,
+            gender TEXT NOT NULL,
+            smoking TEXT NOT NULL,
+            risk_level TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            prob_sum REAL NOT NULL,
+            PRIMARY KEY (day, age_band, gender, smoking, risk_level)
+        ) WITHOUT ROWID
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cohort_watermark (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL
+        )
+    ''')
+    c.execute("INSERT OR IGNORE INTO cohort_watermark (id, last_id) VALUES (1, 0)")
+    
     # Create Users Table (for future auth)
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -72,21 +222,115 @@ def init_db():
             status TEXT DEFAULT 'Scheduled'
         )
     ''')
+
+    # Scheduling (see src/scheduling.py): start/end as minutes since the epoch
+    # (local clinic time), per-resource, with an R*Tree over the active slots
+    for column in ("start_min INTEGER", "end_min INTEGER", "resource TEXT DEFAULT 'clinic'", "resource_id INTEGER DEFAULT 1"):
+        try:
+            c.execute(f"ALTER TABLE appointments ADD COLUMN {column}")
+        except sqlite3.OperationalError:
+            pass # Column already exists
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schedule_resources (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL
+        )
+    ''')
+    c.execute("INSERT OR IGNORE INTO schedule_resources (id, name) VALUES (1, 'clinic')")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_appointments_start ON appointments (start_min)")
+    try:
+        c.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS appointment_slots USING rtree_i32(
+                id, resource_lo, resource_hi, start_min, last_min
+            )
+        ''')
+        # Half-open [start, end): the tree stores the last occupied minute,
+        # so back-to-back appointments don't overlap
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS appointment_slots_insert AFTER INSERT ON appointments
+            WHEN new.start_min IS NOT NULL AND IFNULL(new.status, '') != 'Cancelled' BEGIN
+                INSERT INTO appointment_slots VALUES (new.id, new.resource_id, new.resource_id, new.start_min, new.end_min - 1);
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS appointment_slots_update
+            AFTER UPDATE OF start_min, end_min, resource_id, status ON appointments BEGIN
+                DELETE FROM appointment_slots WHERE id = old.id;
+                INSERT INTO appointment_slots
+                SELECT new.id, new.resource_id, new.resource_id, new.start_min, new.end_min - 1
+                WHERE new.start_min IS NOT NULL AND IFNULL(new.status, '') != 'Cancelled';
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS appointment_slots_delete AFTER DELETE ON appointments BEGIN
+                DELETE FROM appointment_slots WHERE id = old.id;
+            END
+        ''')
+    except sqlite3.OperationalError as e:
+        print(f"R*Tree unavailable ({e}); appointment conflicts use the start-time index.")
+    # Appointments saved with free-text date/time before these columns existed
+    c.execute('''
+        UPDATE appointments SET
+            start_min = CAST(strftime('%s', date || ' ' || time) AS INTEGER) / 60,
+            end_min = CAST(strftime('%s', date || ' ' || time) AS INTEGER) / 60 + 30
+        WHERE start_min IS NULL AND strftime('%s', date || ' ' || time) IS NOT NULL
+    ''')
+
+    # Create CT Scan Results Table (bulk scoring, see src/batch_score_ct.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ct_scan_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            scan_path TEXT UNIQUE,
+            probability REAL,
+            level TEXT,
+            model TEXT,
+            scored_at TEXT,
+            error TEXT
+        )
+    ''')
     
+    # Scoring / report jobs claimed by workers under a lease (see src/job_queue.py)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after REAL NOT NULL DEFAULT 0,
+            lease_owner TEXT,
+            lease_expires REAL,
+            result TEXT,
+            error TEXT,
+            created_at REAL,
+            finished_at REAL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority DESC, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs (status, lease_expires)")
+
     conn.commit()
     conn.close()
 
-def save_patient_record(data_dict):
+PATIENT_INSERT_SQL = '''
+    INSERT INTO patients (
+        date, patient_name, patient_id, gender, age, smoking, 
+        yellow_fingers, anxiety, peer_pressure, chronic_disease, 
+        fatigue, allergy, wheezing, alcohol, coughing, 
+        shortness_of_breath, swallowing_difficulty, chest_pain, 
+        phone, location, risk_level, malignancy_probability
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def patient_params(data_dict, date=None):
     """
-    Saves a single patient record (dictionary) to the database.
-    Argument 'data_dict' should match the table schema columns.
+    Converts a record dict (UI keys, as built in app.py) to the parameter
+    tuple for PATIENT_INSERT_SQL. 'date' defaults to now.
     """
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    
-    # Extract values in correct order
-    params = (
-        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    return (
+        date or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
         data_dict.get('Patient Name'),
         data_dict.get('Patient ID'),
         # Map input features (Assuming input keys match DB columns roughly or we map them)
@@ -113,17 +357,61 @@ def save_patient_record(data_dict):
         data_dict.get('Risk'),
         float(data_dict.get('Probability', 0.0))
     )
-    
+
+def normalize_phone(phone):
+    # Digits only, without leading zeros: '+1 (555) 0100' and '0015550100' match
+    return re.sub(r"\D", "", str(phone or '')).lstrip('0')
+
+def normalize_name(name):
+    # Case-, accent-, spacing- and order-insensitive: 'Doe,  Jané' == 'jane doe'
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode()
+    return ' '.join(sorted(re.findall(r"\w+", text.lower())))
+
+def format_patient_id(identity_id):
+    return f"P{identity_id:06d}"
+
+def resolve_patient_id(conn, name, phone):
+    """
+    Returns the patient ID for this name and phone, creating the identity on
+    first sight (race-free across processes via the UNIQUE key). None when
+    either is missing: name alone is too weak to link medical records.
+    """
+    phone_norm, name_norm = normalize_phone(phone), normalize_name(name)
+    if not phone_norm or not name_norm:
+        return None
+    lookup = "SELECT id FROM patient_identities WHERE phone_norm = ? AND name_norm = ?"
+    row = conn.execute(lookup, (phone_norm, name_norm)).fetchone()
+    if row is None:
+        conn.execute(
+            "INSERT OR IGNORE INTO patient_identities (phone_norm, name_norm, created_at) VALUES (?, ?, ?)",
+            (phone_norm, name_norm, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        row = conn.execute(lookup, (phone_norm, name_norm)).fetchone()
+    return format_patient_id(row[0])
+
+def insert_patient_rows(conn, params_list):
+    """
+    Inserts patient_params() tuples on an open connection (the caller
+    commits), filling in the patient ID from the identity index when the
+    record doesn't carry one.
+    """
+    rows = []
+    for params in params_list:
+        if not params[2]:
+            params = params[:2] + (resolve_patient_id(conn, params[1], params[18]),) + params[3:]
+        rows.append(params)
+    conn.executemany(PATIENT_INSERT_SQL, rows)
+
+@timed('db.save_patient_record')
+def save_patient_record(data_dict):
+    """
+    Saves a single patient record (dictionary) to the database.
+    Argument 'data_dict' should match the table schema columns.
+    For non-blocking saves from the UI see src/write_behind.py.
+    """
+    conn = sqlite3.connect(DB_FILE)
+
     try:
-        c.execute('''
-            INSERT INTO patients (
-                date, patient_name, patient_id, gender, age, smoking, 
-                yellow_fingers, anxiety, peer_pressure, chronic_disease, 
-                fatigue, allergy, wheezing, alcohol, coughing, 
-                shortness_of_breath, swallowing_difficulty, chest_pain, 
-                phone, location, risk_level, malignancy_probability
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', params)
+        insert_patient_rows(conn, [patient_params(data_dict)])
         conn.commit()
         return True
     except Exception as e:
@@ -132,39 +420,22 @@ def save_patient_record(data_dict):
     finally:
         conn.close()
 
-def load_all_records():
+@timed('db.load_all_records')
+def load_all_records(limit=None):
+    """
+    All patient rows, newest first (only the newest 'limit' if given).
+    """
     conn = sqlite3.connect(DB_FILE)
     try:
         # Load into DataFrame for compatibility with existing app logic
-        df = pd.read_sql_query("SELECT * FROM patients ORDER BY id DESC", conn)
+        if limit:
+            df = pd.read_sql_query("SELECT * FROM patients ORDER BY id DESC LIMIT ?", conn, params=(int(limit),))
+        else:
+            df = pd.read_sql_query("SELECT * FROM patients ORDER BY id DESC", conn)
         
         if not df.empty:
             # Map DB columns back to UI/Analytics expected columns
-            column_map = {
-                'date': 'Date',
-                'patient_name': 'Patient Name',
-                'patient_id': 'Patient ID',
-                'gender': 'GENDER',
-                'age': 'AGE',
-                'smoking': 'SMOKING',
-                'yellow_fingers': 'YELLOW_FINGERS',
-                'anxiety': 'ANXIETY',
-                'peer_pressure': 'PEER_PRESSURE',
-                'chronic_disease': 'CHRONIC DISEASE',
-                'fatigue': 'FATIGUE ', # Note space
-                'allergy': 'ALLERGY ', # Note space
-                'wheezing': 'WHEEZING',
-                'alcohol': 'ALCOHOL CONSUMING',
-                'coughing': 'COUGHING',
-                'shortness_of_breath': 'SHORTNESS OF BREATH',
-                'swallowing_difficulty': 'SWALLOWING DIFFICULTY',
-                'chest_pain': 'CHEST PAIN',
-                'phone': 'Phone',
-                'location': 'Location',
-                'risk_level': 'Risk',
-                'malignancy_probability': 'Probability'
-            }
-            df = df.rename(columns=column_map)
+            df = df.rename(columns=COLUMN_MAP)
             
         return df
     except Exception as e:
@@ -173,22 +444,552 @@ def load_all_records():
     finally:
         conn.close()
 
+# Rows fetched per step when exporting (memory is bounded by one batch)
+EXPORT_BATCH_ROWS = 10000
+EXPORT_FORMATS = ('csv', 'csv.gz', 'parquet')
+
+def _export_columns(conn, columns):
+    # DB column names for the requested DB or UI names, in table order
+    table = [row[1] for row in conn.execute("PRAGMA main.table_info(patients)")]
+    if not columns:
+        return table
+    by_ui = {v.strip(): k for k, v in COLUMN_MAP.items()}
+    wanted = []
+    for col in columns:
+        name = col if col in table else by_ui.get(col.strip())
+        if name not in table:
+            raise ValueError(f"Unknown column: {col}")
+        wanted.append(name)
+    return [c for c in table if c in wanted]
+
+def _export_filters(start_date=None, end_date=None, risk=None):
+    # WHERE clauses shared by the live table and the archive files
+    clauses, params = [], []
+    if start_date:
+        clauses.append("date >= ?")
+        params.append(str(start_date))
+    if end_date:
+        # Inclusive end day: '2026-01-31' keeps '2026-01-31 17:00:00'
+        clauses.append("date < ?")
+        params.append(f"{end_date}~")
+    if risk:
+        clauses.append("risk_level = ?")
+        params.append(risk)
+    return clauses, params
+
+def _stream(cursor, batch_size):
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+def iter_record_batches(columns=None, query=None, start_date=None, end_date=None, risk=None,
+                        include_archive=False, batch_size=EXPORT_BATCH_ROWS):
+    """
+    Streams patient rows as lists of tuples, 'batch_size' at a time, oldest
+    first: archived years (if include_archive, one attached file at a time),
+    then the live table. The first item yielded is the list of column names
+    (UI names, as in load_all_records()). 'query' is the Archive search:
+    every word as a prefix, through the full-text index on the live table
+    and as a substring scan on archive files (which have no text index).
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        cols = _export_columns(conn, columns)
+        yield [COLUMN_MAP.get(c, c) for c in cols]
+        clauses, params = _export_filters(start_date, end_date, risk)
+        terms = _fts_terms(query or '')
+
+        if include_archive:
+            text = ["(lower(patient_name) LIKE ? OR phone LIKE ? OR lower(location) LIKE ? OR lower(patient_id) LIKE ?)"] * len(terms)
+            text_params = [f"%{t}%" for t in terms for _ in range(4)]
+            for year, path in archive_files().items():
+                conn.execute("ATTACH DATABASE ? AS archive", (path,))
+                try:
+                    present = {row[1] for row in conn.execute("PRAGMA archive.table_info(patients)")}
+                    select = ', '.join(c if c in present else f"NULL AS {c}" for c in cols)
+                    where = clauses + text
+                    cursor = conn.execute(
+                        f"SELECT {select} FROM archive.patients"
+                        + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY id",
+                        params + text_params)
+                    yield from _stream(cursor, batch_size)
+                finally:
+                    conn.execute("DETACH DATABASE archive")
+
+        where = clauses + (["id IN (SELECT rowid FROM patients_fts WHERE patients_fts MATCH ?)"] if terms else [])
+        cursor = conn.execute(
+            f"SELECT {', '.join(cols)} FROM main.patients"
+            + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY id",
+            params + ([_fts_query(terms)] if terms else []))
+        yield from _stream(cursor, batch_size)
+    finally:
+        conn.close()
+
+def _arrow_value(value, kind):
+    # Column affinity is advisory in SQLite; a stray value becomes null
+    if value is None or kind == 'string':
+        return value if value is None else str(value)
+    try:
+        return int(value) if kind == 'int64' else float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _write_parquet(dest, columns, batches):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        cols = _export_columns(conn, columns)
+        types = {row[1]: row[2].upper() for row in conn.execute("PRAGMA main.table_info(patients)")}
+    finally:
+        conn.close()
+    arrow_types = {'INTEGER': pa.int64(), 'REAL': pa.float64()}
+    schema = pa.schema([(COLUMN_MAP.get(c, c), arrow_types.get(types[c], pa.string())) for c in cols])
+    written = 0
+    with pq.ParquetWriter(dest, schema, compression='zstd') as writer:
+        for rows in batches:
+            arrays = [pa.array([_arrow_value(v, str(field.type)) for v in values], type=field.type)
+                      for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            written += len(rows)
+    return written
+
+@timed('db.export_records')
+def export_records(dest, fmt=None, columns=None, query=None, start_date=None, end_date=None,
+                   risk=None, include_archive=False, batch_size=EXPORT_BATCH_ROWS):
+    """
+    Writes patient rows to 'dest' (a path or a binary file object) as CSV,
+    gzip CSV or Parquet (one row group per batch), streaming from the
+    database so memory stays at one batch whatever the table size. 'fmt'
+    defaults from the file extension. Filters as in iter_record_batches().
+    Returns the number of rows written.
+    """
+    fmt = fmt or next((f for f in ('csv.gz', 'parquet', 'csv') if str(dest).endswith('.' + f)), 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt} (expected one of {EXPORT_FORMATS})")
+    batches = iter_record_batches(columns, query, start_date, end_date, risk, include_archive, batch_size)
+    header = next(batches)
+    if fmt == 'parquet':
+        return _write_parquet(dest, columns, batches)
+
+    is_file = hasattr(dest, 'write')
+    if fmt == 'csv.gz':
+        # Closing the text layer finishes the gzip stream; a caller's file object stays open
+        out = gzip.open(dest, 'wt', compresslevel=6, newline='', encoding='utf-8')
+    elif is_file:
+        out = io.TextIOWrapper(dest, newline='', encoding='utf-8')
+    else:
+        out = open(dest, 'w', newline='', encoding='utf-8')
+    written = 0
+    try:
+        writer = csv.writer(out)
+        writer.writerow(header)
+        for rows in batches:
+            writer.writerows(rows)
+            written += len(rows)
+    finally:
+        if fmt == 'csv' and is_file:
+            out.flush()
+            out.detach()
+        else:
+            out.close()
+    return written
+
+# Width of the age bands in cohort_stats
+AGE_BAND = 5
+
+COHORT_COLUMN_MAP = {
+    'day': 'Date',
+    'age_band': 'Age Band',
+    'gender': 'GENDER',
+    'smoking': 'SMOKING',
+    'risk_level': 'Risk',
+    'n': 'Count',
+    'prob_sum': 'Probability Sum'
+}
+
+@timed('db.refresh_cohort_stats')
+def refresh_cohort_stats():
+    """
+    Folds patient rows added since the last refresh into cohort_stats.
+    Cost depends on the number of new rows only. Rows are committed in id
+    order (SQLite has one writer at a time), so an id watermark never skips
+    a row. Returns the number of rows folded in.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=10)
+    try:
+        last_id = conn.execute("SELECT last_id FROM cohort_watermark WHERE id = 1").fetchone()[0]
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients").fetchone()[0]
+        if max_id <= last_id:
+            return 0
+        # Re-read the watermark under the write lock so concurrent refreshes
+        # cannot count the same rows twice
+        conn.execute("BEGIN IMMEDIATE")
+        last_id = conn.execute("SELECT last_id FROM cohort_watermark WHERE id = 1").fetchone()[0]
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients").fetchone()[0]
+        conn.execute(f'''
+            INSERT INTO cohort_stats (day, age_band, gender, smoking, risk_level, n, prob_sum)
+            SELECT COALESCE(substr(date, 1, 10), ''), COALESCE(age / {AGE_BAND} * {AGE_BAND}, -1),
+                   COALESCE(gender, ''), COALESCE(smoking, ''), COALESCE(risk_level, ''),
+                   COUNT(*), COALESCE(SUM(malignancy_probability), 0)
+            FROM patients
+            WHERE id > ? AND id <= ?
+            GROUP BY 1, 2, 3, 4, 5
+            ON CONFLICT (day, age_band, gender, smoking, risk_level)
+            DO UPDATE SET n = n + excluded.n, prob_sum = prob_sum + excluded.prob_sum
+        ''', (last_id, max_id))
+        conn.execute("UPDATE cohort_watermark SET last_id = ? WHERE id = 1", (max_id,))
+        conn.commit()
+        return max_id - last_id
+    except Exception as e:
+        conn.rollback()
+        print(f"DB Aggregate Error: {e}")
+        return 0
+    finally:
+        conn.close()
+
+@timed('db.load_cohort_stats')
+def load_cohort_stats():
+    """
+    Returns the refreshed aggregates, one row per day x age band x gender x
+    smoking x risk level, with 'Count' and 'Probability Sum' columns.
+    Size depends on the date range, not on the number of patients.
+    """
+    refresh_cohort_stats()
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        df = pd.read_sql_query("SELECT * FROM cohort_stats", conn).rename(columns=COHORT_COLUMN_MAP)
+        for col in ('GENDER', 'SMOKING'):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        return df
+    except Exception as e:
+        print(f"DB Load Error: {e}")
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+@timed('db.get_cohort_summary')
+def get_cohort_summary():
+    """
+    Header metrics from the aggregates: total, high and low risk counts and
+    mean malignancy probability.
+    """
+    refresh_cohort_stats()
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        rows = conn.execute("SELECT risk_level, SUM(n), SUM(prob_sum) FROM cohort_stats GROUP BY risk_level").fetchall()
+    except Exception as e:
+        print(f"DB Load Error: {e}")
+        rows = []
+    finally:
+        conn.close()
+    counts = {risk: n for risk, n, _ in rows}
+    total = sum(counts.values())
+    prob_sum = sum(p for _, _, p in rows)
+    return {
+        'total': total,
+        'high': counts.get('High', 0),
+        'low': counts.get('Low', 0),
+        'mean_probability': prob_sum / total if total else 0.0
+    }
+
+def _fts_terms(query):
+    # Letters/digits only, so user input can never be read as FTS5 syntax
+    return re.findall(r"\w+", query.lower())
+
+# Typo fallback: newest records sharing each word's first two letters are
+# read (at most FUZZY_CANDIDATES) and kept if every word is this close
+# (difflib ratio) to one of theirs
+FUZZY_CANDIDATES = 2000
+FUZZY_CUTOFF = 0.75
+_SEARCH_FIELDS = ('patient_name', 'phone', 'location', 'patient_id')
+
+def _fts_query(terms, slack=0):
+    # Every term as a quoted prefix; 'slack' trims up to that many trailing
+    # characters (keeping at least 3) so a typo at the very end of a word
+    # still matches ("johnsen" -> "johns*")
+    parts = []
+    for term in terms:
+        if slack and len(term) > 3:
+            term = term[:max(3, len(term) - slack)]
+        parts.append(f'"{term}"*')
+    return ' '.join(parts)
+
+def _fuzzy_matches(conn, sql, terms, limit):
+    # Catches typos inside a word ("jonhson" finds "Johnson"), which no prefix does
+    match = ' OR '.join(dict.fromkeys(f'"{term[:2]}"*' for term in terms))
+    candidates = pd.read_sql_query(sql, conn, params=(match, FUZZY_CANDIDATES))
+    if candidates.empty:
+        return candidates
+
+    def close(row):
+        words = re.findall(r"\w+", ' '.join(str(row[c]).lower() for c in _SEARCH_FIELDS))
+        return all(any(w.startswith(term) for w in words) or
+                   difflib.get_close_matches(term, words, n=1, cutoff=FUZZY_CUTOFF)
+                   for term in terms)
+    return candidates[candidates.apply(close, axis=1)].head(int(limit))
+
+@timed('db.search_patients')
+def search_patients(query, limit=50):
+    """
+    Looks patients up by name, phone, location or patient ID. Each word is
+    matched as a prefix ("jo sm" finds "John Smith"); if nothing matches, the
+    search is retried with trailing characters dropped from longer words,
+    then allowing a typo anywhere after the first two letters, and then with
+    any word allowed to match. Newest records first: FTS5 walks
+    its index in rowid order and stops at 'limit', so common names stay fast.
+    Returns a DataFrame with the same columns as load_all_records().
+    """
+    terms = _fts_terms(query or '')
+    if not terms:
+        return pd.DataFrame()
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        sql = '''
+            SELECT p.* FROM patients_fts
+            JOIN patients p ON p.id = patients_fts.rowid
+            WHERE patients_fts MATCH ?
+            ORDER BY patients_fts.rowid DESC
+            LIMIT ?
+        '''
+        attempts = [_fts_query(terms), _fts_query(terms, slack=2), None]
+        if len(terms) > 1:
+            attempts.append(' OR '.join(_fts_query([t], slack=2) for t in terms))
+        try:
+            df = pd.DataFrame()
+            for match in dict.fromkeys(attempts):
+                if match is None:
+                    df = _fuzzy_matches(conn, sql, terms, limit)
+                else:
+                    df = pd.read_sql_query(sql, conn, params=(match, int(limit)))
+                if not df.empty:
+                    break
+        except Exception:
+            # No FTS5 in this SQLite build: slow but correct substring search
+            like = f"%{' '.join(terms)}%"
+            df = pd.read_sql_query('''
+                SELECT * FROM patients
+                WHERE lower(patient_name) LIKE ? OR phone LIKE ? OR lower(location) LIKE ? OR lower(patient_id) LIKE ?
+                ORDER BY id DESC LIMIT ?
+            ''', conn, params=(like, like, like, like, int(limit)))
+        return df.rename(columns=COLUMN_MAP)
+    except Exception as e:
+        print(f"DB Search Error: {e}")
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+def find_patient_id(name, phone):
+    """
+    Looks up an existing patient ID for this name and phone (no insert).
+    """
+    phone_norm, name_norm = normalize_phone(phone), normalize_name(name)
+    if not phone_norm or not name_norm:
+        return None
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        row = conn.execute(
+            "SELECT id FROM patient_identities WHERE phone_norm = ? AND name_norm = ?",
+            (phone_norm, name_norm)).fetchone()
+        return format_patient_id(row[0]) if row else None
+    finally:
+        conn.close()
+
+def archive_files():
+    """
+    {year: path} of the per-year archive databases, oldest first.
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return {}
+    found = {}
+    for name in sorted(os.listdir(ARCHIVE_DIR)):
+        match = re.fullmatch(r"patients_(\d{4})\.db", name)
+        if match:
+            found[int(match.group(1))] = os.path.join(ARCHIVE_DIR, name)
+    return found
+
+def archive_groups():
+    """
+    The archive files as [{year: path}, ...], newest years first, each
+    group small enough to attach to one connection.
+    """
+    years = list(archive_files().items())[::-1]
+    return [dict(years[i:i + MAX_ATTACHED]) for i in range(0, len(years), MAX_ATTACHED)] or [{}]
+
+def connect_with_archive(years=None, include_live=True):
+    """
+    Connection with the archive databases attached and a TEMP view
+    'all_patients': the live table UNION ALL every archived year, same
+    columns. Filters are pushed into each branch, so a patient_id or date
+    lookup uses each file's own index. 'years' ({year: path}, e.g. one of
+    archive_groups()) limits the files; SQLite attaches at most
+    MAX_ATTACHED, so with more years than that only the newest are used
+    and a warning is printed.
+    """
+    if years is None:
+        years = archive_groups()[0]
+        if len(archive_files()) > len(years):
+            print(f"Warning: only the newest {len(years)} archive years are attached; "
+                  "query archive_groups() separately for older ones")
+    conn = sqlite3.connect(DB_FILE)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(patients)")]
+    branches = ["SELECT * FROM main.patients"] if include_live else []
+    for year, path in sorted(years.items()):
+        conn.execute("ATTACH DATABASE ? AS ?", (path, f"archive_{year}"))
+        # Columns added to 'patients' after the year was archived read as NULL
+        present = {row[1] for row in conn.execute(f"PRAGMA archive_{year}.table_info(patients)")}
+        select = ', '.join(c if c in present else f"NULL AS {c}" for c in columns)
+        branches.append(f"SELECT {select} FROM archive_{year}.patients")
+    if not branches:
+        branches.append("SELECT * FROM main.patients WHERE 0")
+    conn.execute("CREATE TEMP VIEW all_patients AS " + " UNION ALL ".join(branches))
+    return conn
+
+@timed('db.get_patient_history')
+def get_patient_history(patient_id):
+    """
+    All visits of one patient, oldest first, with their risk level and
+    probability: the patient's risk trajectory, archived years included.
+    An index range scan on (patient_id, date) in each file; more archive
+    years than one connection can attach are read group by group.
+    """
+    parts = []
+    try:
+        for i, years in enumerate(archive_groups()):
+            conn = connect_with_archive(years, include_live=(i == 0))
+            try:
+                parts.append(pd.read_sql_query('''
+                    SELECT patient_id, id AS record_id, date, patient_name, phone, location,
+                           risk_level, malignancy_probability, confirmed_diagnosis
+                    FROM all_patients WHERE patient_id = ?
+                ''', conn, params=(patient_id,)))
+            finally:
+                conn.close()
+    except Exception as e:
+        print(f"DB History Error: {e}")
+        return pd.DataFrame()
+    df = pd.concat(parts, ignore_index=True) if len(parts) > 1 else parts[0]
+    return df.sort_values(['date', 'record_id'], kind='stable', ignore_index=True).rename(columns=COLUMN_MAP)
+
+def backfill_patient_ids(chunk=50000):
+    """
+    Assigns patient IDs to records saved before the identity index existed
+    (or loaded without one), a chunk of rows per transaction.
+    Returns the number of records linked.
+    """
+    conn = sqlite3.connect(DB_FILE, timeout=30)
+    linked = 0
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT id, patient_name, phone FROM patients WHERE id > ? AND (patient_id IS NULL OR patient_id = '') "
+                "ORDER BY id LIMIT ?", (last_id, chunk)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = [(resolve_patient_id(conn, name, phone), rid) for rid, name, phone in rows]
+            updates = [u for u in updates if u[0] is not None]
+            conn.executemany("UPDATE patients SET patient_id = ? WHERE id = ?", updates)
+            conn.commit()
+            linked += len(updates)
+        return linked
+    finally:
+        conn.close()
+
+def set_confirmed_diagnosis(record_id, diagnosis):
+    """
+    Records the confirmed outcome (1/0) for a patient row so it can be used
+    for incremental model training.
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        conn.execute("UPDATE patients SET confirmed_diagnosis = ? WHERE id = ?", (int(diagnosis), int(record_id)))
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return False
+    finally:
+        conn.close()
+
+@timed('db.load_labelled_records')
+def load_labelled_records(after_seq=0, limit=None):
+    """
+    Returns rows whose diagnosis was set after label sequence 'after_seq'
+    (in labelling order), with UI column names plus 'id',
+    'confirmed_diagnosis' and 'label_seq'.
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        query = "SELECT * FROM patients WHERE label_seq > ? AND confirmed_diagnosis IS NOT NULL ORDER BY label_seq ASC"
+        params = [int(after_seq)]
+        if limit:
+            # Most recently labelled 'limit' rows, still returned oldest first
+            query = f"SELECT * FROM ({query.replace('ASC', 'DESC')} LIMIT ?) ORDER BY label_seq ASC"
+            params.append(int(limit))
+        df = pd.read_sql_query(query, conn, params=params)
+        return df.rename(columns=COLUMN_MAP)
+    except Exception as e:
+        print(f"DB Load Error: {e}")
+        return pd.DataFrame()
+    finally:
+        conn.close()
+
+@timed('db.save_ct_results')
+def save_ct_results(rows):
+    """
+    Upserts a batch of CT scoring results (dicts with 'scan_path',
+    'probability', 'level', 'model', 'scored_at', 'error') in one transaction.
+    Re-scoring a path replaces its previous result.
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        conn.executemany('''
+            INSERT OR REPLACE INTO ct_scan_results (scan_path, probability, level, model, scored_at, error)
+            VALUES (:scan_path, :probability, :level, :model, :scored_at, :error)
+        ''', rows)
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return False
+    finally:
+        conn.close()
+
+@timed('db.save_appointment')
 def save_appointment(appt_dict):
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
-    params = (
-        appt_dict.get('Patient Name'),
-        appt_dict.get('Patient ID'),
-        appt_dict.get('Date'),
-        appt_dict.get('Time'),
-        appt_dict.get('Type'),
-        appt_dict.get('Status', 'Scheduled')
-    )
+    resource = appt_dict.get('Resource', 'clinic')
+    try:
+        start = datetime.strptime(f"{appt_dict.get('Date')} {appt_dict.get('Time')}", "%Y-%m-%d %H:%M")
+        start_min = int((start - datetime(1970, 1, 1)).total_seconds() // 60)
+        end_min = start_min + int(appt_dict.get('Duration', 30))
+    except (TypeError, ValueError):
+        start_min = end_min = None # Free-text date/time: listed, but not in the slot index
     try:
+        # No conflict check here; src/scheduling.py book() refuses overlaps
+        c.execute("INSERT OR IGNORE INTO schedule_resources (name) VALUES (?)", (resource,))
+        resource_id = c.execute("SELECT id FROM schedule_resources WHERE name = ?", (resource,)).fetchone()[0]
         c.execute('''
-            INSERT INTO appointments (patient_name, patient_id, date, time, type, status)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', params)
+            INSERT INTO appointments (patient_name, patient_id, date, time, type, status,
+                                      start_min, end_min, resource, resource_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            appt_dict.get('Patient Name'),
+            appt_dict.get('Patient ID'),
+            appt_dict.get('Date'),
+            appt_dict.get('Time'),
+            appt_dict.get('Type'),
+            appt_dict.get('Status', 'Scheduled'),
+            start_min, end_min, resource, resource_id
+        ))
         conn.commit()
         return True
     except Exception as e:
@@ -197,6 +998,7 @@ def save_appointment(appt_dict):
     finally:
         conn.close()
 
+@timed('db.load_all_appointments')
 def load_all_appointments():
     conn = sqlite3.connect(DB_FILE)
     try:
@@ -209,8 +1011,28 @@ def load_all_appointments():
         conn.close()
 
 # Initialize on module load
-if not os.path.exists(os.path.dirname(DB_FILE)):
+if os.path.dirname(DB_FILE) and not os.path.exists(os.path.dirname(DB_FILE)):
     os.makedirs(os.path.dirname(DB_FILE))
 
 init_db()
 
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Medical records database maintenance")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill-patient-ids')
+    e = sub.add_parser('export', help="Stream patient records to CSV, gzip CSV or Parquet")
+    e.add_argument('dest', help="Output file (.csv, .csv.gz or .parquet)")
+    e.add_argument('--columns', nargs='*', default=None)
+    e.add_argument('--query', default=None, help="Archive search text")
+    e.add_argument('--start-date', default=None)
+    e.add_argument('--end-date', default=None)
+    e.add_argument('--risk', default=None)
+    e.add_argument('--include-archive', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'backfill-patient-ids':
+        print(f"Linked {backfill_patient_ids()} records to patient IDs")
+    else:
+        rows = export_records(args.dest, None, args.columns, args.query, args.start_date, args.end_date,
+                              args.risk, args.include_archive)
+        print(f"Exported {rows} records to {args.dest}")
@@ -0,0 +1,338 @@
+# Input-Drift and Score-Distribution Monitor
+#
+# Compares incoming assessments with the data the clinical model was trained
+# on. The baseline profile (symptom/gender rates, age and probability
+# histograms of data/lung_cancer.csv) is written next to the model file.
+# The monitor tails new 'patients' rows by id watermark and folds them into
+# fixed-size sketches: one per block of BLOCK_ROWS records, the newest
+# WINDOW_BLOCKS kept, so memory and report cost never grow with the archive.
+#   python -m src.drift baseline
+#   python -m src.drift report
+#   python -m src.drift watch --interval 60
+import os
+import json
+import math
+import time
+import sqlite3
+import argparse
+import threading
+from collections import deque
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+from src import database
+from src.scoring import MODEL_PATH, EXPECTED_FEATURES, load_clinical_model, score_records
+
+DATA_FILE = 'data/lung_cancer.csv'
+STATE_FILE = 'data/drift_state.json'
+AGE_EDGES = [0, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 200]
+PROB_EDGES = [i / 10 for i in range(11)]
+BINARY_FEATURES = [f for f in EXPECTED_FEATURES if f != 'AGE']
+# Sliding window: the newest WINDOW_BLOCKS blocks of BLOCK_ROWS records
+BLOCK_ROWS = 500
+WINDOW_BLOCKS = 20
+# Usual PSI reading: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 significant
+PSI_WARN = 0.1
+PSI_ALERT = 0.25
+EPS = 1e-4
+# Fewer recent records than this are reported but never flagged
+MIN_WINDOW_ROWS = 200
+
+_DB_COLUMNS = {v: k for k, v in database.COLUMN_MAP.items()}
+
+
+def baseline_path(model_path=MODEL_PATH):
+    return os.path.splitext(model_path)[0] + '.baseline.json'
+
+
+def _histogram(values, edges):
+    # Values past the last edge land in the last bin; missing values are skipped
+    values = np.asarray(values, dtype=float)
+    clipped = np.clip(values[~np.isnan(values)], edges[0], edges[-1])
+    return np.histogram(clipped, bins=edges)[0].astype(int).tolist()
+
+
+class Sketch:
+    """
+    Fixed-size summary of a batch of records: per-feature counts of 1s,
+    age and probability histograms. Sketches add up with merge().
+    """
+    def __init__(self):
+        self.n = 0
+        self.ones = {f: 0 for f in BINARY_FEATURES}
+        self.seen = {f: 0 for f in BINARY_FEATURES}
+        self.age = [0] * (len(AGE_EDGES) - 1)
+        self.prob = [0] * (len(PROB_EDGES) - 1)
+
+    def update(self, features, probabilities=None):
+        """
+        features: DataFrame with EXPECTED_FEATURES columns (0/1, AGE numeric;
+        missing answers as NaN). probabilities: optional array of scores.
+        """
+        self.n += len(features)
+        for f in BINARY_FEATURES:
+            col = features[f].dropna()
+            self.seen[f] += int(len(col))
+            self.ones[f] += int((col == 1).sum())
+        ages = features['AGE'].dropna()
+        self.age = [a + b for a, b in zip(self.age, _histogram(ages, AGE_EDGES))]
+        if probabilities is not None and len(probabilities):
+            self.prob = [a + b for a, b in zip(self.prob, _histogram(probabilities, PROB_EDGES))]
+
+    def merge(self, other):
+        self.n += other.n
+        for f in BINARY_FEATURES:
+            self.ones[f] += other.ones[f]
+            self.seen[f] += other.seen[f]
+        self.age = [a + b for a, b in zip(self.age, other.age)]
+        self.prob = [a + b for a, b in zip(self.prob, other.prob)]
+        return self
+
+    def to_dict(self):
+        return {'n': self.n, 'ones': self.ones, 'seen': self.seen, 'age': self.age, 'prob': self.prob}
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls()
+        sketch.n = d['n']
+        sketch.ones.update(d['ones'])
+        sketch.seen.update(d['seen'])
+        sketch.age = list(d['age'])
+        sketch.prob = list(d['prob'])
+        return sketch
+
+
+def psi(expected_counts, actual_counts):
+    """
+    Population Stability Index between two histograms over the same bins.
+    """
+    e = np.asarray(expected_counts, dtype=float)
+    a = np.asarray(actual_counts, dtype=float)
+    if e.sum() == 0 or a.sum() == 0:
+        return None
+    e = np.maximum(e / e.sum(), EPS)
+    a = np.maximum(a / a.sum(), EPS)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def ks_binned(expected_counts, actual_counts):
+    """
+    Two-sample Kolmogorov-Smirnov statistic on binned data (the largest CDF
+    gap at a bin edge; a lower bound on the exact D) and its asymptotic p-value.
+    """
+    e = np.asarray(expected_counts, dtype=float)
+    a = np.asarray(actual_counts, dtype=float)
+    n, m = e.sum(), a.sum()
+    if n == 0 or m == 0:
+        return None, None
+    d = float(np.max(np.abs(np.cumsum(e) / n - np.cumsum(a) / m)))
+    lam = d * math.sqrt(n * m / (n + m))
+    p = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k * k * lam * lam) for k in range(1, 101))
+    return d, float(min(max(p, 0.0), 1.0))
+
+
+def _status(value, n):
+    if value is None:
+        return 'n/a'
+    if n < MIN_WINDOW_ROWS:
+        return 'too few rows'
+    return 'alert' if value > PSI_ALERT else 'warn' if value > PSI_WARN else 'ok'
+
+
+def build_baseline(data_file=DATA_FILE, model=None, model_path=MODEL_PATH):
+    """
+    Profiles the training data (and the model's scores on it) and writes the
+    baseline next to the model file. Returns the baseline dict.
+    """
+    from src.ingest import load_dataset
+    X, _ = load_dataset(data_file)
+    model = model if model is not None else load_clinical_model(model_path)
+    probs = [r['probability'] for r in score_records(X, model=model)]
+    sketch = Sketch()
+    sketch.update(X[EXPECTED_FEATURES], probs)
+    baseline = {
+        'source': data_file,
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'age_edges': AGE_EDGES,
+        'prob_edges': PROB_EDGES,
+        'sketch': sketch.to_dict()
+    }
+    path = baseline_path(model_path)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(baseline, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return baseline
+
+
+def load_baseline(model_path=MODEL_PATH):
+    path = baseline_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline['age_edges'] != AGE_EDGES or baseline['prob_edges'] != PROB_EDGES:
+        print("Drift baseline uses different bins; rebuild it with `python -m src.drift baseline`.")
+        return None
+    return Sketch.from_dict(baseline['sketch'])
+
+
+class DriftMonitor:
+    """
+    Window of recent-record sketches, advanced by poll() from the last id
+    it has seen. State (watermark + blocks) persists in STATE_FILE.
+    """
+    def __init__(self, state_file=STATE_FILE):
+        self.state_file = state_file
+        self.watermark = 0
+        self.blocks = deque(maxlen=WINDOW_BLOCKS)
+        self.current = Sketch()
+        self._lock = threading.Lock()
+        if os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+            if state.get('db') != os.path.abspath(database.DB_FILE):
+                return  # State of another database: start over
+            self.watermark = state['watermark']
+            self.blocks.extend(Sketch.from_dict(b) for b in state['blocks'])
+            self.current = Sketch.from_dict(state['current'])
+
+    def _fold(self, features, probs):
+        # Fill the open block; full blocks roll into the window
+        start = 0
+        while start < len(features):
+            take = min(BLOCK_ROWS - self.current.n, len(features) - start)
+            self.current.update(features.iloc[start:start + take], probs[start:start + take])
+            start += take
+            if self.current.n >= BLOCK_ROWS:
+                self.blocks.append(self.current)
+                self.current = Sketch()
+
+    def poll(self, chunk=20000, max_rows=None):
+        """
+        Folds rows saved since the last poll into the window (at most the
+        newest WINDOW_BLOCKS * BLOCK_ROWS of them are read on a first run).
+        Returns the number of rows added.
+        """
+        cols = ', '.join(['id', 'malignancy_probability'] + [_DB_COLUMNS[f] for f in EXPECTED_FEATURES])
+        with self._lock:
+            conn = sqlite3.connect(database.DB_FILE)
+            try:
+                if self.watermark == 0:
+                    # First run: start from the window's worth of newest rows
+                    newest = conn.execute("SELECT MAX(id) FROM patients").fetchone()[0] or 0
+                    self.watermark = max(0, newest - WINDOW_BLOCKS * BLOCK_ROWS)
+                added = 0
+                while max_rows is None or added < max_rows:
+                    rows = conn.execute(
+                        f"SELECT {cols} FROM patients WHERE id > ? ORDER BY id LIMIT ?",
+                        (self.watermark, chunk)).fetchall()
+                    if not rows:
+                        break
+                    df = pd.DataFrame(rows, columns=['id', 'prob'] + EXPECTED_FEATURES)
+                    features = df[EXPECTED_FEATURES].apply(pd.to_numeric, errors='coerce')
+                    self._fold(features, df['prob'].to_numpy(dtype=float))
+                    self.watermark = int(df['id'].iloc[-1])
+                    added += len(df)
+            finally:
+                conn.close()
+            self._save()
+        return added
+
+    def _save(self):
+        state = {
+            'db': os.path.abspath(database.DB_FILE),
+            'watermark': self.watermark,
+            'blocks': [b.to_dict() for b in self.blocks],
+            'current': self.current.to_dict()
+        }
+        tmp = f"{self.state_file}.tmp{os.getpid()}"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def window(self):
+        merged = Sketch()
+        for block in self.blocks:
+            merged.merge(block)
+        return merged.merge(self.current)
+
+    def report(self, baseline=None):
+        """
+        PSI per feature plus PSI/KS for age and probability, recent window
+        vs. baseline. Returns a dict; 'rows' is one entry per statistic.
+        """
+        baseline = baseline or load_baseline()
+        if baseline is None:
+            return {'error': "No drift baseline for the current model. Run `python -m src.drift baseline`."}
+        recent = self.window()
+        rows = []
+        for f in BINARY_FEATURES:
+            if not recent.seen[f]:
+                continue
+            base_rate = baseline.ones[f] / max(baseline.seen[f], 1)
+            rate = recent.ones[f] / recent.seen[f]
+            value = psi([baseline.seen[f] - baseline.ones[f], baseline.ones[f]],
+                        [recent.seen[f] - recent.ones[f], recent.ones[f]])
+            rows.append({'feature': f.strip(), 'baseline': base_rate, 'recent': rate,
+                         'psi': value, 'ks': None, 'ks_p': None, 'status': _status(value, recent.n)})
+        for name, base_hist, hist in (('AGE', baseline.age, recent.age),
+                                      ('Probability', baseline.prob, recent.prob)):
+            value = psi(base_hist, hist)
+            d, p = ks_binned(base_hist, hist)
+            rows.append({'feature': name, 'baseline': None, 'recent': None,
+                         'psi': value, 'ks': d, 'ks_p': p, 'status': _status(value, recent.n)})
+        return {'window_rows': recent.n, 'watermark': self.watermark, 'rows': rows,
+                'alerts': [r['feature'] for r in rows if r['status'] == 'alert']}
+
+
+_monitor = None
+
+
+def get_monitor():
+    global _monitor
+    if _monitor is None:
+        _monitor = DriftMonitor()
+    return _monitor
+
+
+def _print_report(report):
+    if 'error' in report:
+        print(report['error'])
+        return
+    print(f"Drift over the last {report['window_rows']} records (up to id {report['watermark']})")
+    for r in report['rows']:
+        psi_txt = f"{r['psi']:.3f}" if r['psi'] is not None else '  n/a'
+        extra = f"  KS={r['ks']:.3f} p={r['ks_p']:.3g}" if r['ks'] is not None else \
+            f"  {r['baseline']:.1%} -> {r['recent']:.1%}"
+        print(f"  {r['feature']:22s} PSI={psi_txt} [{r['status']}]{extra}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Input-drift and score-distribution monitor")
+    sub = parser.add_subparsers(dest='command', required=True)
+    b = sub.add_parser('baseline')
+    b.add_argument('--data', default=DATA_FILE)
+    sub.add_parser('report')
+    w = sub.add_parser('watch')
+    w.add_argument('--interval', type=float, default=60)
+    args = parser.parse_args()
+
+    if args.command == 'baseline':
+        base = build_baseline(args.data)
+        print(f"Baseline from {base['sketch']['n']} training rows written to {baseline_path()}")
+    elif args.command == 'report':
+        monitor = get_monitor()
+        monitor.poll()
+        _print_report(monitor.report())
+    else:
+        monitor = get_monitor()
+        try:
+            while True:
+                if monitor.poll():
+                    report = monitor.report()
+                    if report.get('alerts'):
+                        print(f"{datetime.now():%H:%M:%S} DRIFT ALERT: {', '.join(report['alerts'])}")
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            pass
@@ -1,33 +1,324 @@
-
+# Streaming Dataset Profiler
+#
+# One pass over the CSV in chunks; every statistic is kept as mergeable
+# running sums so partitions can be profiled in parallel and combined.
+#   python -m src.eda [path] [--partitions 4] [--chunksize 100000] [--no-cache]
+import os
+import io
+import json
+import hashlib
+import argparse
+import numpy as np
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
-
-# Load the dataset
-df = pd.read_csv('data/lung_cancer.csv')
-
-# Basic Info
-print("Basic Info:")
-print(df.info())
-print("\nDescription:")
-print(df.describe())
-print("\nFirst 5 rows:")
-print(df.head())
-
-# Check for missing values
-print("\nMissing values:")
-print(df.isnull().sum())
-
-# Target Distribution
-print("\nTarget Distribution:")
-print(df['LUNG_CANCER'].value_counts())
-
-# Data Cleaning for Correlation (Convert YES/NO to 1/0 and M/F to 1/0)
-df_clean = df.copy()
-df_clean['LUNG_CANCER'] = df_clean['LUNG_CANCER'].map({'YES': 1, 'NO': 0})
-df_clean['GENDER'] = df_clean['GENDER'].map({'M': 1, 'F': 0})
-
-# Correlation Matrix
-print("\nCorrelation Matrix:")
-corr = df_clean.corr()
-print(corr['LUNG_CANCER'].sort_values(ascending=False))
+from concurrent.futures import ProcessPoolExecutor
+
+DATA_FILE = 'data/lung_cancer.csv'
+TARGET = 'LUNG_CANCER'
+CACHE_DIR = 'data/.eda_cache'
+CHUNK_SIZE = 100_000
+
+# Same cleaning as before: YES/NO and M/F to 1/0 before correlating
+ENCODINGS = {
+    'LUNG_CANCER': {'YES': 1, 'NO': 0},
+    'GENDER': {'M': 1, 'F': 0}
+}
+
+
+class StreamingProfile:
+    """
+    Running statistics for one or more chunks of the dataset.
+    Per column: count, missing, min/max and mean/M2 (Welford, merged with
+    Chan's formula). Per column pair: sums over rows where both values are
+    present, so correlations match pandas' pairwise-complete corr().
+    """
+    def __init__(self):
+        self.columns = None
+        self.dtypes = {}
+        self.rows = 0
+        self.missing = None
+        self.count = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+        self.shift = None
+        self.pair_n = None
+        self.pair_sx = None
+        self.pair_sxx = None
+        self.pair_sxy = None
+        self.target_counts = {}
+        self.head = None
+
+    def _init_columns(self, df):
+        self.columns = df.columns.tolist()
+        self.missing = np.zeros(len(self.columns), dtype=np.int64)
+        self.numeric = [c for c in self.columns if c in ENCODINGS or pd.api.types.is_numeric_dtype(df[c])]
+        k = len(self.numeric)
+        self.count = np.zeros(k, dtype=np.int64)
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.shift = None
+        self.pair_n = np.zeros((k, k))
+        self.pair_sx = np.zeros((k, k))
+        self.pair_sxx = np.zeros((k, k))
+        self.pair_sxy = np.zeros((k, k))
+
+    def update(self, df):
+        if self.columns is None:
+            self._init_columns(df)
+            self.head = df.head(5)
+        for col in df.columns:
+            self.dtypes[col] = self.dtypes.get(col) or str(df[col].dtype)
+        self.rows += len(df)
+        self.missing += df[self.columns].isnull().sum().to_numpy()
+
+        if TARGET in df.columns:
+            for value, n in df[TARGET].value_counts().items():
+                self.target_counts[value] = self.target_counts.get(value, 0) + int(n)
+
+        encoded = df[self.numeric].copy()
+        for col, mapping in ENCODINGS.items():
+            if col in encoded.columns and not pd.api.types.is_numeric_dtype(encoded[col]):
+                encoded[col] = encoded[col].map(mapping)
+        x = encoded.to_numpy(dtype=float)
+        present = ~np.isnan(x)
+
+        # Column moments: chunk mean/M2, merged with Chan's parallel update
+        n_b = present.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(n_b > 0, np.nansum(x, axis=0) / np.maximum(n_b, 1), 0.0)
+        m2_b = np.nansum((x - mean_b) ** 2, axis=0)
+        self._merge_moments(n_b, mean_b, m2_b)
+        if len(x):
+            self.min = np.fmin(self.min, np.nanmin(np.where(present, x, np.inf), axis=0))
+            self.max = np.fmax(self.max, np.nanmax(np.where(present, x, -np.inf), axis=0))
+
+        # Pairwise sums on shifted data (shift = first chunk mean) for stability
+        if self.shift is None:
+            self.shift = mean_b.copy()
+        xs = np.where(present, x - self.shift, 0.0)
+        mask = present.astype(float)
+        self.pair_n += mask.T @ mask
+        self.pair_sx += xs.T @ mask
+        self.pair_sxx += (xs * xs).T @ mask
+        self.pair_sxy += xs.T @ xs
+        return self
+
+    def _merge_moments(self, n_b, mean_b, m2_b):
+        n_a = self.count
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean_b - self.mean
+            self.mean = np.where(n > 0, self.mean + delta * n_b / np.maximum(n, 1), 0.0)
+            self.m2 = self.m2 + m2_b + np.where(n > 0, delta ** 2 * n_a * n_b / np.maximum(n, 1), 0.0)
+        self.count = n
+
+    def merge(self, other):
+        """
+        Folds another partition's profile into this one.
+        """
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self.__dict__.update({k: (v.copy() if hasattr(v, 'copy') else v) for k, v in other.__dict__.items()})
+            return self
+        self.rows += other.rows
+        self.missing += other.missing
+        for col, dtype in other.dtypes.items():
+            self.dtypes.setdefault(col, dtype)
+        for value, n in other.target_counts.items():
+            self.target_counts[value] = self.target_counts.get(value, 0) + n
+        self._merge_moments(other.count, other.mean, other.m2)
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+
+        # Re-express the other partition's pair sums around our shift
+        d = other.shift - self.shift
+        d_i = d[:, None]
+        d_j = d[None, :]
+        sx = other.pair_sx + d_i * other.pair_n
+        sxx = other.pair_sxx + 2 * d_i * other.pair_sx + d_i ** 2 * other.pair_n
+        sxy = (other.pair_sxy + d_j * other.pair_sx + d_i * other.pair_sx.T
+               + d_i * d_j * other.pair_n)
+        self.pair_n += other.pair_n
+        self.pair_sx += sx
+        self.pair_sxx += sxx
+        self.pair_sxy += sxy
+        return self
+
+    def correlation(self):
+        n = self.pair_n
+        sx, sy = self.pair_sx, self.pair_sx.T
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = self.pair_sxy - sx * sy / n
+            var_x = self.pair_sxx - sx ** 2 / n
+            var_y = self.pair_sxx.T - sy ** 2 / n
+            corr = cov / np.sqrt(var_x * var_y)
+        return pd.DataFrame(corr, index=self.numeric, columns=self.numeric)
+
+    def describe(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.m2 / (self.count - 1))
+        return pd.DataFrame({
+            'count': self.count, 'mean': self.mean, 'std': std,
+            'min': self.min, 'max': self.max
+        }, index=self.numeric).T
+
+    def to_dict(self):
+        return {
+            'columns': self.columns, 'numeric': self.numeric, 'dtypes': self.dtypes,
+            'rows': self.rows, 'missing': self.missing.tolist(),
+            'count': self.count.tolist(), 'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+            'min': self.min.tolist(), 'max': self.max.tolist(), 'shift': self.shift.tolist(),
+            'pair_n': self.pair_n.tolist(), 'pair_sx': self.pair_sx.tolist(),
+            'pair_sxx': self.pair_sxx.tolist(), 'pair_sxy': self.pair_sxy.tolist(),
+            'target_counts': {str(k): v for k, v in self.target_counts.items()},
+            'head': self.head.to_dict(orient='list') if self.head is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        profile = cls()
+        for key in ('columns', 'numeric', 'dtypes', 'rows', 'target_counts'):
+            setattr(profile, key, data[key])
+        for key in ('missing', 'count'):
+            setattr(profile, key, np.array(data[key], dtype=np.int64))
+        for key in ('mean', 'm2', 'min', 'max', 'shift', 'pair_n', 'pair_sx', 'pair_sxx', 'pair_sxy'):
+            setattr(profile, key, np.array(data[key], dtype=float))
+        profile.head = pd.DataFrame(data['head']) if data.get('head') else None
+        return profile
+
+
+def _read_csv(source, header, chunksize):
+    return pd.read_csv(source, names=header, header=None, chunksize=chunksize)
+
+
+class _RangeReader(io.RawIOBase):
+    """
+    Read-only view of bytes [begin, stop) of an open file, so read_csv
+    pulls one chunk at a time instead of the whole range.
+    """
+    def __init__(self, f, begin, stop):
+        self.f = f
+        self.remaining = stop - begin
+        f.seek(begin)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        n = self.f.readinto(memoryview(buf)[:min(len(buf), self.remaining)])
+        self.remaining -= n
+        return n
+
+
+def _profile_range(args):
+    """
+    Profiles the rows whose first byte falls in [start, end). Peak memory
+    is one chunk, not the range.
+    """
+    path, start, end, header, chunksize = args
+    profile = StreamingProfile()
+    with open(path, 'rb') as f:
+        # Stepping back one byte and finishing that line lands on the first
+        # line starting at or after the offset
+        f.seek(start - 1)
+        f.readline()
+        begin = f.tell()
+        if begin >= end:
+            return profile
+        f.seek(end - 1)
+        f.readline()
+        stop = f.tell()
+        reader = io.BufferedReader(_RangeReader(f, begin, stop), buffer_size=1 << 20)
+        for chunk in _read_csv(reader, header, chunksize):
+            profile.update(chunk)
+    return profile
+
+
+def cache_key(path):
+    # File identity from stat(): no second pass over the data to check the cache
+    st = os.stat(path)
+    ident = f"{os.path.abspath(path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha256(ident.encode()).hexdigest()
+
+
+def profile_file(path=DATA_FILE, chunksize=CHUNK_SIZE, partitions=1, use_cache=True):
+    """
+    Profiles a CSV in one streaming pass. With partitions > 1 the file is
+    split into byte ranges profiled in parallel and merged. Results are
+    cached under CACHE_DIR keyed by the file's path, size and mtime.
+    """
+    cache_path = None
+    if use_cache:
+        cache_path = os.path.join(CACHE_DIR, cache_key(path) + '.json')
+        if os.path.exists(cache_path):
+            with open(cache_path) as f:
+                return StreamingProfile.from_dict(json.load(f))
+
+    with open(path, 'rb') as f:
+        header_line = f.readline()
+        body_start = f.tell()
+    header = pd.read_csv(io.BytesIO(header_line), nrows=0, encoding='utf-8-sig').columns.tolist()
+    size = os.path.getsize(path)
+
+    partitions = max(1, partitions)
+    bounds = np.linspace(body_start, size, partitions + 1).astype(int)
+    jobs = [(path, int(bounds[i]), int(bounds[i + 1]), header, chunksize) for i in range(partitions)]
+    if partitions == 1:
+        parts = [_profile_range(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=partitions) as ex:
+            parts = list(ex.map(_profile_range, jobs))
+
+    profile = StreamingProfile()
+    for part in parts:
+        profile.merge(part)
+
+    if cache_path:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump(profile.to_dict(), f)
+    return profile
+
+
+def print_report(profile):
+    # Basic Info
+    print("Basic Info:")
+    print(f"{profile.rows} rows, {len(profile.columns)} columns")
+    info = pd.DataFrame({
+        'non-null': profile.rows - profile.missing,
+        'dtype': [profile.dtypes.get(c) for c in profile.columns]
+    }, index=profile.columns)
+    print(info)
+    print("\nDescription:")
+    print(profile.describe())
+    print("\nFirst 5 rows:")
+    print(profile.head)
+
+    # Check for missing values
+    print("\nMissing values:")
+    print(pd.Series(profile.missing, index=profile.columns))
+
+    # Target Distribution
+    if profile.target_counts:
+        print("\nTarget Distribution:")
+        print(pd.Series(profile.target_counts, name='count').sort_values(ascending=False))
+
+    # Correlation Matrix
+    corr = profile.correlation()
+    if TARGET in corr.columns:
+        print("\nCorrelation Matrix:")
+        print(corr[TARGET].sort_values(ascending=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Single-pass streaming dataset profile")
+    parser.add_argument('path', nargs='?', default=DATA_FILE)
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--partitions', type=int, default=1)
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args()
+    print_report(profile_file(args.path, args.chunksize, args.partitions, not args.no_cache))
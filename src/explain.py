@@ -0,0 +1,140 @@
+# Per-Prediction Feature Attribution for the Clinical Forest
+#
+# Decision-path attribution (Saabas / treeinterpreter): walking a tree from
+# root to leaf, each split changes the predicted cancer probability, and that
+# change is credited to the split feature. Summed along the path this gives
+#   tree probability = root value + sum of feature contributions
+# and averaging over trees gives the same for the forest's predict_proba.
+#
+# Contributions only depend on the leaf, so they are precomputed once per
+# model version as one (total nodes, n_features) table. Explaining a batch is
+# then a leaf lookup per tree plus a gather and a mean.
+import os
+import threading
+import numpy as np
+import pandas as pd
+from src.metrics import timed
+from src.scoring import MODEL_PATH, EXPECTED_FEATURES, load_clinical_model, build_feature_frame
+
+# Readable names for report / UI output
+FEATURE_LABELS = {
+    'GENDER': 'Gender (Male)', 'AGE': 'Age', 'SMOKING': 'Smoking',
+    'YELLOW_FINGERS': 'Yellow Fingers', 'ANXIETY': 'Anxiety', 'PEER_PRESSURE': 'Peer Pressure',
+    'CHRONIC DISEASE': 'Chronic Disease', 'FATIGUE ': 'Fatigue', 'ALLERGY ': 'Allergy',
+    'WHEEZING': 'Wheezing', 'ALCOHOL CONSUMING': 'Alcohol Consumption', 'COUGHING': 'Coughing',
+    'SHORTNESS OF BREATH': 'Shortness of Breath', 'SWALLOWING DIFFICULTY': 'Swallowing Difficulty',
+    'CHEST PAIN': 'Chest Pain'
+}
+
+
+class ForestExplainer:
+    def __init__(self, model, positive_class=1):
+        self.model = model
+        self.feature_names = list(getattr(model, 'feature_names_in_', EXPECTED_FEATURES))
+        self.class_index = int(np.flatnonzero(model.classes_ == positive_class)[0])
+        n_features = len(self.feature_names)
+
+        tables = []
+        offsets = []
+        biases = []
+        total = 0
+        for est in model.estimators_:
+            tree = est.tree_
+            table, root_value = self._tree_table(tree, n_features)
+            tables.append(table)
+            offsets.append(total)
+            biases.append(root_value)
+            total += tree.node_count
+        # Indexed by offset[tree] + node id; only leaf rows are ever read
+        self.table = np.vstack(tables).astype(np.float32)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.bias = float(np.mean(biases))
+
+    def _tree_table(self, tree, n_features):
+        values = tree.value[:, 0, :]
+        totals = values.sum(axis=1, keepdims=True)
+        probs = np.divide(values, totals, out=np.zeros_like(values), where=totals > 0)[:, self.class_index]
+
+        table = np.zeros((tree.node_count, n_features), dtype=np.float64)
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            left, right = tree.children_left[node], tree.children_right[node]
+            if left == -1:
+                continue
+            feature = tree.feature[node]
+            for child in (left, right):
+                table[child] = table[node]
+                table[child, feature] += probs[child] - probs[node]
+                stack.append(child)
+        return table, probs[0]
+
+    @timed('explain.contributions')
+    def contributions(self, X):
+        """
+        Returns (bias, contributions array of shape (n_samples, n_features))
+        for the positive-class probability. bias + row sum == predict_proba.
+        """
+        # Calling the Cython tree_.apply directly skips the per-call validation
+        # and joblib dispatch of model.apply, which dominate for a single row
+        X32 = np.ascontiguousarray(np.asarray(X, dtype=np.float32))
+        leaves = np.column_stack([est.tree_.apply(X32) for est in self.model.estimators_])
+        rows = leaves + self.offsets[None, :]
+        contrib = self.table[rows].mean(axis=1, dtype=np.float64)
+        return self.bias, contrib
+
+    def explain(self, X, top=None):
+        """
+        Returns one dict per row: {'bias', 'probability', 'contributions'}
+        where contributions maps feature name -> probability change, sorted
+        by absolute effect (optionally only the 'top' largest).
+        """
+        bias, contrib = self.contributions(X)
+        results = []
+        for row in contrib:
+            order = np.argsort(-np.abs(row))
+            if top:
+                order = order[:top]
+            results.append({
+                'bias': bias,
+                'probability': float(bias + row.sum()),
+                'contributions': {self.feature_names[i]: float(row[i]) for i in order}
+            })
+        return results
+
+
+_lock = threading.Lock()
+_explainers = {}
+
+
+def get_explainer(model_path=MODEL_PATH):
+    """
+    Returns the explainer for the model currently at model_path, rebuilding
+    the path tables only when the file changes (a new model version).
+    """
+    mtime = os.path.getmtime(model_path)
+    cached = _explainers.get(model_path)
+    if cached is None or cached[0] != mtime:
+        with _lock:
+            cached = _explainers.get(model_path)
+            if cached is None or cached[0] != mtime:
+                cached = (mtime, ForestExplainer(load_clinical_model(model_path)))
+                _explainers[model_path] = cached
+    return cached[1]
+
+
+def explain_records(rows, top=None, model_path=MODEL_PATH):
+    """
+    Explains one or more patient rows (dicts keyed by model features).
+    """
+    return get_explainer(model_path).explain(build_feature_frame(rows), top=top)
+
+
+def format_contributions(contributions):
+    """
+    Turns a contributions dict into a display frame (label, effect in % points).
+    """
+    return pd.DataFrame({
+        'Factor': [FEATURE_LABELS.get(k, k) for k in contributions],
+        'Effect on risk (pp)': [round(v * 100, 1) for v in contributions.values()]
+    })
@@ -1,15 +1,135 @@
-
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageFilter
 import os
+import csv
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+# Scan edge lengths used for corpus runs (150 = model input, up to ~16 MP)
+DEFAULT_SIZES = [150, 512, 1024, 2048, 4096]
+DEFAULT_FORMATS = ['jpg', 'png']
+MANIFEST_NAME = 'manifest.csv'
+
+
+def generate_scan(size=150, nodules=None, noise=0.0, seed=None):
+    """
+    Draws a synthetic axial CT slice: body outline, two lungs and optional
+    bright nodules. Returns (PIL image, list of nodule boxes).
+    Args:
+        size: Edge length in pixels (square image).
+        nodules: Number of nodules; random 0-3 when None.
+        noise: Std-dev of Gaussian pixel noise (0-255 scale).
+        seed: RNG seed for reproducible scans.
+    """
+    rng = np.random.default_rng(seed)
+    img = Image.new('L', (size, size), color=0)
+    d = ImageDraw.Draw(img)
+
+    # Body and lung fields
+    margin = size * rng.uniform(0.08, 0.15)
+    d.ellipse((margin, margin * 1.3, size - margin, size - margin * 1.3), fill=int(rng.integers(100, 140)))
+    lung_w, lung_h = size * 0.28, size * 0.5
+    cy = size / 2
+    lungs = []
+    for cx in (size * 0.33, size * 0.67):
+        box = (cx - lung_w / 2, cy - lung_h / 2, cx + lung_w / 2, cy + lung_h / 2)
+        d.ellipse(box, fill=int(rng.integers(20, 50)))
+        lungs.append(box)
+
+    # Nodules inside the lung fields
+    if nodules is None:
+        nodules = int(rng.integers(0, 4))
+    boxes = []
+    for _ in range(nodules):
+        x0, y0, x1, y1 = lungs[int(rng.integers(0, 2))]
+        r = size * rng.uniform(0.015, 0.06)
+        nx = rng.uniform(x0 + lung_w * 0.25, x1 - lung_w * 0.25)
+        ny = rng.uniform(y0 + lung_h * 0.2, y1 - lung_h * 0.2)
+        box = (nx - r, ny - r, nx + r, ny + r)
+        d.ellipse(box, fill=int(rng.integers(200, 256)))
+        boxes.append([round(v) for v in box])
+
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(size / 300, 0.5)))
+    if noise > 0:
+        arr = np.asarray(img, dtype=np.float32)
+        arr += rng.standard_normal(arr.shape, dtype=np.float32) * noise
+        img = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+    return img.convert('RGB'), boxes
+
+
+def _write_scan(job):
+    index, out_dir, size, fmt, noise, seed = job
+    img, boxes = generate_scan(size, noise=noise, seed=seed)
+    filename = f"scan_{index:06d}_{size}.{fmt}"
+    path = os.path.join(out_dir, filename)
+    if fmt == 'jpg':
+        img.save(path, quality=90)
+    else:
+        # Fast deflate; noisy multi-megapixel PNGs take seconds at the default level
+        img.save(path, compress_level=1)
+    return {
+        'file': filename,
+        'width': size,
+        'height': size,
+        'format': fmt,
+        'bytes': os.path.getsize(path),
+        'nodules': len(boxes),
+        'label': 1 if boxes else 0,
+        'boxes': json.dumps(boxes),
+        'seed': seed
+    }
+
+
+def generate_corpus(out_dir, count, sizes=None, formats=None, max_noise=12.0, seed=0, workers=None):
+    """
+    Generates 'count' scans in parallel across cores and writes manifest.csv
+    (file, size, format, nodule label and boxes) next to them.
+    """
+    sizes = sizes or DEFAULT_SIZES
+    formats = formats or DEFAULT_FORMATS
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    jobs = [
+        (i, out_dir, int(rng.choice(sizes)), str(rng.choice(formats)),
+         float(rng.uniform(0, max_noise)), seed * 1_000_003 + i)
+        for i in range(count)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        rows = list(ex.map(_write_scan, jobs, chunksize=16))
+
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    with open(manifest_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()) if rows else ['file'])
+        writer.writeheader()
+        writer.writerows(rows)
+    return manifest_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic CT scans")
+    parser.add_argument('--count', type=int, default=0, help="Corpus size (0 writes the single demo scan)")
+    parser.add_argument('--out-dir', default='data/synthetic_ct')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--formats', nargs='+', choices=['jpg', 'png'], default=DEFAULT_FORMATS)
+    parser.add_argument('--max-noise', type=float, default=12.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.count <= 0:
+        # Create dummy image
+        img = Image.new('RGB', (150, 150), color='black')
+        d = ImageDraw.Draw(img)
+        d.ellipse((25, 25, 125, 125), fill='gray')
+        d.ellipse((60, 60, 90, 90), fill='white')
 
-# Create dummy image
-img = Image.new('RGB', (150, 150), color='black')
-d = ImageDraw.Draw(img)
-d.ellipse((25, 25, 125, 125), fill='gray')
-d.ellipse((60, 60, 90, 90), fill='white')
-
-# Save
-if not os.path.exists('data'):
-    os.makedirs('data')
-img.save('data/sample_ct_scan.jpg')
-print("Dummy CT scan image saved to data/sample_ct_scan.jpg")
+        # Save
+        if not os.path.exists('data'):
+            os.makedirs('data')
+        img.save('data/sample_ct_scan.jpg')
+        print("Dummy CT scan image saved to data/sample_ct_scan.jpg")
+    else:
+        manifest = generate_corpus(args.out_dir, args.count, args.sizes, args.formats,
+                                   args.max_noise, args.seed, args.workers)
+        print(f"{args.count} synthetic scans written to {args.out_dir} (manifest: {manifest})")
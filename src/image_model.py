@@ -2,11 +2,18 @@
 import numpy as np
 import os
 
+try:
+    from src.metrics import timed, track
+    from src.scan_loader import load_scan, ScanTooLarge
+except ImportError:
+    # Running as a script from inside src/
+    from metrics import timed, track
+    from scan_loader import load_scan, ScanTooLarge
+
 try:
     import tensorflow as tf
     from tensorflow.keras.models import Sequential, load_model
     from tensorflow.keras.layers import Conv2D, MaxPooling2D, Flatten, Dense, Dropout
-    from tensorflow.keras.preprocessing.image import load_img, img_to_array
     TF_AVAILABLE = True
 except ImportError:
     TF_AVAILABLE = False
@@ -15,6 +22,10 @@ except ImportError:
 MODEL_PATH = 'models/ct_scan_model.h5'
 IMG_SIZE = (150, 150)
 
+# 'keras' (default) or 'tflite' (see src/tflite_backend.py for the export step)
+INFERENCE_BACKEND = os.environ.get('CT_INFERENCE_BACKEND', 'keras')
+TFLITE_MODEL_PATH = os.environ.get('CT_TFLITE_MODEL', 'models/ct_scan_model.tflite')
+
 def create_model():
     """
     Creates a simple CNN model for Lung Cancer classification (Normal vs Cancer).
@@ -42,6 +53,60 @@ def create_model():
     model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
+_model_cache = {}
+
+def _load_backend():
+    if INFERENCE_BACKEND == 'tflite':
+        if not os.path.exists(TFLITE_MODEL_PATH):
+            return None, None
+        from src.tflite_backend import TFLiteBackend
+        return TFLITE_MODEL_PATH, TFLiteBackend
+    if not TF_AVAILABLE or not os.path.exists(MODEL_PATH):
+        return None, None
+    return MODEL_PATH, load_model
+
+def get_model():
+    """
+    Loads the CT model once per process and reuses it across predictions.
+    Returns None if the configured backend or its model file is unavailable.
+    """
+    path, loader = _load_backend()
+    if path is None:
+        return None
+    mtime = os.path.getmtime(path)
+    cached = _model_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with track('image.model_load'):
+            model = loader(path)
+        cached = _model_cache[path] = (mtime, model)
+    return cached[1]
+
+def preprocess_image(image_file):
+    """
+    Decodes and resizes a path or file-like object to a (150, 150, 3) float32
+    array scaled to 0-1. Large scans are decoded at reduced resolution
+    (see src/scan_loader.py); raises ScanTooLarge past CT_MAX_DECODE_MB.
+    """
+    img_array = load_scan(image_file, IMG_SIZE)
+    return img_array.astype(np.float32) / 255.0  # Rescale
+
+@timed('image.predict_batch')
+def predict_batch(img_arrays):
+    """
+    Runs one batched forward pass over preprocessed arrays.
+    Returns a list of cancer probabilities (random when no model is available).
+    """
+    if len(img_arrays) == 0:
+        return []
+    model = get_model()
+    if model is None:
+        return [float(p) for p in np.random.random(len(img_arrays))]
+    batch = np.stack(img_arrays)
+    with track('image.inference'):
+        prediction = model.predict(batch, verbose=0)
+    return [float(p) for p in prediction[:, 0]]
+
+@timed('image.predict_image')
 def predict_image(image_file):
     """
     Predicts if a CT scan image shows cancer.
@@ -50,33 +115,22 @@ def predict_image(image_file):
     Returns:
         prob: Probability of cancer (0-1).
     """
-    if not TF_AVAILABLE:
+    if not TF_AVAILABLE and INFERENCE_BACKEND != 'tflite':
         # Simulation mode for demo
         # Deterministic random based on file size or name to be consistent?
         # Or just random
         return np.random.random()
 
-    if not os.path.exists(MODEL_PATH):
+    if get_model() is None:
         print("Model not found. Using random prediction.")
         return np.random.random()
 
     try:
-        model = load_model(MODEL_PATH)
-        
-        # Preprocess image
-        # If image_file is a path str
-        if isinstance(image_file, str):
-            img = load_img(image_file, target_size=IMG_SIZE)
-        else:
-            # If it's a file-like object (Buffer) from Streamlit, load_img might handle it or need conversion
-            img = load_img(image_file, target_size=IMG_SIZE)
-            
-        img_array = img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)  # Create batch axis
-        img_array = img_array / 255.0  # Rescale
-        
-        prediction = model.predict(img_array)
-        return float(prediction[0][0])
+        # Preprocess image (accepts paths and Streamlit buffers alike)
+        img_array = preprocess_image(image_file)
+        return predict_batch([img_array])[0]
+    except ScanTooLarge:
+        raise
     except Exception as e:
         print(f"Error during prediction: {e}")
         return np.random.random()
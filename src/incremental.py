@@ -0,0 +1,181 @@
+# Incremental Clinical Model Updates
+#
+# Pulls patient records labelled since the last model version (tracked by a
+# watermark on patients.label_seq, the order labels were set in, so a label
+# added later to an old record is still picked up), adds trees trained on a
+# sliding window of recently labelled records, and publishes a new versioned
+# model atomically.
+#   python -m src.incremental --mode grow --trees 20
+#   python -m src.incremental --mode replace --trees 20 --window 5000
+import os
+import json
+import argparse
+from datetime import datetime
+import joblib
+import numpy as np
+from sklearn.metrics import accuracy_score, recall_score
+
+from src import database
+from src.scoring import MODEL_PATH, build_feature_frame, check_features
+
+VERSIONS_DIR = 'models/versions'
+REGISTRY_FILE = 'models/model_registry.json'
+
+DEFAULT_TREES = 20
+DEFAULT_WINDOW = 5000
+MIN_NEW_RECORDS = 50
+# Upper bound on forest size in 'grow' mode; older trees are dropped past it
+MAX_TREES = 400
+
+
+def _atomic_write(path, write_fn):
+    tmp = f"{path}.tmp{os.getpid()}"
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+
+def _write_json(path, data):
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
+
+
+def read_registry():
+    """
+    Returns the model registry, registering the existing model file as
+    version 1 (watermark 0) the first time it is read.
+    """
+    if os.path.exists(REGISTRY_FILE):
+        with open(REGISTRY_FILE) as f:
+            return json.load(f)
+    registry = {'current': None, 'versions': []}
+    if os.path.exists(MODEL_PATH):
+        model = joblib.load(MODEL_PATH)
+        registry = _register(registry, model, watermark=0, mode='full', rows=None)
+    return registry
+
+
+def current_version():
+    registry = read_registry()
+    return registry['versions'][-1] if registry['versions'] else None
+
+
+def _register(registry, model, watermark, mode, rows, metrics=None, before_registry=None):
+    # 'before_registry' runs after the version file is stored and before the
+    # registry names it current (publish_model swaps MODEL_PATH there)
+    version = (registry['versions'][-1]['version'] + 1) if registry['versions'] else 1
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    path = os.path.join(VERSIONS_DIR, f"lung_cancer_model_v{version:04d}.pkl")
+    _atomic_write(path, lambda tmp: joblib.dump(model, tmp))
+    if before_registry:
+        before_registry()
+
+    entry = {
+        'version': version,
+        'path': path,
+        'watermark': int(watermark),
+        'n_estimators': len(getattr(model, 'estimators_', [])),
+        'mode': mode,
+        'rows': rows,
+        'metrics': metrics or {},
+        'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    registry = {'current': version, 'versions': registry['versions'] + [entry]}
+    _atomic_write(REGISTRY_FILE, lambda tmp: _write_json(tmp, registry))
+    return registry
+
+
+def publish_model(model, watermark, mode, rows, metrics=None):
+    """
+    Stores 'model' as the next version and swaps it in as MODEL_PATH with a
+    rename, so the app never loads a half-written pickle. The registry is
+    written last: a crash before that leaves it naming the previous version,
+    and the next update retrains from that version's watermark.
+    """
+    registry = _register(read_registry(), model, watermark, mode, rows, metrics,
+                         before_registry=lambda: _atomic_write(MODEL_PATH, lambda tmp: joblib.dump(model, tmp)))
+    # The score distribution to watch for drift changes with the model
+    try:
+        from src.drift import build_baseline
+        build_baseline(model=model)
+    except Exception as e:
+        print(f"Drift baseline not updated: {e}")
+    return registry['versions'][-1]
+
+
+def _valid_rows(rows):
+    # Records with unusable answers are left out of training, not read as 0
+    if rows.empty:
+        return rows
+    _, errors = check_features(rows)
+    if errors:
+        print(f"Skipping {len(errors)} labelled record(s) with invalid features")
+    return rows.drop(index=rows.index[list(errors)]).reset_index(drop=True)
+
+
+def update_model(mode='grow', trees=DEFAULT_TREES, window=DEFAULT_WINDOW, min_new=MIN_NEW_RECORDS):
+    """
+    Runs one incremental update. Returns the new registry entry, or None if
+    there was not enough newly labelled data.
+    Modes:
+        grow:    keep every tree and add 'trees' new ones (capped at MAX_TREES)
+        replace: drop the 'trees' oldest trees and train as many replacements
+    """
+    current = current_version()
+    if current is None:
+        print("No base model found. Run src/model.py first.")
+        return None
+    watermark = current['watermark']
+
+    new_rows = _valid_rows(database.load_labelled_records(after_seq=watermark))
+    if len(new_rows) < min_new:
+        print(f"Only {len(new_rows)} newly labelled records since label {watermark}; need {min_new}.")
+        return None
+
+    # Sliding window: the most recently labelled records (always includes the new ones)
+    train = _valid_rows(database.load_labelled_records(after_seq=0, limit=max(window, len(new_rows))))
+    y = train['confirmed_diagnosis'].astype(int).to_numpy()
+    if len(np.unique(y)) < 2:
+        print("Training window contains a single class; skipping update.")
+        return None
+    X = build_feature_frame(train)
+
+    model = joblib.load(current['path'])
+    X_new = build_feature_frame(new_rows)
+    y_new = new_rows['confirmed_diagnosis'].astype(int).to_numpy()
+    before = accuracy_score(y_new, model.predict(X_new))
+
+    kept = list(model.estimators_)
+    if mode == 'replace':
+        kept = kept[min(trees, len(kept) - 1):]
+    elif len(kept) + trees > MAX_TREES:
+        kept = kept[len(kept) + trees - MAX_TREES:]
+    model.estimators_ = kept
+    model.warm_start = True
+    model.n_estimators = len(kept) + trees
+    model.fit(X, y)
+    model.warm_start = False
+
+    # 'before' is out-of-sample for the previous version; 'after' includes the
+    # new records in training, so treat it as a sanity check only
+    pred_new = model.predict(X_new)
+    metrics = {
+        'new_records': int(len(new_rows)),
+        'window_records': int(len(train)),
+        'accuracy_new_before': float(before),
+        'accuracy_new_after': float(accuracy_score(y_new, pred_new)),
+        'recall_new_after': float(recall_score(y_new, pred_new, zero_division=0))
+    }
+    entry = publish_model(model, int(new_rows['label_seq'].max()), mode, int(len(train)), metrics)
+    print(f"Published model v{entry['version']} ({entry['n_estimators']} trees, watermark label {entry['watermark']})")
+    print(f"Accuracy on new records: {before:.4f} -> {metrics['accuracy_new_after']:.4f}")
+    return entry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incrementally update the clinical model from labelled records")
+    parser.add_argument('--mode', choices=['grow', 'replace'], default='grow')
+    parser.add_argument('--trees', type=int, default=DEFAULT_TREES)
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    parser.add_argument('--min-new', type=int, default=MIN_NEW_RECORDS)
+    args = parser.parse_args()
+    update_model(args.mode, args.trees, args.window, args.min_new)
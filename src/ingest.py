@@ -0,0 +1,148 @@
+# Clinical Dataset Ingestion Module
+#
+# Reads either dataset layout into the model's feature encoding:
+#   data/lung_cancer.csv       M/F gender, headers like 'FATIGUE ' and 'CHRONIC DISEASE'
+#   data/lung_cancer_data.csv  BOM prefix, 1/2 gender, underscore headers, AGE first
+# The encoded matrix is cached as .npy keyed by the source file's hash, so
+# later training or batch scoring runs skip CSV parsing entirely.
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = 'data/.ingest_cache'
+CACHE_VERSION = 1
+
+# Model input order and names (matches models/feature_names.pkl)
+FEATURE_COLUMNS = [
+    'GENDER', 'AGE', 'SMOKING', 'YELLOW_FINGERS', 'ANXIETY',
+    'PEER_PRESSURE', 'CHRONIC DISEASE', 'FATIGUE ', 'ALLERGY ',
+    'WHEEZING', 'ALCOHOL CONSUMING', 'COUGHING',
+    'SHORTNESS OF BREATH', 'SWALLOWING DIFFICULTY', 'CHEST PAIN'
+]
+TARGET_COLUMN = 'LUNG_CANCER'
+
+# Text and numeric gender codes seen in the exports (1 = Male)
+GENDER_MAP = {'M': 1, 'F': 0, '1': 1, '0': 0, '2': 0}
+TARGET_MAP = {'YES': 1, 'NO': 0, '1': 1, '0': 0}
+
+try:
+    import pyarrow  # noqa: F401
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+
+def normalize_header(name):
+    """
+    Canonical key for a header: BOM and padding stripped, upper case,
+    spaces as underscores ('FATIGUE ' and 'FATIGUE' both become 'FATIGUE').
+    """
+    return name.replace('\ufeff', '').strip().upper().replace(' ', '_')
+
+
+_CANONICAL = {normalize_header(col): col for col in FEATURE_COLUMNS + [TARGET_COLUMN]}
+
+
+def _read_header(path):
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        return f.readline().rstrip('\r\n').split(',')
+
+
+def read_raw(path, use_pyarrow=True):
+    """
+    Parses the CSV with explicit dtypes and returns it with headers renamed
+    to FEATURE_COLUMNS / TARGET_COLUMN.
+    """
+    header = _read_header(path)
+    rename = {}
+    dtypes = {}
+    for raw in header:
+        key = normalize_header(raw)
+        if key not in _CANONICAL:
+            continue
+        rename[raw] = _CANONICAL[key]
+        # GENDER and the target can be text or codes; keep them as strings
+        dtypes[raw] = str if key in ('GENDER', TARGET_COLUMN) else 'int16'
+    missing = set(_CANONICAL.values()) - set(rename.values())
+    if missing:
+        raise ValueError(f"{path}: missing columns {sorted(missing)}")
+
+    engine = 'pyarrow' if use_pyarrow and PYARROW_AVAILABLE else 'c'
+    df = pd.read_csv(path, usecols=list(rename), dtype=dtypes, engine=engine, encoding='utf-8-sig')
+    df.columns = [_CANONICAL[normalize_header(c)] for c in df.columns]
+    return df
+
+
+def encode(df):
+    """
+    Encodes a renamed frame the way src/model.py always has: gender and
+    target to 1/0, symptom answers 1/2 shifted to 0/1.
+    Returns (X int16 array in FEATURE_COLUMNS order, y int8 array).
+    """
+    gender = df['GENDER'].astype(str).str.strip().str.upper().map(GENDER_MAP)
+    target = df[TARGET_COLUMN].astype(str).str.strip().str.upper().map(TARGET_MAP)
+    if gender.isnull().any() or target.isnull().any():
+        raise ValueError("Unrecognized GENDER or LUNG_CANCER values")
+
+    X = np.empty((len(df), len(FEATURE_COLUMNS)), dtype=np.int16)
+    for j, col in enumerate(FEATURE_COLUMNS):
+        if col == 'GENDER':
+            X[:, j] = gender.to_numpy()
+        elif col == 'AGE':
+            X[:, j] = df[col].to_numpy()
+        else:
+            X[:, j] = df[col].to_numpy() - 1
+    return X, target.to_numpy().astype(np.int8)
+
+
+def source_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_arrays(path, use_cache=True, use_pyarrow=True):
+    """
+    Returns (X, y) for either dataset layout, from the .npy cache when the
+    source file is unchanged.
+    """
+    key = f"{source_hash(path)[:32]}_v{CACHE_VERSION}"
+    x_path = os.path.join(CACHE_DIR, key + '.X.npy')
+    y_path = os.path.join(CACHE_DIR, key + '.y.npy')
+    if use_cache and os.path.exists(x_path) and os.path.exists(y_path):
+        return np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+    X, y = encode(read_raw(path, use_pyarrow))
+    if use_cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write-then-rename so a concurrent reader never sees a partial file
+        for arr, final in ((X, x_path), (y, y_path)):
+            tmp = final + '.tmp.npy'
+            np.save(tmp, arr)
+            os.replace(tmp, final)
+        with open(os.path.join(CACHE_DIR, key + '.json'), 'w') as f:
+            json.dump({'source': os.path.abspath(path), 'rows': len(y), 'features': FEATURE_COLUMNS}, f)
+    return X, y
+
+
+def load_dataset(path, use_cache=True, use_pyarrow=True):
+    """
+    Same as load_arrays but as (X DataFrame with model feature names, y Series),
+    ready for RandomForestClassifier.fit / predict.
+    """
+    X, y = load_arrays(path, use_cache, use_pyarrow)
+    return pd.DataFrame(np.asarray(X), columns=FEATURE_COLUMNS), pd.Series(np.asarray(y), name=TARGET_COLUMN)
+
+
+def load_combined(paths, use_cache=True):
+    """
+    Concatenates several exports (any mix of layouts) into one (X, y).
+    """
+    parts = [load_dataset(p, use_cache) for p in paths]
+    X = pd.concat([p[0] for p in parts], ignore_index=True)
+    y = pd.concat([p[1] for p in parts], ignore_index=True)
+    return X, y
@@ -0,0 +1,390 @@
+# Durable Job Queue for Scoring and Report Generation
+#
+# Jobs live in the 'jobs' table next to 'patients'. The UI and batch tools
+# enqueue; any number of worker processes (on this machine, or on others that
+# share the database file) claim them:
+#   python -m src.job_queue worker [--kinds ct_score report] [--batch 16]
+#   python -m src.job_queue enqueue-ct data/archive_scans
+#   python -m src.job_queue status
+# A claim is a lease: the worker heartbeats while it runs the job, and a job
+# whose lease runs out (worker killed, machine gone) is claimed again by the
+# next worker. Failures are retried with backoff up to max_attempts.
+# Workers keep the clinical and CT models loaded between jobs, and claim up
+# to --batch jobs of one kind at a time so they share one model call.
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import sqlite3
+import argparse
+import threading
+
+from src import database
+from src.metrics import observe
+
+LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 30))
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+RETRY_BACKOFF = 2.0
+BUSY_TIMEOUT = 10.0
+
+
+class JobError(Exception):
+    """A failure that retrying cannot fix (e.g. an unreadable scan)."""
+
+
+def _connect():
+    # Autocommit; claims take the write lock explicitly with BEGIN IMMEDIATE
+    return sqlite3.connect(database.DB_FILE, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+def enqueue(kind, payload, priority=0, max_attempts=3):
+    """
+    Adds one job and returns its id.
+    """
+    return enqueue_many(kind, [payload], priority, max_attempts)[0]
+
+
+def enqueue_many(kind, payloads, priority=0, max_attempts=3):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [conn.execute(
+            "INSERT INTO jobs (kind, payload, priority, max_attempts, created_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, json.dumps(p), priority, max_attempts, now)).lastrowid for p in payloads]
+        conn.execute("COMMIT")
+        return ids
+    finally:
+        conn.close()
+
+
+def _reclaim_expired(conn, now):
+    # Jobs whose worker stopped heartbeating go back to the queue (or fail
+    # for good once they have used up their attempts)
+    conn.execute('''
+        UPDATE jobs SET
+            status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            error = 'lease expired', lease_owner = NULL, lease_expires = NULL,
+            finished_at = CASE WHEN attempts >= max_attempts THEN ? END
+        WHERE status = 'running' AND lease_expires < ?
+    ''', (now, now))
+
+
+def claim(worker_id, kinds=None, limit=1, lease=LEASE_SECONDS):
+    """
+    Leases up to 'limit' ready jobs of a single kind (highest priority first)
+    to worker_id. Returns a list of dicts with id, kind, payload, attempts.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        _reclaim_expired(conn, now)
+        kind_filter = f" AND kind IN ({','.join('?' * len(kinds))})" if kinds else ""
+        first = conn.execute(
+            f"SELECT kind FROM jobs WHERE status = 'queued' AND run_after <= ?{kind_filter} "
+            "ORDER BY priority DESC, id LIMIT 1", (now, *(kinds or []))).fetchone()
+        if first is None:
+            conn.execute("COMMIT")
+            return []
+        rows = conn.execute(
+            "SELECT id, kind, payload, attempts FROM jobs WHERE status = 'queued' AND kind = ? "
+            "AND run_after <= ? ORDER BY priority DESC, id LIMIT ?", (first[0], now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE jobs SET status = 'running', lease_owner = ?, lease_expires = ?, "
+            "attempts = attempts + 1 WHERE id = ?",
+            [(worker_id, now + lease, r[0]) for r in rows])
+        conn.execute("COMMIT")
+        return [{'id': r[0], 'kind': r[1], 'payload': json.loads(r[2]), 'attempts': r[3] + 1} for r in rows]
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def heartbeat(worker_id, job_ids, lease=LEASE_SECONDS):
+    """
+    Extends the lease on jobs still held by worker_id. Returns how many
+    were extended (fewer than len(job_ids) means a lease was lost).
+    """
+    conn = _connect()
+    try:
+        cur = conn.executemany(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            [(time.time() + lease, job_id, worker_id) for job_id in job_ids])
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+def complete(job_id, worker_id, result):
+    """
+    Stores the result. Returns False if the lease was lost meanwhile (the
+    job is then someone else's and this result is dropped).
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute(
+            "UPDATE jobs SET status = 'done', result = ?, error = NULL, lease_owner = NULL, "
+            "lease_expires = NULL, finished_at = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (json.dumps(result), time.time(), job_id, worker_id))
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def fail(job_id, worker_id, error, retry=True):
+    """
+    Requeues the job with exponential backoff, or marks it failed once
+    max_attempts is reached (or at once when retry is False).
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        cur = conn.execute('''
+            UPDATE jobs SET
+                status = CASE WHEN attempts >= max_attempts OR ? THEN 'failed' ELSE 'queued' END,
+                run_after = ? + ? * (1 << (attempts - 1)),
+                finished_at = CASE WHEN attempts >= max_attempts OR ? THEN ? END,
+                error = ?, lease_owner = NULL, lease_expires = NULL
+            WHERE id = ? AND lease_owner = ? AND status = 'running'
+        ''', (not retry, now, RETRY_BACKOFF, not retry, now, str(error), job_id, worker_id))
+        return cur.rowcount == 1
+    finally:
+        conn.close()
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT id, kind, status, attempts, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {'id': row[0], 'kind': row[1], 'status': row[2], 'attempts': row[3],
+            'result': json.loads(row[4]) if row[4] else None, 'error': row[5]}
+
+
+def wait(job_id, timeout=60.0, poll=0.1):
+    """
+    Polls until the job is done or failed. Returns the job, or None on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_job(job_id)
+        if job is None or job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(poll)
+    return None
+
+
+def queue_status():
+    """
+    Job counts by kind and status, plus the age of the oldest queued job.
+    """
+    conn = _connect()
+    try:
+        counts = conn.execute(
+            "SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status ORDER BY kind, status").fetchall()
+        oldest = conn.execute("SELECT MIN(created_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+    finally:
+        conn.close()
+    return {'counts': counts, 'oldest_queued_seconds': time.time() - oldest if oldest else 0.0}
+
+
+def purge(older_than_days=7):
+    """
+    Deletes finished jobs older than the given age. Returns the count.
+    """
+    conn = _connect()
+    try:
+        cur = conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                           (time.time() - older_than_days * 86400,))
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+# --- Handlers: a list of payloads in, one result (or Exception) per payload out ---
+
+def _clinical_score(payloads):
+    # payload: {'features': {...EXPECTED_FEATURES...}}; a malformed payload
+    # fails its own job, not the rest of the batch
+    from src.scoring import score_records
+    results, rows, ok = [], [], []
+    for i, p in enumerate(payloads):
+        features = p.get('features') if isinstance(p, dict) else None
+        if isinstance(features, dict):
+            rows.append(features)
+            ok.append(i)
+            results.append(None)
+        else:
+            results.append(JobError("Payload has no 'features' dict"))
+    scored = score_records(rows, errors='return') if rows else []
+    for i, result in zip(ok, scored):
+        results[i] = JobError(f"Invalid features: {result}") if isinstance(result, Exception) else result
+    return results
+
+
+def _ct_score(payloads):
+    # payload: {'image_b64': ...} (UI uploads) or {'path': ...} (archive scans;
+    # results are also upserted into ct_scan_results)
+    import io
+    from src.image_model import preprocess_image, predict_batch, get_model, INFERENCE_BACKEND
+    from src.batch_score_ct import risk_level
+    results, arrays, ok = [], [], []
+    for i, p in enumerate(payloads):
+        try:
+            source = io.BytesIO(base64.b64decode(p['image_b64'])) if 'image_b64' in p else p['path']
+            arrays.append(preprocess_image(source))
+            ok.append(i)
+            results.append(None)
+        except Exception as e:
+            results.append(JobError(f"Unreadable scan: {e}"))
+    probs = predict_batch(arrays) if arrays else []
+    model_name = INFERENCE_BACKEND if get_model() is not None else 'simulated'
+    for i, prob in zip(ok, probs):
+        results[i] = {'probability': prob, 'level': risk_level(prob), 'model': model_name}
+
+    scored_paths = [{'scan_path': os.path.abspath(payloads[i]['path']), 'probability': results[i]['probability'],
+                     'level': results[i]['level'], 'model': model_name,
+                     'scored_at': time.strftime("%Y-%m-%d %H:%M:%S"), 'error': None}
+                    for i in ok if 'path' in payloads[i]]
+    if scored_paths and not database.save_ct_results(scored_paths):
+        raise RuntimeError("Could not write CT results to the database")
+    return results
+
+
+def _report(payloads):
+    # payload: {'patient': {...}, 'prediction': {'prediction', 'probability'}, 'output_path': ...}
+    from src.report_generator import MedicalReportGenerator
+    results = []
+    for p in payloads:
+        try:
+            MedicalReportGenerator(p['output_path']).generate_report(p['patient'], p['prediction'])
+            results.append({'path': p['output_path']})
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _maintenance(payloads):
+    # payload: {'days': archive horizon, 'vacuum_pages': ...} (both optional)
+    from src import archive
+    return [archive.run_maintenance(p.get('days', archive.ARCHIVE_AFTER_DAYS),
+                                    p.get('vacuum_pages', archive.VACUUM_PAGES)) for p in payloads]
+
+
+HANDLERS = {
+    'clinical_score': _clinical_score,
+    'ct_score': _ct_score,
+    'report': _report,
+    'maintenance': _maintenance
+}
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, worker_id, job_ids, lease):
+        super().__init__(daemon=True)
+        self.worker_id = worker_id
+        self.job_ids = job_ids
+        self.lease = lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease / 3):
+            try:
+                if heartbeat(self.worker_id, self.job_ids, self.lease) < len(self.job_ids):
+                    print(f"Worker {self.worker_id}: lost the lease on some of jobs {self.job_ids}")
+            except sqlite3.Error as e:
+                print(f"Heartbeat Error: {e}")
+
+
+def run_worker(kinds=None, batch_size=16, lease=LEASE_SECONDS, poll=POLL_INTERVAL,
+               exit_when_idle=False, worker_id=None):
+    """
+    Claims and runs jobs until interrupted (or, with exit_when_idle, until
+    the queue is empty). Returns the number of jobs processed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    processed = 0
+    print(f"Worker {worker_id} started (kinds={kinds or 'all'}, batch={batch_size})")
+    try:
+        while True:
+            jobs = claim(worker_id, kinds, batch_size, lease)
+            if not jobs:
+                if exit_when_idle:
+                    break
+                time.sleep(poll)
+                continue
+
+            beat = _Heartbeat(worker_id, [j['id'] for j in jobs], lease)
+            beat.start()
+            start = time.perf_counter()
+            try:
+                results = HANDLERS[jobs[0]['kind']]([j['payload'] for j in jobs])
+            except Exception as e:
+                results = [e] * len(jobs)
+            finally:
+                beat.stopped.set()
+            observe(f"jobs.{jobs[0]['kind']}", time.perf_counter() - start)
+
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    print(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']} failed: {result}")
+                    fail(job['id'], worker_id, result, retry=not isinstance(result, JobError))
+                elif not complete(job['id'], worker_id, result):
+                    print(f"Job {job['id']}: lease lost before completion; result dropped")
+            processed += len(jobs)
+    except KeyboardInterrupt:
+        # Claimed but unfinished jobs are picked up again once their lease expires
+        pass
+    print(f"Worker {worker_id} stopped after {processed} jobs")
+    return processed
+
+
+def _list_images(root):
+    from src.batch_score_ct import list_scans
+    return list_scans(root)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable scoring / report job queue")
+    sub = parser.add_subparsers(dest='command', required=True)
+    w = sub.add_parser('worker')
+    w.add_argument('--kinds', nargs='*', default=None, choices=sorted(HANDLERS))
+    w.add_argument('--batch', type=int, default=16)
+    w.add_argument('--lease', type=float, default=LEASE_SECONDS)
+    w.add_argument('--exit-when-idle', action='store_true')
+    e = sub.add_parser('enqueue-ct')
+    e.add_argument('root')
+    e.add_argument('--priority', type=int, default=0)
+    sub.add_parser('status')
+    p = sub.add_parser('purge')
+    p.add_argument('--days', type=float, default=7)
+    args = parser.parse_args()
+
+    if args.command == 'worker':
+        run_worker(args.kinds, args.batch, args.lease, exit_when_idle=args.exit_when_idle)
+    elif args.command == 'enqueue-ct':
+        paths = _list_images(args.root)
+        if not paths:
+            print(f"No scans found under {args.root}")
+            sys.exit(1)
+        ids = enqueue_many('ct_score', [{'path': p} for p in paths], args.priority)
+        print(f"Enqueued {len(ids)} CT scoring jobs ({ids[0]}..{ids[-1]})")
+    elif args.command == 'status':
+        status = queue_status()
+        for kind, state, n in status['counts']:
+            print(f"{kind:16s} {state:8s} {n}")
+        print(f"Oldest queued job: {status['oldest_queued_seconds']:.1f}s")
+    else:
+        print(f"Purged {purge(args.days)} finished jobs")
@@ -0,0 +1,262 @@
+# Concurrent-User Load Test for the Dashboard Backends
+#
+# Simulates clinicians clicking through the app against a scratch database
+# (a temporary one unless --db / db_path is given; data/ is never touched):
+#   python -m src.load_test --users 20 --duration 30 --mode thread
+#   python -m src.load_test --users 8 --iterations 50 --mode process
+import os
+import io
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Page mix (weights) approximating how the sidebar is used
+PAGE_WEIGHTS = {
+    'assessment': 4,
+    'archive': 2,
+    'analytics': 1,
+    'ct_scan': 1,
+    'chatbot': 2
+}
+CHAT_PROMPTS = ["hello", "what are the symptoms?", "does smoking cause it", "how accurate is this", "how to prevent"]
+FEATURES = [
+    'SMOKING', 'YELLOW_FINGERS', 'ANXIETY', 'PEER_PRESSURE', 'CHRONIC DISEASE',
+    'FATIGUE ', 'ALLERGY ', 'WHEEZING', 'ALCOHOL CONSUMING', 'COUGHING',
+    'SHORTNESS OF BREATH', 'SWALLOWING DIFFICULTY', 'CHEST PAIN'
+]
+
+
+def _sample_scan_bytes(size=512):
+    from PIL import Image
+    noise = (np.random.default_rng(0).random((size, size, 3)) * 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(noise).save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+class SimulatedUser:
+    """
+    Replays the backend calls main_app() makes for one page view:
+    header metrics first (every rerun loads the full table), then the page.
+    """
+    def __init__(self, user_id, seed=None):
+        from src import database, scoring, write_behind
+        from src.chatbot import DrAIChatbot
+        self.db = database
+        self.scoring = scoring
+        self.write_behind = write_behind
+        self.chatbot = DrAIChatbot()
+        self.user_id = user_id
+        self.rng = random.Random(seed if seed is not None else user_id)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock_errors = 0
+        self.scan_bytes = None
+
+    def _timed(self, op, func, *args):
+        start = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                self.lock_errors += 1
+            self.errors[op] += 1
+            return None
+        self.latencies[op].append(time.perf_counter() - start)
+        return result
+
+    def _header_metrics(self):
+        return self.db.get_cohort_summary()
+
+    def _assessment(self):
+        row = {'GENDER': self.rng.randint(0, 1), 'AGE': self.rng.randint(18, 100)}
+        for feat in FEATURES:
+            row[feat] = self.rng.randint(0, 1)
+        result = self.scoring.score_records([row])[0]
+        record = {
+            'Patient Name': f"Load User {self.user_id}",
+            'Phone': f"555-{self.user_id:04d}",
+            'Location': 'Load Test',
+            **row,
+            'Risk': 'High' if result['prediction'] == 1 else 'Low',
+            'Probability': result['probability']
+        }
+        # Queued for the background writer, as the Predictor page does
+        if not self.write_behind.submit_patient_record(record):
+            raise RuntimeError("database is locked (submit_patient_record returned False)")
+
+    def _archive(self):
+        # The app waits for queued records before listing them
+        self.write_behind.flush()
+        return self.db.load_all_records()
+
+    def _analytics(self):
+        from src.analytics import AnalyticsDashboard
+        dash = AnalyticsDashboard("")
+        cohorts = dash.load_cohort_stats()
+        if not cohorts.empty:
+            dash.get_risk_distribution(cohorts)
+            dash.get_risk_cluster_nebula(self.db.load_all_records(limit=2000))
+
+    def _ct_scan(self):
+        from src.image_model import predict_image
+        if self.scan_bytes is None:
+            self.scan_bytes = _sample_scan_bytes()
+        return predict_image(io.BytesIO(self.scan_bytes))
+
+    def page_view(self):
+        pages = list(PAGE_WEIGHTS)
+        page = self.rng.choices(pages, weights=[PAGE_WEIGHTS[p] for p in pages])[0]
+        start = time.perf_counter()
+        self._timed('header_metrics', self._header_metrics)
+        if page == 'assessment':
+            self._timed('assessment_save', self._assessment)
+        elif page == 'archive':
+            self._timed('archive_view', self._archive)
+        elif page == 'analytics':
+            self._timed('analytics_figures', self._analytics)
+        elif page == 'ct_scan':
+            self._timed('ct_predict', self._ct_scan)
+        elif page == 'chatbot':
+            self._timed('chatbot', self.chatbot.get_response, self.rng.choice(CHAT_PROMPTS))
+        self.latencies['page_view'].append(time.perf_counter() - start)
+
+    def run(self, duration=None, iterations=None, think_time=0.0):
+        deadline = time.perf_counter() + duration if duration else None
+        count = 0
+        while True:
+            if iterations is not None and count >= iterations:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self.page_view()
+            count += 1
+            if think_time:
+                time.sleep(self.rng.uniform(0, 2 * think_time))
+        return {
+            'latencies': dict(self.latencies),
+            'errors': dict(self.errors),
+            'lock_errors': self.lock_errors
+        }
+
+
+def _run_user(args):
+    user_id, duration, iterations, think_time = args
+    result = SimulatedUser(user_id).run(duration, iterations, think_time)
+    # Pool processes exit without running atexit; write what this one queued
+    from src import write_behind
+    write_behind.flush()
+    return result
+
+
+def _merge(results):
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock_errors = 0
+    for res in results:
+        for op, values in res['latencies'].items():
+            latencies[op].extend(values)
+        for op, n in res['errors'].items():
+            errors[op] += n
+        lock_errors += res['lock_errors']
+    return latencies, errors, lock_errors
+
+
+def run_load_test(users=10, duration=30, iterations=None, mode='thread', think_time=0.0, seed_rows=200,
+                  db_path=None):
+    """
+    Runs 'users' simulated clinicians in threads or processes and returns a
+    summary dict with per-operation throughput and latency percentiles.
+    Everything runs against 'db_path', or a temporary database removed
+    afterwards; the configured DB_FILE is restored on return.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = db_path or os.path.join(tmp, 'load_test.db')
+        saved_env = os.environ.get('MEDICAL_DB_FILE')
+        # Set before src.database is first imported: it initializes DB_FILE on
+        # import. Child processes inherit it (spawned ones re-import the module).
+        os.environ['MEDICAL_DB_FILE'] = path
+        from src import database, write_behind
+        saved_file = database.DB_FILE
+        database.DB_FILE = path
+        try:
+            database.init_db()
+            # Seed the scratch database so read paths have something to load
+            for i in range(seed_rows):
+                database.save_patient_record({
+                    'Patient Name': f"Seed {i}", 'GENDER': i % 2, 'AGE': 30 + i % 60,
+                    'Risk': 'High' if i % 3 == 0 else 'Low', 'Probability': (i % 100) / 100.0
+                })
+
+            jobs = [(i, duration if iterations is None else None, iterations, think_time) for i in range(users)]
+            start = time.perf_counter()
+            if mode == 'process':
+                with multiprocessing.Pool(processes=users) as pool:
+                    results = pool.map(_run_user, jobs)
+            else:
+                with ThreadPoolExecutor(max_workers=users) as ex:
+                    results = list(ex.map(_run_user, jobs))
+            elapsed = time.perf_counter() - start
+        finally:
+            # The shared writer is bound to this database
+            write_behind.close()
+            database.DB_FILE = saved_file
+            if saved_env is None:
+                os.environ.pop('MEDICAL_DB_FILE', None)
+            else:
+                os.environ['MEDICAL_DB_FILE'] = saved_env
+
+    latencies, errors, lock_errors = _merge(results)
+    summary = {'users': users, 'mode': mode, 'elapsed': elapsed, 'lock_errors': lock_errors, 'operations': {}}
+    for op, values in sorted(latencies.items()):
+        arr = np.array(values) * 1000.0
+        summary['operations'][op] = {
+            'count': len(values),
+            'errors': errors.get(op, 0),
+            'throughput': len(values) / elapsed if elapsed else 0.0,
+            'p50_ms': float(np.percentile(arr, 50)),
+            'p95_ms': float(np.percentile(arr, 95)),
+            'p99_ms': float(np.percentile(arr, 99)),
+            'max_ms': float(arr.max())
+        }
+    for op, n in errors.items():
+        if op not in summary['operations']:
+            summary['operations'][op] = {'count': 0, 'errors': n, 'throughput': 0.0,
+                                         'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    return summary
+
+
+def print_summary(summary):
+    print(f"\nLoad test: {summary['users']} users ({summary['mode']} mode), {summary['elapsed']:.1f}s")
+    print(f"{'operation':<20}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, s in summary['operations'].items():
+        print(f"{op:<20}{s['count']:>8}{s['errors']:>8}{s['throughput']:>10.1f}"
+              f"{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}")
+    print(f"\nLock-contention errors: {summary['lock_errors']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent-user load test against a temp database")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=30.0, help="Seconds per user")
+    parser.add_argument('--iterations', type=int, default=None, help="Page views per user (overrides --duration)")
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--think-time', type=float, default=0.0, help="Mean pause between page views (s)")
+    parser.add_argument('--seed-rows', type=int, default=200)
+    parser.add_argument('--db', default=None, help="Database to run against (default: a temporary one)")
+    args = parser.parse_args(argv)
+
+    summary = run_load_test(args.users, args.duration, args.iterations, args.mode,
+                            args.think_time, args.seed_rows, args.db)
+    print_summary(summary)
+    return summary
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+# Lightweight Timing Instrumentation Module
+import os
+import time
+import threading
+import functools
+import bisect
+import tempfile
+from collections import deque
+
+# Enable with METRICS_ENABLED=1. When disabled, decorators and context managers
+# cost a single boolean check per call.
+ENABLED = os.environ.get('METRICS_ENABLED', '0') == '1'
+METRICS_FILE = os.environ.get('METRICS_FILE', 'data/metrics.prom')
+# Minimum seconds between file exports (every Streamlit rerun asks for one)
+EXPORT_INTERVAL = float(os.environ.get('METRICS_EXPORT_INTERVAL', 15))
+
+# Latency buckets in seconds (Prometheus histogram upper bounds)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Recent samples kept per operation for exact p50/p95/p99
+SAMPLE_WINDOW = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_histograms = {}
+
+
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, seconds):
+        idx = bisect.bisect_left(BUCKETS, seconds)
+        if idx < len(BUCKETS):
+            self.bucket_counts[idx] += 1
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def quantiles(self):
+        """
+        Returns {q: seconds} computed over the recent sample window.
+        """
+        if not self.samples:
+            return {q: 0.0 for q in QUANTILES}
+        ordered = sorted(self.samples)
+        last = len(ordered) - 1
+        return {q: ordered[min(last, int(round(q * last)))] for q in QUANTILES}
+
+
+def enable(flag=True):
+    global ENABLED
+    ENABLED = flag
+
+
+def observe(name, seconds):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram(name)
+        hist.observe(seconds)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def track(name):
+    """
+    Context manager timing a block under operation 'name'.
+        with track('predictor.model_load'):
+            model = joblib.load(path)
+    """
+    if not ENABLED:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def timed(name=None):
+    """
+    Decorator recording the wall time of each call under 'name'
+    (defaults to module.function).
+    """
+    def decorator(func):
+        op_name = name or f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(op_name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def snapshot():
+    """
+    Returns {operation: {'count', 'sum', 'p50', 'p95', 'p99'}} for all operations.
+    """
+    with _lock:
+        result = {}
+        for name, hist in _histograms.items():
+            qs = hist.quantiles()
+            result[name] = {
+                'count': hist.count,
+                'sum': hist.total,
+                'p50': qs[0.5],
+                'p95': qs[0.95],
+                'p99': qs[0.99]
+            }
+        return result
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def _format_labels(name):
+    return 'operation="' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def render_prometheus():
+    """
+    Renders all histograms in Prometheus text exposition format.
+    """
+    lines = [
+        '# HELP app_operation_seconds Wall time of instrumented operations.',
+        '# TYPE app_operation_seconds histogram'
+    ]
+    quantile_lines = [
+        '# HELP app_operation_quantile_seconds Recent-window latency quantiles.',
+        '# TYPE app_operation_quantile_seconds summary'
+    ]
+    with _lock:
+        for name in sorted(_histograms):
+            hist = _histograms[name]
+            labels = _format_labels(name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.bucket_counts):
+                cumulative += count
+                lines.append(f'app_operation_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'app_operation_seconds_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f'app_operation_seconds_sum{{{labels}}} {hist.total:.6f}')
+            lines.append(f'app_operation_seconds_count{{{labels}}} {hist.count}')
+            for q, value in hist.quantiles().items():
+                quantile_lines.append(f'app_operation_quantile_seconds{{{labels},quantile="{q}"}} {value:.6f}')
+    return '\n'.join(lines + quantile_lines) + '\n'
+
+
+_last_export = None
+
+
+def export_prometheus(path=None, force=False):
+    """
+    Writes the Prometheus text dump to 'path' atomically (for node_exporter's
+    textfile collector or manual inspection). Calls within EXPORT_INTERVAL of
+    the last export are skipped (returns None) unless 'force' is set.
+    """
+    global _last_export
+    now = time.monotonic()
+    with _lock:
+        if not force and _last_export is not None and now - _last_export < EXPORT_INTERVAL:
+            return None
+        _last_export = now
+    path = path or METRICS_FILE
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # A unique temp file per call: concurrent sessions must not share one
+    fd, tmp_path = tempfile.mkstemp(dir=directory or '.', prefix='.metrics-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(render_prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+_server = None
+
+
+def serve_metrics(port=9464, host='127.0.0.1'):
+    """
+    Starts a background HTTP endpoint exposing /metrics. Safe to call on every
+    Streamlit rerun; only the first call binds the port.
+    """
+    global _server
+    if _server is not None:
+        return _server
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        _server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError as e:
+        print(f"Metrics Server Error: {e}")
+        return None
+    thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    thread.start()
+    return _server
+
+
+if __name__ == "__main__":
+    # Print the current dump written by the app
+    if os.path.exists(METRICS_FILE):
+        with open(METRICS_FILE) as f:
+            print(f.read())
+    else:
+        print(f"No metrics file at {METRICS_FILE}. Run the app with METRICS_ENABLED=1.")
@@ -1,37 +1,28 @@
 
-import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import joblib
 import os
+import sys
+
+# Fix imports when run as `python src/model.py`
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from src.ingest import load_dataset
 
 # Create models directory if not exists
 os.makedirs('models', exist_ok=True)
 
 # Load data
-df = pd.read_csv('data/lung_cancer.csv')
-
-# Preprocessing
-df_clean = df.copy()
-
-# Map LUNG_CANCER to 0/1
-df_clean['LUNG_CANCER'] = df_clean['LUNG_CANCER'].map({'YES': 1, 'NO': 0})
-
-# Map GENDER to 0/1 (M=1, F=0)
-df_clean['GENDER'] = df_clean['GENDER'].map({'M': 1, 'F': 0})
-
-# For other columns with values 1 and 2, shift to 0 and 1
-# List of columns to check/transform
-cols_to_shift = [col for col in df_clean.columns if col not in ['LUNG_CANCER', 'GENDER', 'AGE']]
-
-for col in cols_to_shift:
-    df_clean[col] = df_clean[col] - 1
-
-# Features and Target
-X = df_clean.drop('LUNG_CANCER', axis=1)
-y = df_clean['LUNG_CANCER']
+# load_dataset handles both CSV layouts and applies the usual preprocessing
+# (GENDER M=1/F=0, LUNG_CANCER YES=1/NO=0, symptom answers 1/2 shifted to 0/1).
+# The encoded matrix is cached as .npy, so reruns skip CSV parsing.
+DATA_FILE = sys.argv[1] if len(sys.argv) > 1 else 'data/lung_cancer.csv'
+X, y = load_dataset(DATA_FILE)
 
 # Information about features
 feature_names = X.columns.tolist()
@@ -59,3 +50,8 @@ print("\nModel saved to models/lung_cancer_model.pkl")
 
 # Save feature names for later use in app
 joblib.dump(feature_names, 'models/feature_names.pkl')
+
+# Training-data profile for the drift monitor, stored next to the model
+from src.drift import build_baseline, baseline_path
+build_baseline(DATA_FILE, model=model)
+print(f"Drift baseline saved to {baseline_path()}")
@@ -0,0 +1,228 @@
+# Latency-vs-Accuracy Benchmark for Clinical Model Candidates
+#
+# Trains every candidate on the same stratified splits (the first one is the
+# split src/model.py uses) and measures what each costs to serve: single-row
+# latency as the Predictor calls it, 10k-row batch throughput, pickle size
+# and load time. Candidates within --tolerance of the best balanced accuracy
+# are ranked by single-row latency; the rest follow by balanced
+# accuracy (plain accuracy flatters models that call everyone positive, and
+# most rows in data/lung_cancer.csv are).
+#   python -m src.model_zoo [data.csv] [--repeats 5] [--out models/model_zoo_report.csv]
+import os
+import copy
+import time
+import tempfile
+import argparse
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split, StratifiedKFold
+from sklearn.ensemble import RandomForestClassifier, GradientBoostingClassifier, HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import accuracy_score, balanced_accuracy_score, recall_score, roc_auc_score
+
+from src.ingest import load_dataset
+
+DATA_FILE = 'data/lung_cancer.csv'
+REPORT_FILE = 'models/model_zoo_report.csv'
+BATCH_ROWS = 10_000
+LATENCY_CALLS = 200
+
+
+class LookupTableModel:
+    """
+    Probability table over the 'n_features' most informative binary answers
+    and an age band: one array index per patient, no trees. Cells with few
+    training rows are shrunk towards the overall rate ('smoothing' pseudo-rows).
+    With n_features=None the count is picked from 'feature_options' by
+    cross-validated balanced accuracy on the training data, and predict()
+    uses the decision threshold that did best out of fold, not 0.5.
+    Same predict / predict_proba / classes_ interface as the sklearn models.
+    """
+    def __init__(self, n_features=None, feature_options=(3, 4, 5), age_edges=(50, 60, 70),
+                 smoothing=2.0, cv=5):
+        self.n_features = n_features
+        self.feature_options = feature_options
+        self.age_edges = age_edges
+        self.smoothing = smoothing
+        self.cv = cv
+
+    def _keys(self, X, columns=None):
+        columns = self.columns_ if columns is None else columns
+        X = np.asarray(X, dtype=float)
+        bits = (X[:, columns] > 0).astype(np.int64)
+        key = bits @ (1 << np.arange(len(columns), dtype=np.int64))
+        band = np.searchsorted(self.age_edges, X[:, self.age_index_], side='right')
+        return band * (1 << len(columns)) + key
+
+    def _fit_table(self, X_arr, y, k):
+        # Rank binary answers by how far the cancer rate moves with them
+        binary = [i for i in range(X_arr.shape[1]) if i != self.age_index_]
+        gaps = []
+        for i in binary:
+            on = X_arr[:, i] > 0
+            gaps.append(abs(y[on].mean() - y[~on].mean()) if on.any() and (~on).any() else 0.0)
+        columns = [binary[i] for i in np.argsort(gaps)[::-1][:k]]
+        size = (len(self.age_edges) + 1) << len(columns)
+        keys = self._keys(X_arr, columns)
+        n = np.bincount(keys, minlength=size)
+        pos = np.bincount(keys, weights=y, minlength=size)
+        prior = y.mean()
+        return columns, ((pos + self.smoothing * prior) / (n + self.smoothing)).astype(np.float32)
+
+    def _out_of_fold(self, X_arr, y, k):
+        # Out-of-fold probabilities -> (best balanced accuracy, its threshold)
+        folds = min(self.cv, np.bincount(y, minlength=2).min())
+        if folds < 2:
+            return 0.0, 0.5
+        proba = np.empty(len(y))
+        for train, test in StratifiedKFold(folds, shuffle=True, random_state=0).split(X_arr, y):
+            columns, table = self._fit_table(X_arr[train], y[train], k)
+            proba[test] = table[self._keys(X_arr[test], columns)]
+        best = (0.0, 0.5)
+        for threshold in np.unique(proba):
+            score = balanced_accuracy_score(y, (proba >= threshold).astype(int))
+            if score > best[0]:
+                best = (score, float(threshold))
+        return best
+
+    def fit(self, X, y):
+        names = list(X.columns)
+        X_arr = X.to_numpy(dtype=float)
+        y = np.asarray(y).astype(int)
+        self.classes_ = np.array([0, 1])
+        self.feature_names_in_ = np.array(names, dtype=object)
+        self.age_index_ = names.index('AGE')
+        options = [self.n_features] if self.n_features else self.feature_options
+        results = {k: self._out_of_fold(X_arr, y, k) for k in options}
+        self.n_features_ = max(results, key=lambda k: results[k][0])
+        self.cv_balanced_accuracy_, self.threshold_ = results[self.n_features_]
+        self.columns_, self.table_ = self._fit_table(X_arr, y, self.n_features_)
+        return self
+
+    def predict_proba(self, X):
+        p = self.table_[self._keys(X)].astype(np.float64)
+        return np.column_stack([1 - p, p])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] >= self.threshold_).astype(int)
+
+
+def candidates():
+    """
+    name -> unfitted model. 'rf_100' is the current production model.
+    """
+    return {
+        'rf_100': RandomForestClassifier(n_estimators=100, random_state=42, class_weight='balanced'),
+        'rf_50_depth8': RandomForestClassifier(n_estimators=50, max_depth=8, random_state=42, class_weight='balanced'),
+        'rf_25_depth6': RandomForestClassifier(n_estimators=25, max_depth=6, random_state=42, class_weight='balanced'),
+        'rf_10_depth4': RandomForestClassifier(n_estimators=10, max_depth=4, random_state=42, class_weight='balanced'),
+        'gbm_100': GradientBoostingClassifier(n_estimators=100, max_depth=3, random_state=42),
+        'hist_gbm': HistGradientBoostingClassifier(max_iter=100, random_state=42),
+        'logistic': make_pipeline(StandardScaler(), LogisticRegression(class_weight='balanced', max_iter=1000)),
+        'lookup_table': LookupTableModel()
+    }
+
+
+def _median_seconds(fn, calls):
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def measure_serving(model, X_test):
+    """
+    Single-row latency (1-row DataFrame, as the Predictor page scores),
+    10k-row batch throughput, pickle size and load time.
+    """
+    one = X_test.iloc[[0]]
+    model.predict_proba(one)
+    single = _median_seconds(lambda: model.predict_proba(one), LATENCY_CALLS)
+
+    batch = X_test.sample(BATCH_ROWS, replace=True, random_state=0)
+    batch_seconds = _median_seconds(lambda: model.predict_proba(batch), 3)
+
+    fd, path = tempfile.mkstemp(suffix='.pkl')
+    os.close(fd)
+    try:
+        joblib.dump(model, path)
+        size = os.path.getsize(path)
+        load = _median_seconds(lambda: joblib.load(path), 5)
+    finally:
+        os.remove(path)
+    return {
+        'single_row_ms': single * 1000,
+        'batch_rows_per_s': BATCH_ROWS / batch_seconds,
+        'artifact_kb': size / 1024,
+        'load_ms': load * 1000
+    }
+
+
+def run_benchmark(data_file=DATA_FILE, repeats=5, tolerance=0.01, names=None):
+    """
+    Returns a DataFrame with one ranked row per candidate.
+    """
+    X, y = load_dataset(data_file)
+    splits = [train_test_split(X, y, test_size=0.2, random_state=42 + r, stratify=y) for r in range(repeats)]
+    rows = []
+    for name, template in candidates().items():
+        if names and name not in names:
+            continue
+        scores = {'accuracy': [], 'balanced_accuracy': [], 'recall': [], 'auc': [], 'fit_s': []}
+        fitted = None
+        for X_train, X_test, y_train, y_test in splits:
+            model = copy.deepcopy(template)
+            start = time.perf_counter()
+            model.fit(X_train, y_train)
+            scores['fit_s'].append(time.perf_counter() - start)
+            proba = model.predict_proba(X_test)[:, 1]
+            pred = model.predict(X_test)
+            scores['accuracy'].append(accuracy_score(y_test, pred))
+            scores['balanced_accuracy'].append(balanced_accuracy_score(y_test, pred))
+            scores['recall'].append(recall_score(y_test, pred, zero_division=0))
+            scores['auc'].append(roc_auc_score(y_test, proba) if len(np.unique(y_test)) > 1 else np.nan)
+            fitted = fitted or (model, X_test)
+        row = {'model': name, **{k: float(np.nanmean(v)) for k, v in scores.items()}}
+        row.update(measure_serving(*fitted))
+        # The Predictor's contribution table needs a random forest (src/explain.py)
+        row['explainable'] = isinstance(fitted[0], RandomForestClassifier)
+        rows.append(row)
+        print(f"  {name:14s} acc={row['accuracy']:.3f} balanced={row['balanced_accuracy']:.3f} recall={row['recall']:.3f} "
+              f"1-row={row['single_row_ms']:.2f}ms", flush=True)
+
+    report = pd.DataFrame(rows)
+    report['meets_accuracy'] = report['balanced_accuracy'] >= report['balanced_accuracy'].max() - tolerance
+    report = pd.concat([
+        report[report['meets_accuracy']].sort_values('single_row_ms'),
+        report[~report['meets_accuracy']].sort_values('balanced_accuracy', ascending=False)
+    ]).reset_index(drop=True)
+    report.insert(0, 'rank', range(1, len(report) + 1))
+    baseline = report.loc[report['model'] == 'rf_100']
+    if not baseline.empty:
+        report['speedup_vs_rf_100'] = baseline['single_row_ms'].iloc[0] / report['single_row_ms']
+        report['size_vs_rf_100'] = report['artifact_kb'] / baseline['artifact_kb'].iloc[0]
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark clinical model candidates: accuracy vs. serving cost")
+    parser.add_argument('data', nargs='?', default=DATA_FILE)
+    parser.add_argument('--repeats', type=int, default=5, help="Stratified 80/20 splits to average accuracy over")
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="Balanced-accuracy slack for 'as good as the best'")
+    parser.add_argument('--models', nargs='*', default=None, choices=sorted(candidates()))
+    parser.add_argument('--out', default=REPORT_FILE)
+    args = parser.parse_args()
+
+    print(f"Benchmarking on {args.data} ({args.repeats} splits)")
+    result = run_benchmark(args.data, args.repeats, args.tolerance, args.models)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    result.to_csv(args.out, index=False)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format):
+        print(result.drop(columns=['fit_s']).to_string(index=False))
+    print(f"\nReport written to {args.out}")
@@ -0,0 +1,242 @@
+# Pre-Fork Launcher: Load the Models Once, Share Them Across Workers
+#
+# The parent process imports the scoring stack, loads the clinical model and
+# the CT model, freezes everything it allocated with gc.freeze(), and then
+# forks N workers. Model weights (numpy / TF buffers) and the interpreter
+# state stay on copy-on-write pages shared by all workers; the frozen
+# objects are never touched by the cyclic GC, so collections in a worker do
+# not write to (and thereby copy) the parent's pages.
+#   python -m src.prefork queue --workers 4 [--kinds clinical_score ct_score]
+#   python -m src.prefork api --workers 4 --port 8600
+# 'queue' workers run src/job_queue.py run_worker(); 'api' workers serve
+# src/scoring_api.py from one listening socket opened by the parent.
+# The parent restarts workers that exit, reloads and re-forks when a model
+# file changes on disk, and prints per-worker unique vs shared memory
+# (Linux /proc/<pid>/smaps_rollup) every --report-every seconds.
+# Streamlit runs its own server process and is not forked from here.
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+
+# Workers should not each start a thread pool sized for the whole machine
+os.environ.setdefault('OMP_NUM_THREADS', '1')
+
+REPORT_EVERY = float(os.environ.get('PREFORK_REPORT_EVERY', 60))
+# Seconds between checks of the model files' mtimes
+MODEL_CHECK_EVERY = 5.0
+# Workers that die this soon after starting count as crash-looping
+MIN_WORKER_LIFETIME = 2.0
+
+
+def preload():
+    """
+    Imports the scoring stack and loads both models, with one warm-up
+    prediction each (so lazily built state is created before the fork, not
+    once per worker). Returns the model files to watch.
+    """
+    from src import job_queue, scoring, image_model  # noqa: F401  (imported for the shared pages)
+    from src.scoring import load_clinical_model, score_records, MODEL_PATH
+    watched = []
+    if os.path.exists(MODEL_PATH):
+        load_clinical_model()
+        score_records([{'GENDER': 1, 'AGE': 60}])
+        watched.append(MODEL_PATH)
+    else:
+        print(f"Warning: {MODEL_PATH} not found; workers will fail clinical jobs until it exists")
+    if image_model.get_model() is not None:
+        import numpy as np
+        image_model.predict_batch([np.zeros((*image_model.IMG_SIZE, 3), dtype=np.float32)])
+        watched.append(image_model._load_backend()[0])
+    return watched
+
+
+def freeze():
+    # Objects alive now move to the permanent generation: later collections
+    # (in any worker) skip them and leave their pages shared
+    gc.collect()
+    gc.freeze()
+    return gc.get_freeze_count()
+
+
+def _worker_main(mode, args, listen_sock):
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+    gc.enable()
+    try:
+        if mode == 'queue':
+            from src.job_queue import run_worker
+            run_worker(args.kinds, args.batch, exit_when_idle=False)
+        else:
+            import asyncio
+            from src.scoring_api import serve
+            asyncio.run(serve(sock=listen_sock))
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Worker {os.getpid()} Error: {e}")
+        os._exit(1)
+    os._exit(0)
+
+
+def _spawn(mode, args, listen_sock):
+    pid = os.fork()
+    if pid == 0:
+        _worker_main(mode, args, listen_sock)
+    return pid
+
+
+def memory_info(pid):
+    """
+    {'rss', 'pss', 'shared', 'unique'} in MB for one process: 'unique' pages
+    belong to it alone, 'shared' are also mapped by others (the pre-fork
+    parent, sibling workers, shared libraries). None if /proc is unavailable.
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            kb = {}
+            for line in f:
+                key, _, value = line.partition(':')
+                if value.strip().endswith('kB'):
+                    kb[key] = int(value.split()[0])
+    except OSError:
+        return None
+    return {
+        'rss': kb.get('Rss', 0) / 1024,
+        'pss': kb.get('Pss', 0) / 1024,
+        'shared': (kb.get('Shared_Clean', 0) + kb.get('Shared_Dirty', 0)) / 1024,
+        'unique': (kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)) / 1024
+    }
+
+
+def memory_report(parent_pid, worker_pids):
+    """
+    Prints per-process memory and the total actually used (sum of PSS)
+    against what the same processes would use without sharing (sum of RSS).
+    """
+    rows = [('parent', parent_pid)] + [(f"worker {i}", pid) for i, pid in enumerate(worker_pids)]
+    infos = [(name, pid, memory_info(pid)) for name, pid in rows]
+    if any(info is None for _, _, info in infos):
+        print("Memory report needs /proc/<pid>/smaps_rollup (Linux)")
+        return
+    print(f"{'process':10s} {'pid':>7s} {'rss MB':>8s} {'unique':>8s} {'shared':>8s} {'pss':>8s}")
+    for name, pid, info in infos:
+        print(f"{name:10s} {pid:7d} {info['rss']:8.1f} {info['unique']:8.1f} {info['shared']:8.1f} {info['pss']:8.1f}")
+    total_pss = sum(info['pss'] for _, _, info in infos)
+    total_rss = sum(info['rss'] for _, _, info in infos)
+    print(f"Total in use (PSS) {total_pss:.1f} MB vs {total_rss:.1f} MB if nothing were shared", flush=True)
+
+
+def _mtimes(paths):
+    return {p: os.path.getmtime(p) for p in paths if os.path.exists(p)}
+
+
+def run(mode, args):
+    """
+    Parent loop: preload, freeze, fork, supervise. Returns on SIGINT/SIGTERM
+    after the workers have exited.
+    """
+    gc.disable() # No collections (and page writes) while the shared state is built
+    listen_sock = None
+    if mode == 'api':
+        listen_sock = socket.create_server((args.host, args.port), backlog=1024)
+        listen_sock.set_inheritable(True)
+    watched = preload()
+    print(f"Preloaded models ({', '.join(watched) or 'none'}); {freeze()} objects frozen")
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda s, f: stopping.append(s))
+    signal.signal(signal.SIGINT, lambda s, f: stopping.append(s))
+
+    workers = {_spawn(mode, args, listen_sock): time.time() for _ in range(args.workers)}
+    print(f"Started {len(workers)} {mode} workers: {sorted(workers)}", flush=True)
+    mtimes = _mtimes(watched)
+    next_report = time.time() + min(args.report_every, 10) if args.report_every else None
+    next_check = time.time() + MODEL_CHECK_EVERY
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in workers:
+            started = workers.pop(pid)
+            print(f"Worker {pid} exited (status {status}); restarting")
+            if time.time() - started < MIN_WORKER_LIFETIME:
+                time.sleep(MIN_WORKER_LIFETIME)
+            workers[_spawn(mode, args, listen_sock)] = time.time()
+            continue
+
+        now = time.time()
+        if now >= next_check:
+            next_check = now + MODEL_CHECK_EVERY
+            if _mtimes(watched) != mtimes:
+                # Re-fork from a parent holding the new model, one worker at a time
+                print("Model file changed; reloading and restarting workers", flush=True)
+                gc.unfreeze()
+                preload()
+                freeze()
+                mtimes = _mtimes(watched)
+                for old in list(workers):
+                    _stop_worker(old)
+                    workers.pop(old)
+                    workers[_spawn(mode, args, listen_sock)] = time.time()
+        if next_report and now >= next_report:
+            next_report = now + args.report_every
+            memory_report(os.getpid(), sorted(workers))
+        time.sleep(0.2)
+
+    print(f"Stopping {len(workers)} workers")
+    for pid in workers:
+        _stop_worker(pid, wait=False)
+    for pid in workers:
+        _wait(pid)
+    if listen_sock is not None:
+        listen_sock.close()
+
+
+def _stop_worker(pid, wait=True):
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    if wait:
+        _wait(pid)
+
+
+def _wait(pid, timeout=30.0):
+    # Queue workers finish their current batch first; unfinished claims are
+    # retaken after their lease expires, so a hard kill is safe
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return
+        except ChildProcessError:
+            return
+        time.sleep(0.05)
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    if not hasattr(os, 'fork'):
+        print("Pre-forking needs os.fork (Linux/macOS)")
+        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Load the scoring models once and fork workers that share them")
+    sub = parser.add_subparsers(dest='command', required=True)
+    q = sub.add_parser('queue', help="Job queue workers")
+    q.add_argument('--kinds', nargs='*', default=None)
+    q.add_argument('--batch', type=int, default=16)
+    a = sub.add_parser('api', help="Scoring API workers on one port")
+    a.add_argument('--host', default='127.0.0.1')
+    a.add_argument('--port', type=int, default=int(os.environ.get('SCORING_PORT', 8600)))
+    for p in (q, a):
+        p.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+        p.add_argument('--report-every', type=float, default=REPORT_EVERY, help="Seconds; 0 disables the memory report")
+    args = parser.parse_args()
+    run(args.command, args)
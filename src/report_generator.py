@@ -134,6 +134,29 @@ class MedicalReportGenerator:
         elements.append(t3)
         elements.append(Spacer(1, 0.2 * inch))
 
+        # 4b. Contributing Factors (optional, from src.explain)
+        contributions = prediction_result.get('contributions')
+        if contributions:
+            from src.explain import FEATURE_LABELS
+            elements.append(Paragraph("Key Contributing Factors", self.styles['Header2']))
+            factor_data = [["Factor", "Effect on Risk"]]
+            for feature, effect in contributions.items():
+                factor_data.append([FEATURE_LABELS.get(feature, feature.strip().title()), f"{effect * 100:+.1f} pp"])
+
+            t4 = Table(factor_data, colWidths=[3*inch, 2*inch])
+            t4.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#e3f2fd')),
+                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+                ('GRID', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+                ('FONTSIZE', (0, 0), (-1, -1), 9)
+            ]))
+            for i, effect in enumerate(contributions.values(), start=1):
+                t4.setStyle(TableStyle([('TEXTCOLOR', (1, i), (1, i), colors.red if effect > 0 else colors.green)]))
+            elements.append(t4)
+            elements.append(Paragraph("Percentage-point change in predicted malignancy probability attributed to each parameter.",
+                                      ParagraphStyle('FactorNote', fontSize=8, textColor=colors.grey)))
+            elements.append(Spacer(1, 0.2 * inch))
+
         # 5. Recommendations
         if prediction_result['prediction'] == 1:
             rec_text = "URGENT ACTION REQUIRED: The patient shows clinical signs consistent with high risk for lung cancer. Immediate referral to an oncologist for further diagnostic imaging (CT/PET) and biopsy is strongly recommended."
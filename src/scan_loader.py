@@ -0,0 +1,85 @@
+# Reduced-Resolution Scan Decoding
+#
+# The CT model only needs 150x150 pixels, so decoding a 4000x4000 upload at
+# full resolution wastes most of the time and memory. JPEGs are decoded
+# directly at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling via Image.draft);
+# other formats are decoded in their stored mode (grayscale for most CT
+# exports, a third of RGB) and shrunk with Image.reduce before the final resize.
+# Modes that need converting (palette, 16-bit, RGBA, CMYK) are converted and
+# reduced one band of rows at a time, so no full-resolution RGB copy exists.
+# Only plain PIL + numpy here so decode workers never import TensorFlow.
+import os
+import numpy as np
+from PIL import Image
+
+IMG_SIZE = (150, 150)
+
+# Upper bound on the decoded pixel buffer for one scan
+MAX_DECODE_MB = float(os.environ.get('CT_MAX_DECODE_MB', 256))
+
+# Full-resolution rows converted at once when the mode has to change
+BAND_ROWS = 256
+
+_BYTES_PER_PIXEL = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'I;16': 2, 'RGB': 3, 'YCbCr': 3,
+                    'RGBA': 4, 'CMYK': 4, 'I': 4, 'F': 4}
+
+
+class ScanTooLarge(ValueError):
+    pass
+
+
+def _work_mode(mode):
+    # Grayscale stays single-channel until the final 150x150 step
+    if mode in ('L', 'RGB'):
+        return mode
+    return 'L' if mode in ('1', 'LA') else 'RGB'
+
+
+def decode_size(img):
+    """
+    Peak bytes needed to decode the image as it will actually be decoded
+    (plus one converted band when its mode has to change).
+    """
+    width, height = img.size
+    peak = width * height * _BYTES_PER_PIXEL.get(img.mode, 4)
+    if _work_mode(img.mode) != img.mode:
+        peak += width * min(height, BAND_ROWS) * _BYTES_PER_PIXEL[_work_mode(img.mode)]
+    return peak
+
+
+def _convert_reduced(img, mode, factor):
+    # Same pixels as img.convert(mode).reduce(factor), one band of rows at a
+    # time; bands are whole multiples of 'factor' rows so no box is split
+    width, height = img.size
+    band = max(1, BAND_ROWS // factor) * factor
+    out = Image.new(mode, (-(-width // factor), -(-height // factor)))
+    for top in range(0, height, band):
+        piece = img.crop((0, top, width, min(top + band, height))).convert(mode)
+        out.paste(piece.reduce(factor) if factor > 1 else piece, (0, top // factor))
+    return out
+
+
+def load_scan(image_file, size=IMG_SIZE, max_mb=None):
+    """
+    Decodes a path or file-like object to a size[0] x size[1] RGB uint8
+    array, decoding no more pixels than needed. Raises ScanTooLarge if the
+    reduced decode would still exceed max_mb (default CT_MAX_DECODE_MB).
+    """
+    max_bytes = (MAX_DECODE_MB if max_mb is None else max_mb) * 1024 * 1024
+    with Image.open(image_file) as img:
+        if img.format == 'JPEG':
+            # Picks the largest DCT scale that still covers 'size'
+            img.draft('L' if img.mode == 'L' else 'RGB', size)
+        if decode_size(img) > max_bytes:
+            raise ScanTooLarge(f"Scan {img.size[0]}x{img.size[1]} ({img.mode}) needs "
+                               f"{decode_size(img) / 2**20:.0f} MB to decode; limit is {max_bytes / 2**20:.0f} MB")
+        img.load()
+
+        factor = max(1, min(img.size[0] // size[0], img.size[1] // size[1]))
+        if _work_mode(img.mode) != img.mode:
+            img = _convert_reduced(img, _work_mode(img.mode), factor)
+        elif factor >= 2:
+            img = img.reduce(factor)
+        # Same final step as keras load_img: RGB, nearest resize
+        img = img.resize(size, Image.NEAREST).convert('RGB')
+        return np.asarray(img, dtype=np.uint8)
@@ -0,0 +1,340 @@
+# Appointment Scheduling
+#
+# Appointments carry start_min/end_min (minutes since the epoch, clinic local
+# time) and a resource (clinician, room, scanner). Listing a day or week is a
+# range scan on idx_appointments_start; conflict and free-slot checks query
+# the appointment_slots R*Tree, which holds only active (not cancelled)
+# bookings keyed by (resource, interval).
+#   book(...)             one appointment, refused on overlap
+#   book_many(...)        a batch in one transaction (skip or reject clashes)
+#   schedule_campaign(...) places a screening list into the first free slots
+import sqlite3
+from datetime import datetime, timedelta, date as date_cls, time as time_cls
+import pandas as pd
+
+from src import database
+from src.metrics import timed
+
+EPOCH = datetime(1970, 1, 1)
+DEFAULT_DURATION = 30
+# Longest bookable appointment; bounds the look-back of window queries
+MAX_DURATION = 8 * 60
+OPEN_TIME = '08:00'
+CLOSE_TIME = '17:00'
+BUSY_TIMEOUT = 10.0
+
+
+class SlotConflict(ValueError):
+    def __init__(self, message, conflicts):
+        super().__init__(message)
+        self.conflicts = conflicts
+
+
+def to_minutes(dt):
+    return int((dt - EPOCH).total_seconds() // 60)
+
+
+def from_minutes(minutes):
+    return EPOCH + timedelta(minutes=int(minutes))
+
+
+def _day_bounds(day, open_time=OPEN_TIME, close_time=CLOSE_TIME):
+    day = day.date() if isinstance(day, datetime) else day
+    return (to_minutes(datetime.combine(day, time_cls.fromisoformat(open_time))),
+            to_minutes(datetime.combine(day, time_cls.fromisoformat(close_time))))
+
+
+def _connect():
+    return sqlite3.connect(database.DB_FILE, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+def _has_rtree(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'appointment_slots'").fetchone() is not None
+
+
+def resource_id(conn, name):
+    conn.execute("INSERT OR IGNORE INTO schedule_resources (name) VALUES (?)", (name,))
+    return conn.execute("SELECT id FROM schedule_resources WHERE name = ?", (name,)).fetchone()[0]
+
+
+def _conflicts(conn, res_id, start, end):
+    # Active bookings of this resource overlapping [start, end)
+    if _has_rtree(conn):
+        rows = conn.execute('''
+            SELECT id FROM appointment_slots
+            WHERE resource_lo = ? AND start_min <= ? AND last_min >= ?
+        ''', (res_id, end - 1, start)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT id FROM appointments
+            WHERE start_min > ? AND start_min < ? AND end_min > ?
+              AND resource_id = ? AND IFNULL(status, '') != 'Cancelled'
+        ''', (start - MAX_DURATION, end, start, res_id)).fetchall()
+    return [r[0] for r in rows]
+
+
+def find_conflicts(start, duration=DEFAULT_DURATION, resource='clinic'):
+    """
+    Ids of active appointments on 'resource' overlapping [start, start + duration).
+    """
+    conn = _connect()
+    try:
+        start_min = to_minutes(start)
+        return _conflicts(conn, resource_id(conn, resource), start_min, start_min + duration)
+    finally:
+        conn.close()
+
+
+def _insert(conn, appt, res_id, resource):
+    start = appt['start']
+    return conn.execute('''
+        INSERT INTO appointments (patient_name, patient_id, date, time, type, status,
+                                  start_min, end_min, resource, resource_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (appt.get('patient_name'), appt.get('patient_id'), start.strftime("%Y-%m-%d"),
+          start.strftime("%H:%M"), appt.get('type', 'Consultation'), appt.get('status', 'Scheduled'),
+          to_minutes(start), to_minutes(start) + appt.get('duration', DEFAULT_DURATION),
+          resource, res_id)).lastrowid
+
+
+def _check_duration(appt):
+    duration = appt.get('duration', DEFAULT_DURATION)
+    if not 0 < duration <= MAX_DURATION:
+        raise ValueError(f"Duration must be 1-{MAX_DURATION} minutes, got {duration}")
+
+
+@timed('schedule.book')
+def book(patient_name, start, duration=DEFAULT_DURATION, type='Consultation',
+         resource='clinic', patient_id=None):
+    """
+    Books one appointment and returns its id. Raises SlotConflict if the
+    resource is already booked for any part of the interval.
+    """
+    return book_many([{'patient_name': patient_name, 'patient_id': patient_id, 'start': start,
+                       'duration': duration, 'type': type}], resource, on_conflict='raise')[0]
+
+
+@timed('schedule.book_many')
+def book_many(appointments, resource='clinic', on_conflict='skip'):
+    """
+    Books a list of dicts (patient_name, patient_id, start: datetime,
+    duration, type) in one transaction. Each is checked against existing
+    bookings and the ones before it in the list. on_conflict='skip' leaves
+    clashing entries out (their id is None); 'raise' rolls the batch back.
+    Returns the new ids in input order.
+    """
+    for appt in appointments:
+        _check_duration(appt)
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        res_id = resource_id(conn, resource)
+        ids = []
+        for appt in appointments:
+            start = to_minutes(appt['start'])
+            clashes = _conflicts(conn, res_id, start, start + appt.get('duration', DEFAULT_DURATION))
+            if clashes:
+                if on_conflict == 'raise':
+                    raise SlotConflict(f"{resource} is already booked at {appt['start']:%Y-%m-%d %H:%M}", clashes)
+                ids.append(None)
+                continue
+            ids.append(_insert(conn, appt, res_id, resource))
+        conn.execute("COMMIT")
+        return ids
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def cancel(appointment_id):
+    conn = _connect()
+    try:
+        conn.execute("UPDATE appointments SET status = 'Cancelled' WHERE id = ?", (int(appointment_id),))
+    finally:
+        conn.close()
+
+
+@timed('schedule.appointments_between')
+def appointments_between(start, end, resource=None):
+    """
+    Appointments overlapping [start, end) (datetimes), ordered by start.
+    Reads only the window: a start_min range scan bounded by MAX_DURATION.
+    """
+    start_min, end_min = to_minutes(start), to_minutes(end)
+    sql = '''
+        SELECT id, patient_name, patient_id, date, time, type, status, resource,
+               start_min, end_min - start_min AS duration
+        FROM appointments
+        WHERE start_min > ? AND start_min < ? AND end_min > ?
+    '''
+    params = [start_min - MAX_DURATION, end_min, start_min]
+    if resource:
+        sql += " AND resource = ?"
+        params.append(resource)
+    conn = sqlite3.connect(database.DB_FILE)
+    try:
+        return pd.read_sql_query(sql + " ORDER BY start_min", conn, params=params)
+    finally:
+        conn.close()
+
+
+def day_view(day, resource=None):
+    day = day if isinstance(day, date_cls) else date_cls.fromisoformat(str(day))
+    start = datetime.combine(day, time_cls())
+    return appointments_between(start, start + timedelta(days=1), resource)
+
+
+def week_view(day, resource=None):
+    """
+    Monday-to-Sunday week containing 'day'.
+    """
+    day = day if isinstance(day, date_cls) else date_cls.fromisoformat(str(day))
+    monday = datetime.combine(day - timedelta(days=day.weekday()), time_cls())
+    return appointments_between(monday, monday + timedelta(days=7), resource)
+
+
+def _busy(conn, res_id, lo, hi):
+    # Active intervals of one resource overlapping [lo, hi), sorted by start
+    if _has_rtree(conn):
+        rows = conn.execute('''
+            SELECT start_min, last_min + 1 FROM appointment_slots
+            WHERE resource_lo = ? AND start_min < ? AND last_min >= ?
+        ''', (res_id, hi, lo)).fetchall()
+    else:
+        rows = conn.execute('''
+            SELECT start_min, end_min FROM appointments
+            WHERE start_min > ? AND start_min < ? AND end_min > ?
+              AND resource_id = ? AND IFNULL(status, '') != 'Cancelled'
+        ''', (lo - MAX_DURATION, hi, lo, res_id)).fetchall()
+    return sorted(rows)
+
+
+def _free_starts(busy, lo, hi, duration, step):
+    # Sweep the sorted busy intervals; candidate starts are on the 'step' grid
+    starts = []
+    t = lo
+    i = 0
+    while t + duration <= hi:
+        while i < len(busy) and busy[i][1] <= t:
+            i += 1
+        clash = next((b for b in busy[i:] if b[0] < t + duration and b[1] > t), None)
+        if clash is None:
+            starts.append(t)
+            t += step
+        else:
+            # Jump past the clash, back onto the grid
+            t = lo + -(-(clash[1] - lo) // step) * step
+    return starts
+
+
+@timed('schedule.free_slots')
+def free_slots(day, duration=DEFAULT_DURATION, resource='clinic', step=15,
+               open_time=OPEN_TIME, close_time=CLOSE_TIME):
+    """
+    Start times (datetimes) on 'day' where 'resource' is free for 'duration'
+    minutes within opening hours.
+    """
+    lo, hi = _day_bounds(day, open_time, close_time)
+    conn = _connect()
+    try:
+        busy = _busy(conn, resource_id(conn, resource), lo, hi)
+    finally:
+        conn.close()
+    return [from_minutes(t) for t in _free_starts(busy, lo, hi, duration, step)]
+
+
+@timed('schedule.schedule_campaign')
+def schedule_campaign(patients, first_day, days=5, duration=DEFAULT_DURATION, resource='clinic',
+                      type='Screening', step=None, open_time=OPEN_TIME, close_time=CLOSE_TIME,
+                      skip_weekends=True):
+    """
+    Screening campaigns: gives each patient (dicts with patient_name and
+    optionally patient_id) the next free slot from first_day on, in one
+    transaction. Busy intervals are read once per day. Returns
+    (booked [(patient, start)], unplaced patients).
+    """
+    step = step or duration
+    first_day = first_day if isinstance(first_day, date_cls) else date_cls.fromisoformat(str(first_day))
+    queue = list(patients)
+    booked = []
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        res_id = resource_id(conn, resource)
+        for offset in range(days):
+            if not queue:
+                break
+            day = first_day + timedelta(days=offset)
+            if skip_weekends and day.weekday() >= 5:
+                continue
+            lo, hi = _day_bounds(day, open_time, close_time)
+            for t in _free_starts(_busy(conn, res_id, lo, hi), lo, hi, duration, step):
+                if not queue:
+                    break
+                patient = queue.pop(0)
+                start = from_minutes(t)
+                _insert(conn, {**patient, 'start': start, 'duration': duration, 'type': type}, res_id, resource)
+                booked.append((patient, start))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return booked, queue
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Appointment scheduling")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_day = sub.add_parser('day', help="List one day")
+    p_day.add_argument('date')
+    p_day.add_argument('--resource', default=None)
+    p_week = sub.add_parser('week', help="List the week containing a date")
+    p_week.add_argument('date')
+    p_week.add_argument('--resource', default=None)
+    p_free = sub.add_parser('free', help="Free start times on a day")
+    p_free.add_argument('date')
+    p_free.add_argument('--duration', type=int, default=DEFAULT_DURATION)
+    p_free.add_argument('--resource', default='clinic')
+    p_book = sub.add_parser('book', help="Book one appointment")
+    p_book.add_argument('patient_name')
+    p_book.add_argument('start', help="YYYY-MM-DD HH:MM")
+    p_book.add_argument('--duration', type=int, default=DEFAULT_DURATION)
+    p_book.add_argument('--type', default='Consultation')
+    p_book.add_argument('--resource', default='clinic')
+    p_camp = sub.add_parser('campaign', help="Book a screening campaign from a CSV (patient_name[, patient_id])")
+    p_camp.add_argument('csv')
+    p_camp.add_argument('first_day')
+    p_camp.add_argument('--days', type=int, default=5)
+    p_camp.add_argument('--duration', type=int, default=DEFAULT_DURATION)
+    p_camp.add_argument('--resource', default='clinic')
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command in ('day', 'week'):
+        view = day_view if args.command == 'day' else week_view
+        print(view(args.date, args.resource).to_string(index=False))
+    elif args.command == 'free':
+        slots = free_slots(date_cls.fromisoformat(args.date), args.duration, args.resource)
+        print(f"{len(slots)} free {args.duration}-minute slots on {args.resource}:")
+        print(" ".join(s.strftime("%H:%M") for s in slots))
+    elif args.command == 'book':
+        try:
+            appt_id = book(args.patient_name, datetime.strptime(args.start, "%Y-%m-%d %H:%M"),
+                           args.duration, args.type, args.resource)
+            print(f"Booked appointment {appt_id}")
+        except SlotConflict as e:
+            print(f"Not booked: {e} (appointments {e.conflicts})")
+    else:
+        patients = pd.read_csv(args.csv).to_dict('records')
+        booked, unplaced = schedule_campaign(patients, args.first_day, args.days, args.duration, args.resource)
+        print(f"Booked {len(booked)} patients, {len(unplaced)} without a slot in {args.days} days")
+        if booked:
+            print(f"First {booked[0][1]:%Y-%m-%d %H:%M}, last {booked[-1][1]:%Y-%m-%d %H:%M}")
@@ -0,0 +1,146 @@
+# Shared Clinical Scoring Module
+import os
+import threading
+import joblib
+import pandas as pd
+from src.metrics import timed, track
+
+MODEL_PATH = 'models/lung_cancer_model.pkl'
+
+# Column order the RandomForest was trained on (see src/model.py)
+EXPECTED_FEATURES = [
+    'GENDER', 'AGE', 'SMOKING', 'YELLOW_FINGERS', 'ANXIETY',
+    'PEER_PRESSURE', 'CHRONIC DISEASE', 'FATIGUE ', 'ALLERGY ',
+    'WHEEZING', 'ALCOHOL CONSUMING', 'COUGHING',
+    'SHORTNESS OF BREATH', 'SWALLOWING DIFFICULTY', 'CHEST PAIN'
+]
+
+_model_lock = threading.Lock()
+_model_cache = {}
+
+
+def load_clinical_model(model_path=MODEL_PATH):
+    """
+    Loads the clinical model once per process and reuses it afterwards.
+    The cache is invalidated when the file on disk changes.
+    """
+    mtime = os.path.getmtime(model_path)
+    cached = _model_cache.get(model_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with _model_lock:
+        cached = _model_cache.get(model_path)
+        if cached is None or cached[0] != mtime:
+            with track('predictor.model_load'):
+                model = joblib.load(model_path)
+            _model_cache[model_path] = (mtime, model)
+            cached = _model_cache[model_path]
+    return cached[1]
+
+
+# Plausible patient ages; anything outside is a data-entry error
+AGE_RANGE = (0, 120)
+# Request keys accepted for each feature (clients need not reproduce the
+# trailing spaces in 'FATIGUE ' / 'ALLERGY ')
+_FEATURE_KEYS = {f.strip(): f for f in EXPECTED_FEATURES}
+
+
+def validate_record(record):
+    """
+    Checks one input record (dict keyed by EXPECTED_FEATURES): GENDER and
+    AGE present, AGE a number within AGE_RANGE, every other feature 0 or 1,
+    no unknown keys. Returns (record with canonical keys, list of errors).
+    """
+    if not isinstance(record, dict):
+        return None, ['record must be a JSON object']
+    errors = []
+    clean = {}
+    for key, value in record.items():
+        name = _FEATURE_KEYS.get(str(key).strip())
+        if name is None:
+            errors.append(f"unknown field {key!r}")
+            continue
+        if name == 'AGE':
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+                errors.append(f"AGE must be a number, got {value!r}")
+            elif not AGE_RANGE[0] <= value <= AGE_RANGE[1]:
+                errors.append(f"AGE must be between {AGE_RANGE[0]} and {AGE_RANGE[1]}, got {value}")
+        elif isinstance(value, bool) or value not in (0, 1):
+            errors.append(f"{name.strip()} must be 0 or 1, got {value!r}")
+        clean[name] = value
+    errors.extend(f"missing required field {f}" for f in ('GENDER', 'AGE') if f not in clean)
+    return clean, errors
+
+
+def check_features(rows):
+    """
+    Parses rows (list of dicts or a DataFrame keyed by EXPECTED_FEATURES)
+    without guessing: a symptom that is absent (missing key, None, '') means
+    0, but a value that is present and not 0/1 (or an AGE that is not a
+    number within AGE_RANGE) is an error for that row, never a silent 0.
+    Returns (numeric frame, {row position: error message}).
+    """
+    df = rows.copy() if isinstance(rows, pd.DataFrame) else pd.DataFrame(list(rows))
+    df = df.reset_index(drop=True)
+    missing = [col for col in ('GENDER', 'AGE') if col not in df.columns]
+    if missing:
+        raise ValueError(f"Missing required fields: {missing}")
+    for col in EXPECTED_FEATURES:
+        if col not in df.columns:
+            df[col] = 0
+    raw = df[EXPECTED_FEATURES].replace('', None)
+    # Archived rows store flags as text ('1'/'0')
+    X = raw.apply(pd.to_numeric, errors='coerce')
+    absent = raw.isna()
+    errors = {}
+    for col in EXPECTED_FEATURES:
+        if col == 'AGE':
+            bad = X[col].isna() | (X[col] < AGE_RANGE[0]) | (X[col] > AGE_RANGE[1])
+        else:
+            bad = ~absent[col] & ~X[col].isin([0, 1])
+            if col == 'GENDER':
+                bad |= absent[col]
+        for pos in bad[bad].index:
+            value = 'missing' if absent[col].iloc[pos] else repr(df[col].iloc[pos])
+            errors.setdefault(pos, []).append(f"{col.strip()}={value}")
+    errors = {pos: "Invalid " + ", ".join(cols) for pos, cols in errors.items()}
+    return X.fillna(0), errors
+
+
+def build_feature_frame(rows):
+    """
+    Builds the model input frame (0/1 encoded, GENDER 1=Male). Missing
+    symptoms default to 0; invalid values raise ValueError (see check_features).
+    """
+    X, errors = check_features(rows)
+    if errors:
+        shown = '; '.join(f"row {pos}: {msg}" for pos, msg in list(errors.items())[:5])
+        raise ValueError(f"{len(errors)} invalid record(s): {shown}")
+    return X.astype(int)
+
+
+@timed('predictor.score_batch')
+def score_records(rows, model=None, errors='raise'):
+    """
+    Scores a batch of patient rows in one model call.
+    Returns a list of {'prediction': 0/1, 'probability': float}. Invalid
+    rows raise ValueError, or with errors='return' get a ValueError in their
+    place while the valid rows are still scored.
+    """
+    if model is None:
+        model = load_clinical_model()
+    if errors == 'raise':
+        X, bad = build_feature_frame(rows), {}
+    else:
+        X, bad = check_features(rows)
+    results = [ValueError(bad[pos]) if pos in bad else None for pos in range(len(X))]
+    valid = [pos for pos in range(len(X)) if pos not in bad]
+    if not valid:
+        return results
+    with track('predictor.inference'):
+        proba = model.predict_proba(X.iloc[valid].astype(int))
+    # Same decision rule as model.predict, without a second pass over the trees
+    preds = model.classes_[proba.argmax(axis=1)]
+    for pos, pred, prob in zip(valid, preds, proba[:, 1]):
+        results[pos] = {'prediction': int(pred), 'probability': float(prob)}
+    return results
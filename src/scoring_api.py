@@ -0,0 +1,326 @@
+# Headless Scoring API (ASGI)
+#
+# Run with:  uvicorn src.scoring_api:app --port 8600
+# or, without uvicorn installed:  python -m src.scoring_api
+#
+# Endpoints:
+#   GET  /health
+#   POST /score/clinical   JSON {"records": [{...}, ...]} or a single record dict
+#   POST /score/ct         raw image bytes (JPEG/PNG) as the request body
+import os
+import io
+import json
+import asyncio
+from http import HTTPStatus
+from concurrent.futures import ThreadPoolExecutor
+
+from src.scoring import score_records, load_clinical_model, validate_record
+from src import image_model
+
+# Worker threads for model calls (sklearn / TF release the GIL in their kernels)
+EXECUTOR_WORKERS = int(os.environ.get('SCORING_WORKERS', os.cpu_count() or 2))
+# Requests are coalesced into one model call up to this size...
+MAX_BATCH_SIZE = int(os.environ.get('SCORING_MAX_BATCH', 64))
+# ...or until the oldest request has waited this long
+MAX_BATCH_WAIT = float(os.environ.get('SCORING_BATCH_WAIT_MS', 5)) / 1000.0
+# Pending items per queue before new requests are rejected with 503
+MAX_PENDING = int(os.environ.get('SCORING_MAX_PENDING', 2048))
+# Largest accepted request body
+MAX_BODY_BYTES = int(os.environ.get('SCORING_MAX_BODY_MB', 20)) * 1024 * 1024
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    """
+    Collects individual items from concurrent requests and runs them through
+    'batch_fn' in one executor call. The pending queue is bounded so a burst
+    is rejected early instead of growing latency without limit.
+    """
+    def __init__(self, batch_fn, executor, max_batch=MAX_BATCH_SIZE,
+                 max_wait=MAX_BATCH_WAIT, max_pending=MAX_PENDING):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def submit_many(self, items):
+        """
+        Enqueues items and waits for their results. Raises Overloaded if the
+        queue cannot take all of them.
+        """
+        if self.queue.maxsize - self.queue.qsize() < len(items):
+            raise Overloaded()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for item in items:
+            fut = loop.create_future()
+            self.queue.put_nowait((item, fut))
+            futures.append(fut)
+        return await asyncio.gather(*futures)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self.executor, self.batch_fn, items)
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                if fut.done():
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+
+def _score_ct_batch(images):
+    # Decode failures are returned per item so they only fail their own request
+    results = [None] * len(images)
+    arrays, positions = [], []
+    for i, data in enumerate(images):
+        try:
+            arrays.append(image_model.preprocess_image(io.BytesIO(data)))
+            positions.append(i)
+        except image_model.ScanTooLarge as e:
+            results[i] = e
+        except Exception as e:
+            results[i] = ValueError(f"Could not decode image: {e}")
+    for i, prob in zip(positions, image_model.predict_batch(arrays)):
+        results[i] = prob
+    return results
+
+
+class ScoringService:
+    def __init__(self, workers=EXECUTOR_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scoring')
+        self.clinical = MicroBatcher(score_records, self.executor)
+        # Image batches are heavier; keep them small
+        self.ct = MicroBatcher(_score_ct_batch, self.executor, max_batch=16)
+
+    async def startup(self):
+        loop = asyncio.get_running_loop()
+        # Warm both models before accepting traffic
+        await loop.run_in_executor(self.executor, load_clinical_model)
+        await loop.run_in_executor(self.executor, image_model.get_model)
+        self.clinical.start()
+        self.ct.start()
+
+    async def shutdown(self):
+        await self.clinical.stop()
+        await self.ct.stop()
+        self.executor.shutdown(wait=False)
+
+
+service = ScoringService()
+
+
+async def _read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        body = message.get('body', b'')
+        size += len(body)
+        if size > MAX_BODY_BYTES:
+            raise ValueError("Request body too large")
+        chunks.append(body)
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+async def _send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode('utf-8')
+    raw_headers = [(b'content-type', b'application/json'),
+                   (b'content-length', str(len(body)).encode())]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.encode(), value.encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await service.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            except Exception as e:
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+        elif message['type'] == 'lifespan.shutdown':
+            await service.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """
+    ASGI entry point.
+    """
+    if scope['type'] == 'lifespan':
+        await _lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    try:
+        if method == 'GET' and path == '/health':
+            await _send_json(send, 200, {
+                'status': 'ok',
+                'clinical_pending': service.clinical.queue.qsize(),
+                'ct_pending': service.ct.queue.qsize()
+            })
+
+        elif method == 'POST' and path == '/score/clinical':
+            payload = json.loads(await _read_body(receive) or b'{}')
+            records = payload.get('records', [payload]) if isinstance(payload, dict) else payload
+            if not records:
+                await _send_json(send, 400, {'error': 'No records supplied'})
+                return
+            # Validate here so one bad request cannot fail a shared batch
+            if not isinstance(records, list):
+                await _send_json(send, 400, {'error': 'records must be a list'})
+                return
+            clean = []
+            for i, record in enumerate(records):
+                record, errors = validate_record(record)
+                if errors:
+                    await _send_json(send, 400, {'error': f"Invalid record {i}", 'details': errors})
+                    return
+                clean.append(record)
+            results = await service.clinical.submit_many(clean)
+            for result in results:
+                result['risk'] = 'High' if result['prediction'] == 1 else 'Low'
+            await _send_json(send, 200, {'results': results})
+
+        elif method == 'POST' and path == '/score/ct':
+            data = await _read_body(receive)
+            if not data:
+                await _send_json(send, 400, {'error': 'Empty image body'})
+                return
+            prob = (await service.ct.submit_many([data]))[0]
+            await _send_json(send, 200, {'probability': prob})
+
+        else:
+            await _send_json(send, 404, {'error': 'Not found'})
+
+    except Overloaded:
+        await _send_json(send, 503, {'error': 'Scoring queue full'}, {'retry-after': '1'})
+    except image_model.ScanTooLarge as e:
+        await _send_json(send, 413, {'error': str(e)})
+    except (ValueError, KeyError, TypeError) as e:
+        await _send_json(send, 400, {'error': str(e)})
+    except Exception as e:
+        print(f"Scoring API Error: {e}")
+        await _send_json(send, 500, {'error': 'Internal error'})
+
+
+# --- Minimal HTTP/1.1 server for environments without uvicorn ---
+
+async def _handle_connection(reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                writer.write(b'HTTP/1.1 413 Payload Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                break
+            body = await reader.readexactly(length) if length else b''
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            response = {}
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    response['status'] = message['status']
+                    response['headers'] = message['headers']
+                else:
+                    response['body'] = message.get('body', b'')
+
+            scope = {'type': 'http', 'method': method, 'path': target.split('?')[0], 'headers': headers}
+            await app(scope, receive, send)
+
+            status = response['status']
+            head = f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n".encode()
+            for key, value in response['headers']:
+                head += key + b': ' + value + b'\r\n'
+            writer.write(head + b'\r\n' + response.get('body', b''))
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host='127.0.0.1', port=8600, sock=None):
+    # 'sock': an already listening socket (pre-forked workers share one, see src/prefork.py)
+    await service.startup()
+    if sock is not None:
+        server = await asyncio.start_server(_handle_connection, sock=sock)
+        host, port = sock.getsockname()[:2]
+    else:
+        server = await asyncio.start_server(_handle_connection, host, port, backlog=1024)
+    print(f"Scoring API listening on http://{host}:{port} (pid {os.getpid()})")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.shutdown()
+
+
+if __name__ == "__main__":
+    port = int(os.environ.get('SCORING_PORT', 8600))
+    try:
+        import uvicorn
+        uvicorn.run(app, host='127.0.0.1', port=port)
+    except ImportError:
+        asyncio.run(serve(port=port))
@@ -0,0 +1,318 @@
+# Synthetic Patient Data Generator
+#
+# Fits per-feature marginals and the pairwise correlation structure of
+# data/lung_cancer.csv (Gaussian copula) and samples any number of rows.
+#   python -m src.synthetic_data --rows 1000000 --format csv --out data/synthetic_patients.csv
+#   python -m src.synthetic_data --rows 1000000 --format parquet --out data/synthetic_patients.parquet
+#   python -m src.synthetic_data --rows 1000000 --format sqlite --out data/medical_records.db
+import os
+import sqlite3
+import argparse
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+SOURCE_FILE = 'data/lung_cancer.csv'
+CHUNK_SIZE = 100_000
+CALIBRATION_ROUNDS = 8
+CALIBRATION_ROWS = 50_000
+
+FIRST_NAMES = np.array(["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda",
+                        "David", "Elizabeth", "Grace", "Kwame", "Ama", "Kofi", "Abena", "Yaw", "Esi", "Samuel"])
+LAST_NAMES = np.array(["Smith", "Johnson", "Mensah", "Owusu", "Brown", "Boateng", "Asante", "Williams",
+                       "Jones", "Osei", "Garcia", "Miller", "Addo", "Davis", "Appiah", "Wilson"])
+LOCATIONS = np.array(["Accra", "Kumasi", "Tamale", "Takoradi", "Cape Coast", "Ho", "Koforidua", "Sunyani"])
+
+# patients table column -> source column (see src/database.py)
+PATIENT_COLUMNS = {
+    'gender': 'GENDER', 'age': 'AGE', 'smoking': 'SMOKING', 'yellow_fingers': 'YELLOW_FINGERS',
+    'anxiety': 'ANXIETY', 'peer_pressure': 'PEER_PRESSURE', 'chronic_disease': 'CHRONIC DISEASE',
+    'fatigue': 'FATIGUE ', 'allergy': 'ALLERGY ', 'wheezing': 'WHEEZING', 'alcohol': 'ALCOHOL CONSUMING',
+    'coughing': 'COUGHING', 'shortness_of_breath': 'SHORTNESS OF BREATH',
+    'swallowing_difficulty': 'SWALLOWING DIFFICULTY', 'chest_pain': 'CHEST PAIN'
+}
+
+
+def _norm_ppf(p):
+    # Acklam's rational approximation of the inverse normal CDF (vectorized,
+    # avoids a scipy dependency). Relative error < 1.2e-9.
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    c = [-7.784894002430293e-03, -3.223964580411365e-01, -2.400758277161838e+00,
+         -2.549671984034590e+00, 4.374664141464968e+00, 2.938163982698783e+00]
+    d = [7.784695709041462e-03, 3.224671290700398e-01, 2.445134137142996e+00,
+         3.754408661907416e+00]
+    p = np.clip(np.asarray(p, dtype=float), 1e-12, 1 - 1e-12)
+    out = np.empty_like(p)
+    low, high = p < 0.02425, p > 1 - 0.02425
+    mid = ~(low | high)
+    q = np.sqrt(-2 * np.log(p[low]))
+    out[low] = (((((c[0]*q+c[1])*q+c[2])*q+c[3])*q+c[4])*q+c[5]) / ((((d[0]*q+d[1])*q+d[2])*q+d[3])*q+1)
+    q = np.sqrt(-2 * np.log(1 - p[high]))
+    out[high] = -(((((c[0]*q+c[1])*q+c[2])*q+c[3])*q+c[4])*q+c[5]) / ((((d[0]*q+d[1])*q+d[2])*q+d[3])*q+1)
+    q = p[mid] - 0.5
+    r = q * q
+    out[mid] = (((((a[0]*r+a[1])*r+a[2])*r+a[3])*r+a[4])*r+a[5])*q / (((((b[0]*r+b[1])*r+b[2])*r+b[3])*r+b[4])*r+1)
+    return out
+
+
+def _norm_cdf(x):
+    # Abramowitz-Stegun 7.1.26 erf approximation; plenty for uniform ranks
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x) / np.sqrt(2.0)
+    t = 1.0 / (1.0 + 0.3275911 * z)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1.0 - poly * np.exp(-z * z)
+    return 0.5 * (1.0 + np.sign(x) * erf)
+
+
+def _nearest_correlation(corr):
+    # Clip negative eigenvalues and rescale to a unit diagonal so the matrix
+    # stays a valid (Cholesky-factorable) correlation matrix
+    corr = (corr + corr.T) / 2
+    np.fill_diagonal(corr, 1.0)
+    eigvals, eigvecs = np.linalg.eigh(corr)
+    corr = eigvecs @ np.diag(np.clip(eigvals, 1e-6, None)) @ eigvecs.T
+    d = np.sqrt(np.diag(corr))
+    return corr / np.outer(d, d)
+
+
+class SyntheticPatientGenerator:
+    """
+    Gaussian-copula model of the clinical dataset. Each column keeps its own
+    empirical marginal; dependence between columns comes from the correlation
+    matrix of their normal scores.
+    """
+    def __init__(self, source_path=SOURCE_FILE, seed=42):
+        self.source_path = source_path
+        self.rng = np.random.default_rng(seed)
+        self.columns = None
+        self.quantiles = None
+        self.cholesky = None
+        self._fit()
+
+    def _fit(self):
+        df = pd.read_csv(self.source_path)
+        df['GENDER'] = df['GENDER'].map({'M': 1, 'F': 0})
+        df['LUNG_CANCER'] = df['LUNG_CANCER'].map({'YES': 1, 'NO': 0})
+        df = df.dropna()
+        self.columns = df.columns.tolist()
+
+        values = df.to_numpy(dtype=float)
+        n = len(values)
+        # Normal scores from mid-ranks (ties share a rank, which keeps binary columns exact)
+        ranks = df.rank(method='average').to_numpy()
+        scores = _norm_ppf((ranks - 0.5) / n)
+        corr = _nearest_correlation(np.nan_to_num(np.corrcoef(scores, rowvar=False)))
+
+        # Sorted column values act as the inverse empirical CDF
+        self.quantiles = np.sort(values, axis=0)
+
+        # Discretizing a latent normal shrinks correlations (most columns are
+        # binary), so adjust the latent matrix until the output matches the
+        # observed correlations.
+        target = np.nan_to_num(np.corrcoef(values, rowvar=False))
+        calib_rng = np.random.default_rng(0)
+        for _ in range(CALIBRATION_ROUNDS):
+            self.cholesky = np.linalg.cholesky(corr)
+            sample = self._from_latent(calib_rng.standard_normal((CALIBRATION_ROWS, len(self.columns))))
+            achieved = np.nan_to_num(np.corrcoef(sample, rowvar=False))
+            corr = _nearest_correlation(corr + (target - achieved))
+        self.correlation = pd.DataFrame(corr, index=self.columns, columns=self.columns)
+        self.cholesky = np.linalg.cholesky(corr)
+
+    def _from_latent(self, z):
+        z = z @ self.cholesky.T
+        u = _norm_cdf(z)
+        n_src = self.quantiles.shape[0]
+        out = np.empty_like(u)
+        positions = u * (n_src - 1)
+        lo = np.floor(positions).astype(np.int64)
+        hi = np.minimum(lo + 1, n_src - 1)
+        frac = positions - lo
+        for j, col in enumerate(self.columns):
+            qs = self.quantiles[:, j]
+            if col == 'AGE':
+                # Interpolate so ages between observed values appear
+                out[:, j] = np.rint(qs[lo[:, j]] * (1 - frac[:, j]) + qs[hi[:, j]] * frac[:, j])
+            else:
+                out[:, j] = qs[np.rint(positions[:, j]).astype(np.int64)]
+        return out.astype(np.int64)
+
+    def sample(self, n_rows):
+        """
+        Returns an (n_rows, n_columns) integer array in the source encoding
+        (GENDER 1=M, symptoms 1/2, LUNG_CANCER 1=YES).
+        """
+        return self._from_latent(self.rng.standard_normal((n_rows, len(self.columns))))
+
+    def sample_frame(self, n_rows):
+        """
+        Returns a DataFrame laid out exactly like data/lung_cancer.csv.
+        """
+        arr = self.sample(n_rows)
+        df = pd.DataFrame(arr, columns=self.columns)
+        df['GENDER'] = np.where(df['GENDER'] == 1, 'M', 'F')
+        df['LUNG_CANCER'] = np.where(df['LUNG_CANCER'] == 1, 'YES', 'NO')
+        return df
+
+    def iter_chunks(self, n_rows, chunk_size=CHUNK_SIZE):
+        remaining = n_rows
+        while remaining > 0:
+            size = min(chunk_size, remaining)
+            yield size
+            remaining -= size
+
+    def patient_rows(self, n_rows, start_date, end_date):
+        """
+        Returns a DataFrame matching the 'patients' table columns (without id),
+        encoded the way app.py saves assessments (0/1 flags as text). Dates are
+        sorted within [start_date, end_date) so ids increase with time.
+        """
+        arr = self.sample(n_rows)
+        col_idx = {col: i for i, col in enumerate(self.columns)}
+        span = max(int((end_date - start_date).total_seconds()), 1)
+        offsets = self.rng.integers(0, span, n_rows)
+        dates = (np.datetime64(start_date.replace(microsecond=0)) + offsets.astype('timedelta64[s]'))
+
+        rows = {
+            'date': np.datetime_as_string(np.sort(dates), unit='s'),
+            'patient_name': np.char.add(np.char.add(self.rng.choice(FIRST_NAMES, n_rows), ' '),
+                                        self.rng.choice(LAST_NAMES, n_rows)),
+            'patient_id': None,
+        }
+        for db_col, src_col in PATIENT_COLUMNS.items():
+            values = arr[:, col_idx[src_col]]
+            if db_col == 'age':
+                rows[db_col] = values
+            elif db_col == 'gender':
+                rows[db_col] = values.astype(str)
+            else:
+                rows[db_col] = (values - 1).astype(str)  # 1/2 -> 0/1 like the model input
+        rows['phone'] = np.char.add('0', self.rng.integers(200000000, 599999999, n_rows).astype(str))
+        rows['location'] = self.rng.choice(LOCATIONS, n_rows)
+
+        # Model-like probability: label-driven with noise, then thresholded the same way
+        label = arr[:, col_idx['LUNG_CANCER']]
+        prob = np.clip(np.where(label == 1, self.rng.beta(5, 2, n_rows), self.rng.beta(2, 5, n_rows)), 0, 1)
+        rows['risk_level'] = np.where(prob > 0.5, 'High', 'Low')
+        rows['malignancy_probability'] = np.round(prob, 4)
+        df = pd.DataFrame(rows)
+        df['date'] = df['date'].str.replace('T', ' ')
+        return df
+
+
+def write_csv(generator, n_rows, out_path, chunk_size=CHUNK_SIZE):
+    header = True
+    with open(out_path, 'w', newline='') as f:
+        for size in generator.iter_chunks(n_rows, chunk_size):
+            generator.sample_frame(size).to_csv(f, index=False, header=header)
+            header = False
+    return out_path
+
+
+def write_parquet(generator, n_rows, out_path, chunk_size=CHUNK_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print("pyarrow not installed. Use --format csv instead.")
+        return None
+    writer = None
+    try:
+        for size in generator.iter_chunks(n_rows, chunk_size):
+            table = pa.Table.from_pandas(generator.sample_frame(size), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(out_path, table.schema, compression='zstd')
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    return out_path
+
+
+def write_sqlite(generator, n_rows, db_path, chunk_size=CHUNK_SIZE, days=365):
+    """
+    Bulk-inserts into the 'patients' table of db_path (created with the app
+    schema if missing), one transaction per chunk. Visit dates cover the
+    last 'days' days in insertion order.
+    """
+    os.environ.setdefault('MEDICAL_DB_FILE', db_path)
+    from src import database
+    database.DB_FILE = db_path
+    database.init_db()
+
+    # Autocommit; each chunk is one explicit BEGIN IMMEDIATE ... COMMIT
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ['date', 'patient_name', 'patient_id'] + list(PATIENT_COLUMNS) + \
+                  ['phone', 'location', 'risk_level', 'malignancy_probability']
+        sql = f"INSERT INTO patients ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        end = datetime.now()
+        chunk_start = end - timedelta(days=days)
+        per_row = timedelta(days=days) / max(n_rows, 1)
+        # The per-row search index trigger makes bulk loads ~10x slower; each
+        # chunk drops it, indexes its rows with one INSERT ... SELECT and
+        # recreates it, all in the chunk's transaction. Other writers (the
+        # app, write-behind) are locked out meanwhile, so their rows are
+        # always indexed by the trigger and never twice.
+        trigger = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = 'patients_fts_insert'").fetchone()
+        for size in generator.iter_chunks(n_rows, chunk_size):
+            chunk_end = chunk_start + per_row * size
+            df = generator.patient_rows(size, chunk_start, chunk_end)[columns]
+            chunk_start = chunk_end
+            df['age'] = df['age'].astype(int)
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                last_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM patients").fetchone()[0]
+                if trigger:
+                    conn.execute("DROP TRIGGER IF EXISTS patients_fts_insert")
+                conn.executemany(sql, df.itertuples(index=False, name=None))
+                if trigger:
+                    conn.execute('''
+                        INSERT INTO patients_fts(rowid, patient_name, phone, location, patient_id)
+                        SELECT id, patient_name, phone, location, patient_id FROM patients WHERE id > ?
+                    ''', (last_id,))
+                    conn.execute(trigger[0])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    return db_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic lung cancer patient data")
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--format', choices=['csv', 'parquet', 'sqlite'], default='csv')
+    parser.add_argument('--out', default=None)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--source', default=SOURCE_FILE)
+    args = parser.parse_args(argv)
+
+    default_out = {'csv': 'data/synthetic_patients.csv', 'parquet': 'data/synthetic_patients.parquet',
+                   'sqlite': 'data/synthetic_records.db'}
+    out = args.out or default_out[args.format]
+    generator = SyntheticPatientGenerator(args.source, seed=args.seed)
+
+    start = datetime.now()
+    if args.format == 'csv':
+        write_csv(generator, args.rows, out, args.chunk_size)
+    elif args.format == 'parquet':
+        write_parquet(generator, args.rows, out, args.chunk_size)
+    else:
+        write_sqlite(generator, args.rows, out, args.chunk_size)
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"Wrote {args.rows:,} rows to {out} in {elapsed:.1f}s ({args.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
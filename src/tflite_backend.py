@@ -0,0 +1,265 @@
+# TFLite Export and Inference Backend for the CT Scan CNN
+#
+# Export (needs full TensorFlow):
+#   python -m src.tflite_backend export --quantize int8 --calibration-dir data/synthetic_ct
+# Compare against the Keras model:
+#   python -m src.tflite_backend compare --images data/synthetic_ct --tflite models/ct_scan_model_int8.tflite
+# Serve with it: CT_INFERENCE_BACKEND=tflite (see src/image_model.py). Inference
+# only needs the interpreter, so workers can run with the small tflite-runtime
+# package instead of TensorFlow.
+import os
+import csv
+import json
+import time
+import argparse
+import threading
+import numpy as np
+
+try:
+    from tflite_runtime.interpreter import Interpreter
+except ImportError:
+    try:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    except ImportError:
+        Interpreter = None
+
+KERAS_MODEL_PATH = 'models/ct_scan_model.h5'
+TFLITE_MODEL_PATH = 'models/ct_scan_model.tflite'
+REPORT_PATH = 'models/ct_backend_report.json'
+IMG_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+CALIBRATION_SAMPLES = 200
+
+
+def _list_images(directory, limit=None):
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMG_EXTENSIONS):
+                paths.append(os.path.join(root, name))
+    paths.sort()
+    return paths[:limit] if limit else paths
+
+
+def _calibration_batches(calibration_dir, samples):
+    from src.image_model import preprocess_image, IMG_SIZE
+    paths = _list_images(calibration_dir, samples) if calibration_dir else []
+    if paths:
+        for path in paths:
+            yield [preprocess_image(path)[None, ...]]
+    else:
+        # No calibration set given: random scans only fix the input range
+        print("No calibration images found; using random inputs (int8 accuracy will suffer).")
+        rng = np.random.default_rng(0)
+        for _ in range(samples):
+            yield [rng.random((1, IMG_SIZE[0], IMG_SIZE[1], 3), dtype=np.float32)]
+
+
+def export_tflite(keras_path=KERAS_MODEL_PATH, out_path=None, quantize='none',
+                  calibration_dir=None, samples=CALIBRATION_SAMPLES):
+    """
+    Converts the Keras .h5 model to TFLite.
+    quantize:
+        none     float32 weights and activations
+        float16  float16 weights (about half the size, float32 compute on CPU)
+        dynamic  int8 weights, float activations (no calibration needed)
+        int8     full-integer weights and activations, calibrated on
+                 'calibration_dir' scans (input and output stay float32)
+    """
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize in ('float16', 'dynamic', 'int8'):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantize == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantize == 'int8':
+        converter.representative_dataset = lambda: _calibration_batches(calibration_dir, samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    tflite_model = converter.convert()
+
+    if out_path is None:
+        suffix = '' if quantize == 'none' else f'_{quantize}'
+        out_path = TFLITE_MODEL_PATH.replace('.tflite', f'{suffix}.tflite')
+    tmp = out_path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(tflite_model)
+    os.replace(tmp, out_path)
+    print(f"TFLite model ({quantize}) saved to {out_path} ({len(tflite_model) / 1e6:.2f} MB)")
+    return out_path
+
+
+class TFLiteBackend:
+    """
+    Drop-in for the Keras model's predict() using the TFLite interpreter.
+    Handles quantized inputs/outputs and resizes the input tensor when the
+    batch size changes.
+    """
+    def __init__(self, model_path=TFLITE_MODEL_PATH, num_threads=None):
+        if Interpreter is None:
+            raise ImportError("Neither tflite-runtime nor tensorflow is installed.")
+        self.model_path = model_path
+        self.num_threads = num_threads or int(os.environ.get('TFLITE_THREADS', os.cpu_count() or 1))
+        self.interpreter = Interpreter(model_path=model_path, num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self.input['shape'][0])
+        # An interpreter must not be invoked from two threads at once
+        self._lock = threading.Lock()
+
+    def _resize(self, batch_size):
+        if batch_size != self.batch_size:
+            shape = list(self.input['shape'])
+            shape[0] = batch_size
+            self.interpreter.resize_tensor_input(self.input['index'], shape)
+            self.interpreter.allocate_tensors()
+            self.input = self.interpreter.get_input_details()[0]
+            self.output = self.interpreter.get_output_details()[0]
+            self.batch_size = batch_size
+
+    def predict(self, batch, verbose=0):
+        with self._lock:
+            return self._predict(np.asarray(batch, dtype=np.float32))
+
+    def _predict(self, batch):
+        self._resize(len(batch))
+        if self.input['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self.input['quantization']
+            batch = np.clip(np.round(batch / scale + zero_point),
+                            np.iinfo(self.input['dtype']).min,
+                            np.iinfo(self.input['dtype']).max).astype(self.input['dtype'])
+        self.interpreter.set_tensor(self.input['index'], batch)
+        self.interpreter.invoke()
+        out = self.interpreter.get_tensor(self.output['index'])
+        if self.output['dtype'] in (np.int8, np.uint8):
+            scale, zero_point = self.output['quantization']
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+def _time_backend(model, arrays, batch_size):
+    single = []
+    for arr in arrays:
+        start = time.perf_counter()
+        model.predict(arr[None, ...], verbose=0)
+        single.append(time.perf_counter() - start)
+    probs = []
+    start = time.perf_counter()
+    for i in range(0, len(arrays), batch_size):
+        probs.extend(np.asarray(model.predict(np.stack(arrays[i:i + batch_size]), verbose=0))[:, 0])
+    batch_elapsed = time.perf_counter() - start
+    single_ms = np.array(single) * 1000
+    return np.array(probs), {
+        'single_p50_ms': float(np.percentile(single_ms, 50)),
+        'single_p95_ms': float(np.percentile(single_ms, 95)),
+        'batch_scans_per_s': len(arrays) / batch_elapsed if batch_elapsed else 0.0
+    }
+
+
+def compare_backends(images_dir, tflite_paths, keras_path=KERAS_MODEL_PATH, limit=200,
+                     batch_size=16, num_threads=None, report_path=REPORT_PATH):
+    """
+    Runs the Keras model and each TFLite file over the same scans and writes
+    a JSON report: latency, throughput, file size, RSS growth on load, and
+    agreement with Keras (plus accuracy when a manifest.csv with labels exists).
+    """
+    from src.image_model import preprocess_image
+    paths = _list_images(images_dir, limit)
+    if not paths:
+        print(f"No images found in {images_dir}")
+        return None
+    arrays = [preprocess_image(p) for p in paths]
+
+    labels = None
+    manifest = os.path.join(images_dir, 'manifest.csv')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            by_file = {row['file']: int(row['label']) for row in csv.DictReader(f)}
+        labels = np.array([by_file.get(os.path.basename(p), -1) for p in paths])
+
+    results = []
+    reference = None
+    candidates = [('keras', keras_path)] + [('tflite', p) for p in tflite_paths]
+    for kind, path in candidates:
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        if kind == 'keras':
+            import tensorflow as tf
+            model = tf.keras.models.load_model(path)
+        else:
+            model = TFLiteBackend(path, num_threads)
+        load_s = time.perf_counter() - start
+        rss_after = _rss_mb()
+
+        probs, timing = _time_backend(model, arrays, batch_size)
+        entry = {
+            'backend': kind,
+            'path': path,
+            'file_mb': os.path.getsize(path) / 1e6,
+            'load_s': load_s,
+            'rss_growth_mb': (rss_after - rss_before) if rss_before is not None else None,
+            **timing
+        }
+        if reference is None:
+            reference = probs
+        else:
+            entry['max_abs_diff_vs_keras'] = float(np.max(np.abs(probs - reference)))
+            entry['label_agreement_vs_keras'] = float(np.mean((probs > 0.5) == (reference > 0.5)))
+        if labels is not None and (labels >= 0).any():
+            known = labels >= 0
+            entry['accuracy'] = float(np.mean((probs[known] > 0.5) == labels[known]))
+        results.append(entry)
+        del model
+
+    report = {'images': len(paths), 'batch_size': batch_size, 'results': results}
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'backend':<8}{'file MB':>9}{'p50 ms':>9}{'p95 ms':>9}{'scans/s':>9}{'agree':>8}  path")
+    for r in results:
+        agree = r.get('label_agreement_vs_keras')
+        print(f"{r['backend']:<8}{r['file_mb']:>9.2f}{r['single_p50_ms']:>9.2f}{r['single_p95_ms']:>9.2f}"
+              f"{r['batch_scans_per_s']:>9.1f}{(f'{agree:.3f}' if agree is not None else '-'):>8}  {r['path']}")
+    print(f"Report written to {report_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TFLite export and backend comparison for the CT model")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    exp = sub.add_parser('export')
+    exp.add_argument('--keras', default=KERAS_MODEL_PATH)
+    exp.add_argument('--out', default=None)
+    exp.add_argument('--quantize', choices=['none', 'float16', 'dynamic', 'int8'], default='none')
+    exp.add_argument('--calibration-dir', default=None)
+    exp.add_argument('--samples', type=int, default=CALIBRATION_SAMPLES)
+
+    cmp = sub.add_parser('compare')
+    cmp.add_argument('--images', required=True)
+    cmp.add_argument('--tflite', nargs='+', default=[TFLITE_MODEL_PATH])
+    cmp.add_argument('--keras', default=KERAS_MODEL_PATH)
+    cmp.add_argument('--limit', type=int, default=200)
+    cmp.add_argument('--batch-size', type=int, default=16)
+    cmp.add_argument('--threads', type=int, default=None)
+    cmp.add_argument('--report', default=REPORT_PATH)
+
+    args = parser.parse_args()
+    if args.command == 'export':
+        export_tflite(args.keras, args.out, args.quantize, args.calibration_dir, args.samples)
+    else:
+        compare_backends(args.images, args.tflite, args.keras, args.limit, args.batch_size,
+                         args.threads, args.report)
@@ -0,0 +1,257 @@
+# Write-Behind Persistence for Patient Records
+#
+# The Predictor page hands finished assessments to a background writer
+# instead of inserting them itself, so the result shows without waiting on
+# SQLite. The writer drains a bounded queue and commits batches in a single
+# transaction, when FLUSH_SIZE records are waiting or FLUSH_INTERVAL has passed.
+#
+# RECORD_DURABILITY controls what "saved" means:
+#   sync     caller waits until its record is committed (synchronous=FULL)
+#   batched  caller returns at once; batches commit with synchronous=FULL (default)
+#   relaxed  caller returns at once; WAL + synchronous=NORMAL, so a power loss
+#            (not an app crash) can lose the last commits
+# In 'batched' and 'relaxed' mode a record is only in memory until its batch
+# commits (up to FLUSH_INTERVAL, longer while the database is locked): if the
+# process crashes or is killed first, records still queued are lost. Use
+# 'sync' where every acknowledged record must survive a crash.
+# submit() returns False when a record could not be written (a direct write
+# after the queue filled, or a 'sync' commit, that failed).
+import os
+import time
+import queue
+import sqlite3
+import atexit
+import threading
+
+from src import database
+from src.metrics import observe
+
+DURABILITY = os.environ.get('RECORD_DURABILITY', 'batched')
+QUEUE_SIZE = int(os.environ.get('RECORD_QUEUE_SIZE', 1000))
+FLUSH_SIZE = int(os.environ.get('RECORD_FLUSH_SIZE', 50))
+FLUSH_INTERVAL = float(os.environ.get('RECORD_FLUSH_INTERVAL', 0.25))
+# Retries per batch on 'database is locked' before trying again next cycle
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05
+BUSY_TIMEOUT = 5.0
+
+
+def _is_lock_error(e):
+    return isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+
+
+class _Item:
+    __slots__ = ('params', 'done', 'ok')
+
+    def __init__(self, params, wait):
+        self.params = params
+        self.done = threading.Event() if wait else None
+        self.ok = False
+
+
+class WriteBehindWriter:
+    """
+    Background thread owning one SQLite connection. submit() never touches
+    the database unless the queue is full (then the caller writes directly,
+    so a stuck writer slows requests down instead of losing records).
+    """
+    def __init__(self, db_file=None, durability=DURABILITY, queue_size=QUEUE_SIZE,
+                 flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        if durability not in ('sync', 'batched', 'relaxed'):
+            raise ValueError(f"Unknown durability mode: {durability}")
+        self.db_file = db_file or database.DB_FILE
+        self.durability = durability
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.failed = 0
+        self._carry = []
+        # flush() waits for the processed count to catch up with the
+        # submitted count at the time it was called
+        self._submitted = 0
+        self._processed = 0
+        self._progress = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='record-writer', daemon=True)
+        self._thread.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=BUSY_TIMEOUT)
+        if self.durability == 'relaxed':
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+        else:
+            conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def submit(self, data_dict):
+        """
+        Queues one record (same dict as database.save_patient_record).
+        The timestamp is taken now, not when the batch is written.
+        Returns True once queued (or, in 'sync' mode, once committed), False
+        if the record was written directly or synchronously and that failed.
+        """
+        item = _Item(database.patient_params(data_dict), wait=self.durability == 'sync')
+        with self._progress:
+            self._submitted += 1
+        try:
+            self.queue.put(item, timeout=0.5)
+        except queue.Full:
+            print("Record queue full; writing directly.")
+            self._write_direct([item])
+            return item.ok
+        if item.done is not None:
+            item.done.wait()
+            return item.ok
+        return True
+
+    def flush(self, timeout=10.0):
+        """
+        Blocks until everything queued so far is committed (or timeout).
+        """
+        with self._progress:
+            target = self._submitted
+            return self._progress.wait_for(lambda: self._processed >= target, timeout)
+
+    def pending(self):
+        return self.queue.qsize() + len(self._carry)
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _write_direct(self, items):
+        # The caller is told about a failure, so nothing is kept for a retry
+        try:
+            conn = self._connect()
+            try:
+                if self._commit(conn, items):
+                    return True
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            print(f"DB Error: {e}")
+        self._discard(items)
+        return False
+
+    def _commit(self, conn, items):
+        # One transaction per batch; lock errors back off and retry
+        for attempt in range(LOCK_RETRIES):
+            try:
+                start = time.perf_counter()
+                with conn:
+                    database.insert_patient_rows(conn, [i.params for i in items])
+                observe('db.write_behind_batch', time.perf_counter() - start)
+                self.written += len(items)
+                for item in items:
+                    item.ok = True
+                self._release(items)
+                return True
+            except sqlite3.Error as e:
+                if not _is_lock_error(e):
+                    return self._commit_one_by_one(conn, items)
+                time.sleep(LOCK_BACKOFF * (2 ** attempt))
+        print(f"DB Error: database locked; {len(items)} records kept for the next flush")
+        return False
+
+    def _commit_one_by_one(self, conn, items):
+        # A bad row should not take the rest of its batch down with it
+        for item in items:
+            try:
+                with conn:
+                    database.insert_patient_rows(conn, [item.params])
+                self.written += 1
+                item.ok = True
+            except sqlite3.Error as e:
+                print(f"DB Error: {e}")
+                self.failed += 1
+        self._release(items)
+        return True
+
+    def _discard(self, items):
+        # Counted as processed so flush() does not wait for them
+        self.failed += len(items)
+        self._release(items)
+
+    def _release(self, items):
+        for item in items:
+            if item.done is not None:
+                item.done.set()
+        with self._progress:
+            self._processed += len(items)
+            self._progress.notify_all()
+
+    def _drain(self, first_wait):
+        batch = self._carry
+        self._carry = []
+        deadline = time.monotonic() + first_wait
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=max(remaining, 0)) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+            # Sync callers are waiting; don't hold their commit for the interval
+            if self.durability == 'sync':
+                deadline = min(deadline, time.monotonic())
+        return batch
+
+    def _run(self):
+        conn = self._connect()
+        try:
+            while True:
+                stopping = self._stop.is_set()
+                batch = self._drain(0 if stopping else self.flush_interval)
+                if batch and not self._commit(conn, batch):
+                    self._carry = batch
+                    if stopping:
+                        print(f"DB Error: {len(batch)} queued records could not be written at shutdown")
+                        self._carry = []
+                        self._discard(batch)
+                        break
+                if stopping and self.queue.empty() and not self._carry:
+                    break
+        finally:
+            conn.close()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """
+    Returns the process-wide writer, starting it on first use. It is flushed
+    at interpreter exit.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindWriter()
+                atexit.register(_writer.close)
+    return _writer
+
+
+def submit_patient_record(data_dict):
+    return get_writer().submit(data_dict)
+
+
+def flush(timeout=10.0):
+    """
+    Waits for queued records to reach the database, e.g. before listing them.
+    """
+    return _writer.flush(timeout) if _writer is not None else True
+
+
+def close(timeout=10.0):
+    """
+    Writes what is queued and stops the process-wide writer; the next
+    submit starts a new one (on the then-current database.DB_FILE).
+    """
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close(timeout)